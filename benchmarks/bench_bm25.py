@@ -0,0 +1,75 @@
+"""
+BM25Index over a synthetic tree the size of ICD9: build time, per-note search
+latency against a pure-Python term-at-a-time BM25, and how often the note's
+own code comes first (or in the top 10) compared with taking the first
+substring candidate, the ranking fallback before BM25 ordering.
+
+    python benchmarks/bench_bm25.py [n_notes]
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+from simple_icd9cm.icd9cm import ICD9
+from simple_icd9cm.lexical import BM25Index, tokenize
+from synthetic import write_codes
+
+
+def python_scores(index, text):
+    """BM25 with a Python loop over the same postings."""
+    scores = {}
+    for term, count in Counter(tokenize(text)).items():
+        t = index.vocabulary.get(term)
+        if t is None:
+            continue
+        for j in range(index.indptr[t], index.indptr[t + 1]):
+            doc = int(index.doc_ids[j])
+            scores[doc] = scores.get(doc, 0.0) + count * float(index.weights[j])
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:10]
+
+
+def main():
+    n_notes = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    with tempfile.TemporaryDirectory() as tmp:
+        icd9 = ICD9(write_codes(os.path.join(tmp, 'codes.json')))
+        start = time.perf_counter()
+        index = BM25Index(icd9.iter_leaves())
+        build = time.perf_counter() - start
+        rng = random.Random(0)
+        leaves = rng.sample(icd9.leaves, n_notes)
+        notes = [f"Patient seen in clinic. {leaf.description}. Follow up in two weeks." for leaf in leaves]
+        print(f"{len(index)} leaves, {len(index.vocabulary)} terms, {len(index.weights)} postings; "
+              f"built in {build * 1e3:.0f} ms")
+
+        for label, search in [('numpy bincount', lambda note: index.search(note, 10)),
+                              ('python loop', lambda note: python_scores(index, note))]:
+            times = []
+            for note in notes:
+                start = time.perf_counter()
+                search(note)
+                times.append(time.perf_counter() - start)
+            print(f"{label:15s} p50 {statistics.median(times) * 1e3:6.2f} ms  "
+                  f"p95 {statistics.quantiles(times, n=20)[-1] * 1e3:6.2f} ms per note")
+
+        top1 = top10 = first = 0
+        for leaf, note in zip(leaves, notes):
+            ranked = [code for code, _ in icd9.bm25_index.search(note, 10)]
+            # synthetic leaves can share a description; any of them counts
+            same = {other.code for other in icd9.leaves if other.description == leaf.description}
+            top1 += bool(ranked) and ranked[0] in same
+            top10 += bool(same.intersection(ranked))
+            found = icd9.substring_index.search(leaf.description.lower().split())
+            first += bool(found) and found[0] in same
+        print(f"note's code (or a leaf with its description) first: {top1 / n_notes:.0%} BM25, "
+              f"{first / n_notes:.0%} first substring candidate; in BM25 top 10: {top10 / n_notes:.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Ranking prompts with and without the candidate budget, on a synthetic tree
+where every keyword of a note is also a common word ("of", "unspecified").
+Reports candidates and prompt tokens before and after trimming, and how often
+the note's own code survives it, against keeping the first candidates that fit.
+
+    python benchmarks/bench_candidate_budget.py [n_notes] [context_window]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+from icd9_llm_tree_search.candidate_budget import count_message_tokens
+from icd9_llm_tree_search.tree_search import ICD9LLMTreeSearch
+from simple_icd9cm.icd9cm import ICD9
+from synthetic import write_codes
+
+
+def main():
+    n_notes = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    context_window = int(sys.argv[2]) if len(sys.argv) > 2 else 4096
+    with tempfile.TemporaryDirectory() as tmp:
+        searcher = ICD9LLMTreeSearch(api_key='mock', use_dspy_optimization=False, context_window=context_window)
+        searcher.icd9 = ICD9(write_codes(os.path.join(tmp, 'codes.json')))
+        budget = searcher.candidate_budget
+        limit = budget.context_window - budget.reserve
+        rng = random.Random(0)
+        leaves = rng.sample(searcher.icd9.leaves, n_notes)
+
+        over = kept_true = prefix_true = 0
+        elapsed = 0.0
+        for leaf in leaves:
+            note = f"Diagnosis: {leaf.description}."
+            keywords = leaf.description.lower().split()
+            codes = searcher.icd9.substring_index.search(keywords)
+            start = time.perf_counter()
+            kept, _ = searcher._budgeted_candidates(note, codes, keywords)
+            elapsed += time.perf_counter() - start
+            if len(kept) == len(codes):
+                continue
+            over += 1
+            kept_true += leaf.code in kept
+            # the naive alternative: the first candidates that fit
+            lines, room = searcher._candidate_lines(codes), limit - count_message_tokens(
+                searcher._ranking_messages(note, ""), budget.count_tokens)
+            prefix = []
+            for code, line in zip(codes, lines):
+                room -= budget.count_tokens(line) + 1
+                if room < 0:
+                    break
+                prefix.append(code)
+            prefix_true += leaf.code in prefix
+
+        stats = budget.stats
+        print(f"{n_notes} notes, context window {context_window}, {len(searcher.icd9.leaves)} leaves")
+        print(f"candidates per note: {stats['candidates'] / n_notes:7.0f} offered, "
+              f"{stats['dropped'] / n_notes:7.0f} dropped")
+        print(f"prompt tokens per note: {stats['prompt_tokens'] / n_notes:7.0f} full, "
+              f"{(stats['prompt_tokens'] - stats['tokens_saved']) / n_notes:7.0f} sent "
+              f"({stats['tokens_saved'] / n_notes:.0f} saved)")
+        print(f"{over} prompts over budget; note's code kept in {kept_true} by score, "
+              f"{prefix_true} by first-that-fit; {elapsed / n_notes * 1e3:.1f} ms per note")
+
+
+if __name__ == '__main__':
+    main()
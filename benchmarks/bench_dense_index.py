@@ -0,0 +1,75 @@
+"""
+DenseIndex over a synthetic tree the size of ICD9 with the offline hashed
+n-gram embedder: full build, memory-mapped open, incremental rebuild after 1%
+of the descriptions change, batched against one-note-at-a-time search, and
+recall on paraphrased notes (every word inflected, so no keyword is a
+substring of the description) against substring matching.
+
+    python benchmarks/bench_dense_index.py [n_notes]
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+from simple_icd9cm.icd9cm import ICD9
+from simple_icd9cm.vectorindex import DenseIndex, HashedNgramEmbedder
+from synthetic import make_hierarchies
+
+
+def inflect(word):
+    return word + ('es' if word.endswith(('s', 'x')) else 'ed' if word.endswith('e') else 's')
+
+
+def timed(f):
+    start = time.perf_counter()
+    result = f()
+    return result, time.perf_counter() - start
+
+
+def main():
+    n_notes = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    with tempfile.TemporaryDirectory() as tmp:
+        codes, path = os.path.join(tmp, 'codes.json'), os.path.join(tmp, 'leaves.npy')
+        hierarchies = make_hierarchies()
+        with open(codes, 'w') as f:
+            json.dump(hierarchies, f)
+        icd9 = ICD9(codes)
+        embedder = HashedNgramEmbedder()
+        index, build = timed(lambda: DenseIndex.open(path, embedder, codes, icd9))
+        print(f"{len(index)} leaves x {index.matrix.shape[1]} dims: built in {build * 1e3:.0f} ms")
+        _, reopen = timed(lambda: DenseIndex.open(path, HashedNgramEmbedder(), codes))
+        print(f"reopened (memory-mapped) in {reopen * 1e3:.1f} ms")
+
+        rng = random.Random(0)
+        for hierarchy in rng.sample(hierarchies, len(hierarchies) // 100):
+            hierarchy[-1]['descr'] += ' recurrent'
+        with open(codes, 'w') as f:
+            json.dump(hierarchies, f)
+        icd9 = ICD9(codes)
+        embedder = HashedNgramEmbedder()  # nothing cached from the first build
+        index, rebuild = timed(lambda: DenseIndex.open(path, embedder, codes, icd9))
+        print(f"after 1% of descriptions changed: rebuilt in {rebuild * 1e3:.0f} ms ({index.stats})")
+
+        leaves = rng.sample(icd9.leaves, n_notes)
+        notes = [' '.join(inflect(w) for w in leaf.description.lower().split()) for leaf in leaves]
+        batched, batch_time = timed(lambda: index.search(notes, 20))
+        _, loop_time = timed(lambda: [index.search([note], 20) for note in notes])
+        print(f"top-20 for {n_notes} notes: {batch_time * 1e3:.0f} ms batched, {loop_time * 1e3:.0f} ms one by one")
+
+        dense = substring = 0
+        for leaf, note, hits in zip(leaves, notes, batched):
+            same = {other.code for other in icd9.leaves if other.description == leaf.description}
+            dense += bool(same.intersection(code for code, _ in hits))
+            substring += bool(same.intersection(icd9.substring_index.search(note.split())))
+        print(f"paraphrased notes with their code among the candidates: {dense / n_notes:.0%} dense top 20, "
+              f"{substring / n_notes:.0%} substring matches")
+
+
+if __name__ == '__main__':
+    main()
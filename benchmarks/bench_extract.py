@@ -0,0 +1,82 @@
+"""
+Replay cached pages through the PyQuery handlers and through the compiled
+extractor (`scraper.extract.CompiledLevels`).
+
+`scraper/cache` stores the links of each page but not its HTML, so every page
+is rendered back into markup shaped like icd9cm.chrisendres.com (one
+`.lvlN` item per link, inside some page chrome).  Both paths must return the
+same links for every page; we report the time per page and how many pages
+round-trip to the cached links.
+
+    python benchmarks/bench_extract.py
+"""
+import contextlib
+import html
+import io
+import json
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+from scraper.pagecache import read_bdb_hash
+from scraper.scraper import Scraper, icd9_handlers
+
+HOST = 'http://icd9cm.chrisendres.com'
+CONTENTS = f'{HOST}/index.php?action=contents'
+CHROME = ''.join(f'<li class="nav"><a href="/index.php?page={i}">Menu item {i}</a></li>' for i in range(40))
+
+
+def render(links, depth):
+    """HTML for a page at `depth` listing `links` as level depth + 1 items."""
+    items = []
+    for n, link in enumerate(links, 1):
+        code, descr = link['code'] or '', (link.get('descr') or '').strip()
+        if depth == 0:
+            cls, text = 'chapter', f'{n}. {descr} ({code})'
+        elif depth == 1:
+            cls, text = 'section', f'{descr} ({code})'
+        else:
+            cls, text = 'dlvl', f'{code} {descr}'
+        anchor = f'<a href="{html.escape(link["href"])}">' if link['href'] else ''
+        items.append(f'<div class="lvl{depth + 1}">{anchor}<div class="{cls}">{html.escape(text)}</div>'
+                     f'{"</a>" if anchor else ""}</div>')
+    return (f'<!DOCTYPE html><html><head><title>ICD9</title></head><body>'
+            f'<ul class="menu">{CHROME}</ul><br><div id="content">{"".join(items)}</div>'
+            f'<p class="footer">&copy; footer</p></body></html>').encode()
+
+
+def load_pages():
+    cache = {key.decode(): json.loads(value) for key, value in read_bdb_hash(os.path.join(ROOT, 'scraper', 'cache'))}
+    pages, stack = [], [(CONTENTS, 0)]
+    while stack:
+        url, depth = stack.pop()
+        links = cache[url]
+        pages.append((render(links, depth), depth, links))
+        stack.extend((f'{HOST}/{link["href"]}', depth + 1) for link in links if link['href'])
+    return pages
+
+
+def timed(scraper, pages):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        out = [scraper.extract_links(page, depth) for page, depth, _ in pages]
+    return out, time.perf_counter() - start
+
+
+def main():
+    pages = load_pages()
+    handlers, t_handlers = timed(Scraper(icd9_handlers(), compiled=False), pages)
+    compiled, t_compiled = timed(Scraper(icd9_handlers()), pages)
+    assert compiled == handlers, 'compiled extraction differs from the handlers'
+    same = sum(links == cached for links, (_, _, cached) in zip(compiled, pages))
+    n = len(pages)
+    print(f'{n} pages, {same} round-trip to the cached links, outputs identical')
+    print(f'handlers: {t_handlers:6.2f} s  ({t_handlers / n * 1e3:.2f} ms/page)')
+    print(f'compiled: {t_compiled:6.2f} s  ({t_compiled / n * 1e3:.2f} ms/page)  {t_handlers / t_compiled:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Lookup cost of ICD9.find versus the recursive `search` walk as the tree grows.
+
+    python benchmarks/bench_find.py
+"""
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from icd9 import ICD9, Node
+from synthetic import make_hierarchies
+
+
+def build(hierarchies):
+    tree = ICD9.__new__(ICD9)
+    tree.depth2nodes = defaultdict(dict)
+    Node.__init__(tree, -1, 'ROOT')
+    tree.process(hierarchies)
+    return tree
+
+
+def per_call(fn, codes, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for code in codes:
+            fn(code)
+        best = min(best, time.perf_counter() - start)
+    return best / len(codes)
+
+
+def main():
+    print(f"{'nodes':>8} {'search walk (us)':>18} {'find (us)':>10} {'find_many (us)':>15}")
+    for n_categories in (100, 400, 1200, 4000):
+        tree = build(make_hierarchies(n_categories))
+        codes = [n.code for n in tree.leaves]
+        sample = random.Random(0).sample(codes, 200)
+        walk = per_call(lambda c: tree.search(c)[0], sample[:20], repeat=1)
+        find = per_call(tree.find, sample)
+        start = time.perf_counter()
+        tree.find_many(sample)
+        many = (time.perf_counter() - start) / len(sample)
+        n_nodes = sum(len(d) for d in tree.depth2nodes.values())
+        print(f"{n_nodes:>8} {walk * 1e6:>18.1f} {find * 1e6:>10.2f} {many * 1e6:>15.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Hierarchy queries on ICD10CM at full ICD-10-CM scale (~95k generated codes):
+the old scan-based get_children versus the indexed structure.
+
+    python benchmarks/bench_icd10cm.py
+"""
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from simple_icd10cm.icd10cm import ICD10CM
+
+
+def make_codes(n_categories=1900, seed=0):
+    """Category -> 4th character -> 5th character -> 7th character, ~95k unique rows."""
+    rng = random.Random(seed)
+    rows = []
+    letters = string.ascii_uppercase
+    for i in range(n_categories):
+        cat = f"{letters[i // 100 % 26]}{i % 100:02d}"
+        rows.append({"code": cat, "desc": f"Category {cat}"})
+        for a in '0123456789'[:rng.randint(3, 8)]:
+            sub = f"{cat}.{a}"
+            rows.append({"code": sub, "desc": f"Subcategory {sub}", "parent": cat})
+            for b in '0123456789'[:rng.choice([0, 3, 5])]:
+                code = f"{sub}{b}"
+                rows.append({"code": code, "desc": f"Code {code}", "parent": sub})
+                for c in 'ADS'[:rng.choice([0, 3, 3])]:
+                    rows.append({"code": f"{code}{c}", "desc": f"Code {code}{c}", "parent": code})
+    return rows
+
+
+def timed(fn, codes):
+    start = time.perf_counter()
+    for code in codes:
+        fn(code)
+    return (time.perf_counter() - start) / len(codes)
+
+
+def main():
+    rows = make_codes()
+    start = time.perf_counter()
+    cm = ICD10CM(rows)
+    build = time.perf_counter() - start
+    sample = random.Random(1).sample([row["code"] for row in rows], 500)
+    scan = timed(lambda c: [row["code"] for row in cm.data if row.get("parent") == c], sample[:20])
+    print(f"{len(rows)} codes, index built in {build * 1e3:.0f} ms")
+    print(f"get_children (scan):    {scan * 1e6:10.1f} us")
+    print(f"get_children (indexed): {timed(cm.get_children, sample) * 1e6:10.2f} us")
+    print(f"get_ancestors:          {timed(cm.get_ancestors, sample) * 1e6:10.2f} us")
+    print(f"get_descendants:        {timed(cm.get_descendants, sample) * 1e6:10.2f} us")
+    print(f"is_descendant:          {timed(lambda c: cm.is_descendant(c, c[:3]), sample) * 1e6:10.2f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Loading a full-size ICD-10-CM order file (~95k generated codes) into ICD10CM:
+
+    dicts   parse into a list of row dicts, then ICD10CM(data=rows)
+    stream  ICD10CM.from_order_file without the cache
+    cached  ICD10CM.from_order_file from its binary cache
+
+Each mode runs in a fresh interpreter; load time and peak traced memory come
+from separate runs, since tracemalloc slows allocation down.
+
+    python benchmarks/bench_icd10cm_load.py
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+CHILD = r'''
+import json, sys, time, tracemalloc
+sys.path.insert(0, {root!r})
+from simple_icd10cm.icd10cm import ICD10CM
+from simple_icd10cm import orderfile
+
+def load_dicts(path):
+    codes, descs, parents = orderfile.read_order_file(path)
+    rows = []
+    for code, desc, parent in zip(codes, descs, parents):
+        row = {{"code": code, "desc": desc}}
+        if parent:
+            row["parent"] = parent
+        rows.append(row)
+    del codes, descs, parents
+    return ICD10CM(rows)
+
+mode, path = {mode!r}, {path!r}
+if {trace!r}:
+    tracemalloc.start()
+start = time.perf_counter()
+if mode == 'dicts':
+    cm = load_dicts(path)
+else:
+    cm = ICD10CM.from_order_file(path, use_cache=(mode == 'cached'))
+elapsed = time.perf_counter() - start
+_, peak = tracemalloc.get_traced_memory()
+print(json.dumps({{'seconds': elapsed, 'peak': peak, 'codes': len(cm.get_all_codes())}}))
+'''
+
+
+def run_child(mode, path, trace):
+    code = CHILD.format(root=ROOT, mode=mode, path=path, trace=trace)
+    out = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True)
+    return json.loads(out.stdout)
+
+
+def write_order_file(path):
+    sys.path.insert(0, HERE)
+    from bench_icd10cm import make_codes
+    with open(path, 'w') as f:
+        for i, row in enumerate(make_codes(), 1):
+            raw = row["code"].replace('.', '')
+            long = f"{row['desc']}, unspecified site, initial encounter for closed injury"
+            f.write(f"{i:05d} {raw:<7} {int(len(raw) > 4)} {long[:60]:<60} {long}\n")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'icd10cm_order.txt')
+        write_order_file(path)
+        sys.path.insert(0, ROOT)
+        from simple_icd10cm.icd10cm import ICD10CM
+        ICD10CM.from_order_file(path)  # writes the cache
+        print(f"order file {os.path.getsize(path) / 2**20:.1f} MB, "
+              f"cache {os.path.getsize(path + '.cache') / 2**20:.1f} MB")
+        print(f"{'mode':>7} {'codes':>7} {'load (ms)':>10} {'peak (MB)':>10}")
+        for mode in ('dicts', 'stream', 'cached'):
+            r = run_child(mode, path, trace=False)
+            peak = run_child(mode, path, trace=True)['peak']
+            print(f"{mode:>7} {r['codes']:>7} {r['seconds'] * 1e3:>10.0f} {peak / 2**20:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Keyword extraction with and without KeywordBatcher, against a local mock
+endpoint whose answers take a fixed latency plus a cost per generated word,
+generating at most `slots` answers at once (0: unlimited).
+Reports throughput, requests sent and p50/p95 per-note latency.
+
+    python benchmarks/bench_keyword_batching.py [n_notes] [concurrency] [latency_ms] [slots]
+"""
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+from icd9_llm_tree_search.keyword_batching import KeywordBatcher
+from icd9_llm_tree_search.tree_search import ICD9LLMTreeSearch
+from simple_icd9cm.icd9cm import ICD9
+from bench_llm_batch import make_notes
+from mock_openai import MockOpenAI
+from synthetic import write_codes
+
+
+async def extract_all(notes, concurrency, extract):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(note):
+        async with semaphore:
+            start = time.perf_counter()
+            keywords = await extract(note)
+            latencies.append(time.perf_counter() - start)
+            return keywords
+
+    return await asyncio.gather(*(one(note) for note in notes)), latencies
+
+
+def run(searcher, notes, concurrency, batcher_options=None):
+    async def main():
+        client = searcher.make_async_client(concurrency)
+        try:
+            if batcher_options is None:
+                return await extract_all(notes, concurrency, lambda note: searcher._aextract_keywords(note, client))
+            batcher = KeywordBatcher(searcher, client, **batcher_options)
+            return await extract_all(notes, concurrency, batcher.extract)
+        finally:
+            await client.close()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        keywords, latencies = asyncio.run(main())
+        elapsed = time.perf_counter() - start
+    return keywords, latencies, elapsed
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1]
+
+
+def main():
+    n_notes = int(sys.argv[1]) if len(sys.argv) > 1 else 128
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    latency = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.2
+    slots = int(sys.argv[4]) if len(sys.argv) > 4 else 2
+    with tempfile.TemporaryDirectory() as tmp, MockOpenAI(latency, token_latency=0.002, slots=slots) as mock:
+        searcher = ICD9LLMTreeSearch(model_name='mock', api_key='mock', base_url=mock.base_url,
+                                     use_dspy_optimization=False)
+        searcher.icd9 = ICD9(write_codes(os.path.join(tmp, 'codes.json'), n_categories=300))
+        notes = make_notes(searcher.icd9, n_notes)
+        print(f"{n_notes} notes, {concurrency} in flight, {latency * 1e3:.0f} ms + 2 ms/word per request, "
+              f"{slots or 'unlimited'} server slots")
+
+        expected = None
+        for label, options in [('single-note calls', None),
+                               ('batched, window 10 ms', {'window': 0.01, 'max_notes': concurrency}),
+                               ('batched, window 50 ms', {'window': 0.05, 'max_notes': concurrency})]:
+            mock.requests = 0
+            keywords, latencies, elapsed = run(searcher, notes, concurrency, options)
+            if expected is None:
+                expected = keywords
+            assert keywords == expected, 'batched keywords differ'
+            print(f"{label:22s} {n_notes / elapsed:7.1f} notes/s  {mock.requests:4d} requests  "
+                  f"p50 {percentile(latencies, 50) * 1e3:6.0f} ms  p95 {percentile(latencies, 95) * 1e3:6.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
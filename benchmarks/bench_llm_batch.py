@@ -0,0 +1,58 @@
+"""
+Throughput of ICD9LLMTreeSearch.run_search_batch as concurrency grows,
+against a local mock endpoint with a fixed per-request latency.
+
+    python benchmarks/bench_llm_batch.py [n_notes] [latency_ms]
+"""
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+from icd9_llm_tree_search.tree_search import ICD9LLMTreeSearch
+from simple_icd9cm.icd9cm import ICD9
+from mock_openai import MockOpenAI
+from synthetic import write_codes
+
+
+def make_notes(tree, n, seed=0):
+    rng = random.Random(seed)
+    leaves = tree.leaves
+    return [f"Patient seen in clinic. {rng.choice(leaves).description}." for _ in range(n)]
+
+
+def main():
+    n_notes = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.05
+    with tempfile.TemporaryDirectory() as tmp, MockOpenAI(latency) as mock:
+        searcher = ICD9LLMTreeSearch(model_name='mock', api_key='mock', base_url=mock.base_url,
+                                     use_dspy_optimization=False)
+        searcher.icd9 = ICD9(write_codes(os.path.join(tmp, 'codes.json'), n_categories=300))
+        notes = make_notes(searcher.icd9, n_notes)
+        searcher.icd9.substring_index
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            expected = [searcher.run_search(note) for note in notes]
+            sequential = time.perf_counter() - start
+        print(f"{n_notes} notes, {latency * 1e3:.0f} ms per request")
+        print(f"run_search loop:       {n_notes / sequential:7.1f} notes/s")
+        for concurrency in (1, 2, 4, 8, 16, 32):
+            mock.max_active = 0
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                results = searcher.run_search_batch(notes, concurrency=concurrency)
+                elapsed = time.perf_counter() - start
+            assert results == expected, 'batch results differ from run_search'
+            print(f"batch concurrency {concurrency:2d}:  {n_notes / elapsed:7.1f} notes/s  "
+                  f"({n_notes / elapsed / (n_notes / sequential):4.1f}x, {mock.max_active} in flight)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Per-process memory of the object tree (`icd9cm.ICD9`) versus the
+struct-of-arrays backend (`compact.CompactICD9`) on an ICD9-sized tree.
+
+Each backend is loaded in a fresh interpreter; we report the RSS growth
+caused by loading and the bytes still held by Python objects afterwards
+(tracemalloc, after the parsed JSON has been released).
+
+    python benchmarks/bench_memory.py [n_categories]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+CHILD = r'''
+import gc, json, resource, sys, tracemalloc
+sys.path.insert(0, {root!r})
+from simple_icd9cm.icd9cm import ICD9
+from simple_icd9cm.compact import CompactICD9
+
+def rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+cls = {{'object': ICD9, 'compact': CompactICD9}}[{backend!r}]
+gc.collect()
+before = rss_kb()
+if {trace!r}:
+    tracemalloc.start()
+tree = cls({path!r})
+tree.leaves  # force any lazy indexes
+gc.collect()
+held, _ = tracemalloc.get_traced_memory()
+print(json.dumps({{'rss_kb': rss_kb() - before, 'held': held, 'nodes': sum(1 for _ in tree.walk())}}))
+'''
+
+
+def run_child(backend, path, trace):
+    code = CHILD.format(root=ROOT, backend=backend, path=path, trace=trace)
+    out = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True)
+    return json.loads(out.stdout)
+
+
+def measure(backend, path):
+    # tracemalloc inflates RSS, so the two numbers come from separate runs.
+    r = run_child(backend, path, trace=False)
+    r['held'] = run_child(backend, path, trace=True)['held']
+    return r
+
+
+def main():
+    sys.path.insert(0, HERE)
+    from synthetic import write_codes
+    n_categories = int(sys.argv[1]) if len(sys.argv) > 1 else 1200
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_codes(os.path.join(tmp, 'codes.json'), n_categories)
+        print(f"{'backend':>8} {'nodes':>7} {'RSS growth (MB)':>16} {'held (MB)':>10} {'bytes/node':>11}")
+        for backend in ('object', 'compact'):
+            r = measure(backend, path)
+            print(f"{backend:>8} {r['nodes']:>7} {r['rss_kb'] / 1024:>16.1f} "
+                  f"{r['held'] / 2**20:>10.2f} {r['held'] / r['nodes']:>11.0f}")
+
+
+if __name__ == '__main__':
+    main()
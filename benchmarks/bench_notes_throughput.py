@@ -0,0 +1,48 @@
+"""
+Throughput of ICD9.find_codes_for_notes as the worker count grows.
+
+    python benchmarks/bench_notes_throughput.py [n_notes]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+from simple_icd9cm.icd9cm import ICD9
+from synthetic import WORDS, write_codes
+
+
+def make_notes(tree, n, seed=0):
+    rng = random.Random(seed)
+    leaves = tree.leaves
+    for _ in range(n):
+        picked = '. '.join(rng.choice(leaves).description for _ in range(3))
+        filler = ' '.join(rng.choice(WORDS) for _ in range(200))
+        yield f"Patient seen in clinic. {picked}. {filler}."
+
+
+def main():
+    n_notes = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    with tempfile.TemporaryDirectory() as tmp:
+        tree = ICD9(write_codes(os.path.join(tmp, 'codes.json')))
+        start = time.perf_counter()
+        tree.matcher
+        print(f"matcher build: {time.perf_counter() - start:.2f} s")
+        base = None
+        for workers in (1, 2, 4, 8):
+            if workers > (os.cpu_count() or 1):
+                break
+            start = time.perf_counter()
+            matched = sum(len(r) for r in tree.find_codes_for_notes(
+                make_notes(tree, n_notes), workers=workers, chunksize=128))
+            rate = n_notes / (time.perf_counter() - start)
+            base = base or rate
+            print(f"workers={workers}: {rate:8.0f} notes/s ({rate / base:.1f}x), {matched} matches")
+
+
+if __name__ == '__main__':
+    main()
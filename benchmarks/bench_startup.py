@@ -0,0 +1,47 @@
+"""
+Startup cost of loading the ICD9 tree from codes.json versus a binary snapshot.
+
+    python benchmarks/bench_startup.py [n_categories]
+"""
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+from simple_icd9cm.compact import CompactICD9
+from simple_icd9cm.icd9cm import ICD9
+from simple_icd9cm.snapshot import build_snapshot
+from synthetic import write_codes
+
+
+def best_of(fn, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    n_categories = int(sys.argv[1]) if len(sys.argv) > 1 else 1200
+    with tempfile.TemporaryDirectory() as tmp:
+        codes = write_codes(os.path.join(tmp, 'codes.json'), n_categories)
+        snap = os.path.join(tmp, 'codes.snap')
+        build = best_of(lambda: build_snapshot(codes, snap), repeat=1)
+        rows = [
+            ('ICD9(codes.json)', lambda: ICD9(codes)),
+            ('CompactICD9(codes.json)', lambda: CompactICD9(codes)),
+            ('ICD9.from_snapshot', lambda: ICD9.from_snapshot(snap)),
+            ('CompactICD9.from_snapshot', lambda: CompactICD9.from_snapshot(snap)),
+        ]
+        print(f"snapshot build: {build * 1e3:.1f} ms, {os.path.getsize(snap) / 1024:.0f} KiB")
+        for name, fn in rows:
+            print(f"{name:>28}: {best_of(fn) * 1e3:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
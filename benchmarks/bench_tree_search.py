@@ -0,0 +1,69 @@
+"""
+LLM calls and latency of ICD9LLMTreeSearch.run_tree_search: unbounded
+depth-first expansion (every accepted node, one call at a time) against the
+beam-bounded search with level-parallel calls, on a synthetic tree and a local
+mock endpoint.  Each note is the chain of descriptions from a chapter down to
+a leaf; the mock accepts every code with at least half of its description's
+words in the note, so the true path is always accepted, along with false
+leads at every level.
+
+    python benchmarks/bench_tree_search.py [n_notes] [latency_ms]
+"""
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+from icd9_llm_tree_search.tree_search import ICD9LLMTreeSearch
+from simple_icd9cm.icd9cm import ICD9
+from mock_openai import MockOpenAI
+from synthetic import write_codes
+
+
+def path_note(leaf):
+    chain = []
+    node = leaf
+    while node.parent is not None:
+        chain.append(node.description)
+        node = node.parent
+    return '. '.join(reversed(chain)) + '.'
+
+
+def main():
+    n_notes = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.05
+    with tempfile.TemporaryDirectory() as tmp, MockOpenAI(latency) as mock:
+        icd9 = ICD9(write_codes(os.path.join(tmp, 'codes.json'), n_categories=300))
+        leaves = random.Random(0).sample(icd9.leaves, n_notes)
+        print(f"{n_notes} notes, {latency * 1e3:.0f} ms per request")
+        for label, beam_width, workers in [('unbounded DFS, sequential', None, 1),
+                                           ('unbounded, level-parallel', None, 8),
+                                           ('beam 3, sequential', 3, 1),
+                                           ('beam 3, level-parallel', 3, 8),
+                                           ('beam 1, level-parallel', 1, 8)]:
+            # a fresh searcher: nothing memoized from the previous configuration
+            searcher = ICD9LLMTreeSearch(model_name='mock', api_key='mock', base_url=mock.base_url,
+                                         use_dspy_optimization=False)
+            searcher.icd9 = icd9
+            calls = found = 0
+            elapsed = 0.0
+            for leaf in leaves:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    start = time.perf_counter()
+                    codes = searcher.run_tree_search(path_note(leaf), max_depth=7,
+                                                     beam_width=beam_width, workers=workers)
+                    elapsed += time.perf_counter() - start
+                calls += searcher.tree_search_report['calls']
+                found += leaf.code in codes
+            print(f"{label:27s} {calls / n_notes:6.1f} calls/note  {elapsed / n_notes * 1e3:6.0f} ms/note  "
+                  f"true leaf found {found}/{n_notes}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+A local OpenAI-compatible chat completions endpoint for benchmarks.
+
+Answers keyword-extraction requests with the words of the note's last
+sentence (as a JSON object per note number for batched requests), ranking
+requests with the first candidate code, and tree search decisions with Yes
+for every code with at least half of its description's words in the note.  Each answer takes `latency` seconds
+plus `token_latency` per word generated, and at most `slots` answers are
+generated at once (None: no limit), like a local inference server with a
+fixed number of parallel sequences.  A benchmark thus measures the client
+side: concurrency, connection reuse, request counts.
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+
+def keywords(note: str) -> List[str]:
+    last = [s for s in re.split(r'[.\n]', note) if s.strip()][-1]
+    return last.lower().split()
+
+
+def decisions(user: str) -> str:
+    note, task = user.split('[Case note]:', 1)[-1].split('[Task]:', 1)
+    words = set(re.findall(r'\w+', note.lower()))
+    lines = []
+    for code, descr in re.findall(r'^(\S+): (.+)$', task, re.MULTILINE):
+        descr_words = set(re.findall(r'\w+', descr.lower()))
+        relevant = 2 * len(descr_words & words) >= len(descr_words)
+        lines.append(f"{code}: {'Yes' if relevant else 'No'}")
+    return '\n'.join(lines)
+
+
+def reply(messages: List[Dict[str, Any]]) -> str:
+    system, user = messages[0]['content'], messages[-1]['content']
+    if 'decides' in system:
+        return decisions(user)
+    if 'keywords' in system:
+        notes = re.split(r'\[Case note \d+\]:', user.split('[Task]:', 1)[0])[1:]
+        if notes:
+            return json.dumps({str(i): keywords(note) for i, note in enumerate(notes, 1)})
+        note = user.split('[Case note]:', 1)[-1].split('[Task]:', 1)[0]
+        return ', '.join(keywords(note))
+    codes = re.findall(r'^(\S+): ', user.split('ICD-9 Codes:', 1)[-1], re.MULTILINE)
+    return codes[0] if codes else ''
+
+
+class MockOpenAI:
+    def __init__(self, latency: float = 0.05, reply=reply, token_latency: float = 0.0,
+                 slots: Optional[int] = None):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.slots = threading.Semaphore(slots) if slots else None
+        self.reply = reply
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with server.lock:
+                    server.requests += 1
+                    server.active += 1
+                    server.max_active = max(server.max_active, server.active)
+                try:
+                    status, content = 200, server.reply(body['messages'])
+                    if server.slots is not None:
+                        with server.slots:
+                            time.sleep(server.latency + server.token_latency * len(content.split()))
+                    else:
+                        time.sleep(server.latency + server.token_latency * len(content.split()))
+                except Exception as e:  # reported to the client as a bad request
+                    status, content = 400, str(e)
+                finally:
+                    with server.lock:
+                        server.active -= 1
+                if status == 200:
+                    data = {'id': f'mock-{server.requests}', 'object': 'chat.completion', 'created': 0,
+                            'model': body.get('model', 'mock'),
+                            'choices': [{'index': 0, 'finish_reason': 'stop',
+                                         'message': {'role': 'assistant', 'content': content}}],
+                            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}}
+                else:
+                    data = {'error': {'message': content, 'type': 'invalid_request_error'}}
+                out = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}/v1'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
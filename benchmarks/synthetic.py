@@ -0,0 +1,58 @@
+"""
+Synthetic ICD9-shaped hierarchies for benchmarks.
+
+`codes.json` is not shipped with the repo, so the benchmarks build trees with
+the same shape (chapter range -> section range -> category -> subcategory ->
+subclassification) at whatever size they need.
+"""
+import json
+import random
+from typing import Any, List
+
+WORDS = [
+    'acute', 'chronic', 'infection', 'fracture', 'closed', 'open', 'lung',
+    'heart', 'kidney', 'liver', 'tuberculosis', 'fibrosis', 'cholera',
+    'typhoid', 'fever', 'unspecified', 'other', 'specified', 'malignant',
+    'neoplasm', 'benign', 'disorder', 'syndrome', 'congenital', 'anomaly',
+    'injury', 'poisoning', 'hypertension', 'diabetes', 'mellitus', 'with',
+    'without', 'complication', 'of', 'and', 'due', 'to', 'left', 'right',
+]
+
+
+def description(rng: random.Random, n_words: int = 5) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(n_words)).capitalize()
+
+
+def make_hierarchies(n_categories: int = 1200, seed: int = 0) -> List[Any]:
+    """
+    Return a codes.json-style list of hierarchies.  ~1200 categories gives a
+    tree about the size of the real ICD9 code set (~17k nodes).
+    """
+    rng = random.Random(seed)
+    hierarchies = []
+    root = {'code': None}
+    per_section = 10
+    per_chapter = 100
+    for cat in range(n_categories):
+        chapter_start = cat // per_chapter * per_chapter
+        section_start = cat // per_section * per_section
+        chapter = {'code': f'{chapter_start:03d}-{chapter_start + per_chapter - 1:03d}',
+                   'descr': description(rng, 3)}
+        section = {'code': f'{section_start:03d}-{section_start + per_section - 1:03d}',
+                   'descr': description(rng, 3)}
+        category = {'code': f'{cat:03d}', 'descr': description(rng, 4)}
+        for sub in range(rng.randint(4, 8)):
+            subcategory = {'code': f'{cat:03d}.{sub}', 'descr': description(rng)}
+            n_leaves = rng.choice([0, 0, 3, 5])
+            if not n_leaves:
+                hierarchies.append([root, chapter, section, category, subcategory])
+            for leaf in range(n_leaves):
+                hierarchies.append([root, chapter, section, category, subcategory,
+                                    {'code': f'{cat:03d}.{sub}{leaf}', 'descr': description(rng)}])
+    return hierarchies
+
+
+def write_codes(path: str, n_categories: int = 1200, seed: int = 0) -> str:
+    with open(path, 'w') as f:
+        json.dump(make_hierarchies(n_categories, seed), f)
+    return path
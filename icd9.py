@@ -1,9 +1,13 @@
 import csv
 import json
 from collections import *
-from typing import List, Optional, Any
+from bisect import bisect_left
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Any
 
 class Node:
+    # Set by ICD9.get_node so lookups can use the tree-wide code index.
+    _tree: Optional['ICD9'] = None
+
     def __init__(self, depth: int, code: str, descr: Optional[str] = None):
         self.depth: int = depth
         self.descr: str = descr or code
@@ -24,11 +28,34 @@ class Node:
         return ret
 
     def find(self, code: str) -> Optional['Node']:
+        tree = self._tree
+        if tree is not None:
+            return tree.lookup(code, within=self)
         nodes = self.search(code)
         if nodes:
             return nodes[0]
         return None
 
+    def find_many(self, codes: Iterable[str]) -> List[Optional['Node']]:
+        return [self.find(code) for code in codes]
+
+    def has_descendant(self, node: 'Node') -> bool:
+        """True if `node` is in the subtree rooted here (including self)."""
+        tree = self._numbered()
+        if tree is not None and node._tree is tree:
+            return self._pre <= node._pre < self._post
+        while node is not None and node.depth > self.depth:
+            node = node.parent
+        return node is self
+
+    def _numbered(self) -> Optional['ICD9']:
+        """The owning tree with up-to-date interval numbering, if any."""
+        tree = self._tree
+        if tree is None:
+            return None
+        tree.number()
+        return tree
+
     @property
     def root(self) -> 'Node':
         return self.parents[0]
@@ -39,6 +66,9 @@ class Node:
 
     @property
     def codes(self) -> List[str]:
+        tree = self._numbered()
+        if tree is not None:
+            return tree._leaf_codes[self._leaf_lo:self._leaf_hi]
         return [n.code for n in self.leaves]
 
     @property
@@ -53,6 +83,9 @@ class Node:
 
     @property
     def leaves(self) -> List['Node']:
+        tree = self._numbered()
+        if tree is not None:
+            return tree._leaves[self._leaf_lo:self._leaf_hi]
         leaves = set()
         if not self.children:
             return [self]
@@ -61,8 +94,44 @@ class Node:
         return list(leaves)
 
     def leaves_at_depth(self, depth: int) -> List['Node']:
+        tree = self._numbered()
+        if tree is not None:
+            pres, nodes = tree._depth2leaves.get(depth, ([], []))
+            return nodes[bisect_left(pres, self._pre):bisect_left(pres, self._post)]
         return [n for n in self.leaves if n.depth == depth]
 
+    def iter_leaves(self) -> Iterator['Node']:
+        """Yield the leaves under this node in pre-order, without building a list."""
+        tree = self._numbered()
+        if tree is not None:
+            leaves = tree._leaves
+            for i in range(self._leaf_lo, self._leaf_hi):
+                yield leaves[i]
+            return
+        for node in self.walk():
+            if not node.children:
+                yield node
+
+    def walk(self, depth: Optional[int] = None) -> Iterator['Node']:
+        """
+        Yield this node and its descendants in pre-order.  With `depth`, nodes
+        deeper than that (absolute) depth are not visited.
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            if depth is None or node.depth < depth:
+                stack.extend(reversed(node.children))
+
+    @property
+    def subtree_size(self) -> int:
+        """Number of nodes in the subtree rooted here, including self."""
+        tree = self._numbered()
+        if tree is not None:
+            return self._post - self._pre
+        return sum(1 for _ in self.walk())
+
     @property
     def siblings(self) -> List['Node']:
         parent = self.parent
@@ -78,6 +147,12 @@ class Node:
 
 
 class ICD9(Node):
+    _code2node: Optional[Dict[str, Node]] = None
+    # Interval numbering, rebuilt by `number` after the tree changes.
+    _leaves: Optional[List[Node]] = None
+    _leaf_codes: List[str]
+    _depth2leaves: Dict[int, Tuple[List[int], List[Node]]]
+
     def __init__(self, codesfname: str):
         self.depth2nodes: dict[int, dict[str, Node]] = defaultdict(dict)
         super().__init__(-1, 'ROOT')
@@ -88,14 +163,88 @@ class ICD9(Node):
     def process(self, allcodes: Any) -> None:
         for hierarchy in allcodes:
             self.add(hierarchy)
+        self.number()
+
+    def number(self) -> None:
+        """
+        Assign each node its pre-order interval [_pre, _post) and the range
+        [_leaf_lo, _leaf_hi) of its leaves, which are laid out contiguously in
+        pre-order.  Subtree queries then become slices of `_leaves`.  No-op
+        unless the tree changed since the last call.
+        """
+        if self._leaves is not None:
+            return
+        leaves: List[Node] = []
+        depth2leaves: Dict[int, Tuple[List[int], List[Node]]] = {}
+        pre = 0
+        stack: List[Tuple[Node, bool]] = [(self, False)]
+        while stack:
+            node, done = stack.pop()
+            if done:
+                node._post = pre
+                node._leaf_hi = len(leaves)
+                continue
+            node._pre = pre
+            node._leaf_lo = len(leaves)
+            pre += 1
+            if not node.children:
+                leaves.append(node)
+                pres, nodes = depth2leaves.setdefault(node.depth, ([], []))
+                pres.append(node._pre)
+                nodes.append(node)
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node.children))
+        self._leaf_codes = [n.code for n in leaves]
+        self._depth2leaves = depth2leaves
+        self._leaves = leaves
+
+    @property
+    def _tree(self) -> 'ICD9':
+        return self
+
+    @property
+    def code2node(self) -> Dict[str, Node]:
+        """
+        Hash index from code to node, built lazily from `depth2nodes`.
+        A code present at several depths maps to its shallowest node.
+        """
+        if self._code2node is None:
+            index: Dict[str, Node] = {}
+            for depth in sorted(self.depth2nodes):
+                for code, node in self.depth2nodes[depth].items():
+                    index.setdefault(code, node)
+            self._code2node = index
+        return self._code2node
+
+    def lookup(self, code: str, within: Optional[Node] = None) -> Optional[Node]:
+        """
+        Exact-code lookup through the index.  With `within`, only nodes in
+        that subtree are returned.
+        """
+        if within is None:
+            within = self
+        if code == within.code:
+            return within
+        node = self.code2node.get(code)
+        if node is None or within is self or within.has_descendant(node):
+            return node
+        for depth, nodes in self.depth2nodes.items():
+            if depth > within.depth:
+                node = nodes.get(code)
+                if node is not None and within.has_descendant(node):
+                    return node
+        return None
 
     def get_node(self, depth: int, code: str, descr: str) -> Node:
         d = self.depth2nodes[depth]
         if code not in d:
-            d[code] = Node(depth, code, descr)
+            node = d[code] = Node(depth, code, descr)
+            node._tree = self
+            self._code2node = None
         return d[code]
 
     def add(self, hierarchy: Any) -> None:
+        self._leaves = None
         prev_node = self
         for depth, link in enumerate(hierarchy):
             if not link['code']:
@@ -103,8 +252,10 @@ class ICD9(Node):
             code = link['code']
             descr = link['descr'] if 'descr' in link else code
             node = self.get_node(depth, code, descr)
-            node.parent = prev_node
-            prev_node.add_child(node)
+            # Skip the linear membership check when the edge already exists.
+            if node.parent is not prev_node:
+                node.parent = prev_node
+                prev_node.add_child(node)
             prev_node = node
 
 
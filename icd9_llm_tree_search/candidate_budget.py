@@ -0,0 +1,157 @@
+"""
+Token-budgeted candidate selection for the ranking prompt.
+
+Pass 2 of `ICD9LLMTreeSearch.run_search` returns every leaf whose description
+contains one of the note's keywords, so a common keyword ("unspecified",
+"other") yields thousands of candidates and a ranking prompt longer than the
+model's context window, which the server rejects.  `CandidateBudget` counts
+the ranking prompt's tokens locally and, when it would not fit in
+`context_window` less `reserve` tokens (the answer, and the instructions DSPy
+adds around the fields), keeps as many of the best-scoring candidates as fit,
+in their original order.  Prompts that fit are left untouched.
+
+Candidates are scored by `score_candidates`: keyword coverage, each keyword
+weighted by how few candidates contain it, plus a bonus for specific
+descriptions (no "unspecified" or "not elsewhere classified", most of their
+words covered by the keywords).
+"""
+import functools
+import math
+import re
+import threading
+from collections import Counter
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from .keyword_batching import approx_tokens
+
+# Wording of the residual ("wastebasket") categories of ICD-9.
+RESIDUAL_RE = re.compile(r'\b(?:unspecified|not elsewhere classified|nec|nos|other specified)\b')
+WORD_RE = re.compile(r'[a-z0-9]+')
+
+# Tokens the chat format adds per message, and to prime the answer.
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+
+# Assumed for models not in CONTEXT_WINDOWS, such as local ones served
+# with a small context (LM Studio's default is 4096).
+DEFAULT_CONTEXT_WINDOW = 4096
+
+# Context windows (tokens) of hosted models, by model name or name prefix
+# before a '-'; the longest match wins.
+CONTEXT_WINDOWS = {
+    'gpt-3.5-turbo': 16385,
+    'gpt-3.5-turbo-instruct': 4096,
+    'gpt-4': 8192,
+    'gpt-4-32k': 32768,
+    'gpt-4-turbo': 128000,
+    'gpt-4-1106': 128000,
+    'gpt-4-0125': 128000,
+    'gpt-4o': 128000,
+    'gpt-4.1': 1047576,
+    'o1': 200000,
+    'o3': 200000,
+    'o4-mini': 200000,
+}
+
+
+def context_window_for(model_name: str) -> Optional[int]:
+    """The context window of `model_name` if it is a known hosted model, else None."""
+    name = model_name.rsplit('/', 1)[-1].lower()
+    known = [prefix for prefix in CONTEXT_WINDOWS if name == prefix or name.startswith(prefix + '-')]
+    return CONTEXT_WINDOWS[max(known, key=len)] if known else None
+
+
+@functools.lru_cache(maxsize=None)
+def _load_counter(model_name: str) -> Callable[[str], int]:
+    try:
+        import tiktoken
+        try:
+            encoding = tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            encoding = tiktoken.get_encoding('cl100k_base')
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception:
+        return approx_tokens
+
+
+def token_counter(model_name: str) -> Callable[[str], int]:
+    """
+    A function counting the tokens of a text for `model_name`: its tiktoken
+    encoding, cl100k_base for models tiktoken does not know (local models;
+    an estimate of their own tokenizer, which `reserve` leaves room for), or
+    `approx_tokens` without tiktoken or its encoding files.  The encoding is
+    loaded on the first count.
+    """
+    def count_tokens(text: str) -> int:
+        return _load_counter(model_name)(text)
+    return count_tokens
+
+
+def count_message_tokens(messages: Sequence[dict], count_tokens: Callable[[str], int]) -> int:
+    """Prompt tokens of a chat request."""
+    return sum(MESSAGE_OVERHEAD + count_tokens(m['content']) for m in messages) + REPLY_OVERHEAD
+
+
+def score_candidates(keywords: Sequence[str], descriptions: Sequence[str]) -> List[float]:
+    """Relevance of each description to `keywords`; higher is better."""
+    keywords = [k for k in dict.fromkeys(k.strip().lower() for k in keywords) if k]
+    lowered = [d.lower() for d in descriptions]
+    df = Counter(k for d in lowered for k in keywords if k in d)
+    weight = {k: math.log(1 + len(lowered) / df[k]) for k in df}
+    covering = {}  # matched keywords -> (their weight, their words)
+    scores = []
+    for d in lowered:
+        matched = tuple(k for k in keywords if k in d)
+        if matched not in covering:
+            covering[matched] = (sum(weight[k] for k in matched), set(WORD_RE.findall(' '.join(matched))))
+        coverage, matched_words = covering[matched]
+        words = WORD_RE.findall(d)
+        covered = sum(map(matched_words.__contains__, words)) / len(words) if words else 0.0
+        specific = 0.0 if RESIDUAL_RE.search(d) else 0.5
+        scores.append(coverage + 0.5 * covered + specific)
+    return scores
+
+
+class CandidateBudget:
+    def __init__(self, count_tokens: Callable[[str], int], context_window: int = 4096, reserve: int = 512):
+        self.count_tokens = count_tokens
+        self.context_window = context_window
+        self.reserve = reserve
+        # calls: rankings budgeted; trimmed: those that dropped candidates;
+        # candidates/dropped: candidates offered and left out; prompt_tokens:
+        # tokens of the full prompts; tokens_saved: tokens the trimming removed
+        self.stats: Counter = Counter()
+        # async searches budget their prompts on worker threads
+        self.lock = threading.Lock()
+
+    def _count(self, **deltas: int) -> None:
+        with self.lock:
+            self.stats.update(deltas)
+
+    def select(self, codes: List[str], lines: List[str], keywords: Optional[Sequence[str]],
+               messages_for: Callable[[str], List[dict]]) -> Tuple[List[str], List[str]]:
+        """
+        The candidates (codes and their prompt lines) to rank.  `messages_for`
+        builds the ranking request from a candidate list; `keywords` are those
+        the candidates were found with.
+        """
+        limit = self.context_window - self.reserve
+        full = count_message_tokens(messages_for("\n".join(lines)), self.count_tokens)
+        self._count(calls=1, candidates=len(codes), prompt_tokens=full)
+        if full <= limit:
+            return codes, lines
+
+        room = limit - count_message_tokens(messages_for(""), self.count_tokens)
+        scores = score_candidates(keywords or [], [line.split(': ', 1)[-1] for line in lines])
+        keep = []
+        for i in sorted(range(len(codes)), key=lambda i: -scores[i]):
+            cost = self.count_tokens(lines[i]) + 1  # and its newline
+            if cost > room and keep:
+                break
+            keep.append(i)
+            room -= cost
+        keep.sort()
+        codes, lines = [codes[i] for i in keep], [lines[i] for i in keep]
+        self._count(trimmed=1, dropped=len(scores) - len(keep),
+                    tokens_saved=full - count_message_tokens(messages_for("\n".join(lines)), self.count_tokens))
+        return codes, lines
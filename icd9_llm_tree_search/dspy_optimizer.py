@@ -4,7 +4,7 @@ import dspy
 from typing import List, Dict, Any
 import json
 import random
-from simple_icd9cm.icd9cm import ICD9
+from simple_icd9cm.registry import shared_icd9
 
 
 class RankingSignature(dspy.Signature):
@@ -27,21 +27,17 @@ class DSPyMedicalCoder(dspy.Module):
         super().__init__()
         self.keyword_extractor = dspy.Predict(KeywordExtractionSignature)
         self.code_ranker = dspy.Predict(RankingSignature)
-        self.icd9 = ICD9()
+        self.icd9 = shared_icd9()
     
     def forward(self, clinical_note: str, candidate_codes: List[str]) -> str:
         """Forward pass through the medical coding pipeline"""
         
         # Format candidate codes with descriptions
         code_descriptions = []
-        for code in candidate_codes:
-            try:
-                node = self.icd9.find(code)
-                if node:
-                    code_descriptions.append(f"{code}: {node.description}")
-                else:
-                    code_descriptions.append(f"{code}: Unknown description")
-            except:
+        for code, node in zip(candidate_codes, self.icd9.find_many(candidate_codes)):
+            if node:
+                code_descriptions.append(f"{code}: {node.description}")
+            else:
                 code_descriptions.append(f"{code}: Unknown description")
         
         candidate_codes_str = "\n".join(code_descriptions)
@@ -70,7 +66,7 @@ class DSPyOptimizerManager:
     def __init__(self, lm_studio_url="http://localhost:1234/v1", model_name="medgemma"):
         self.lm_studio_url = lm_studio_url
         self.model_name = model_name
-        self.icd9 = ICD9()
+        self.icd9 = shared_icd9()
         self.medical_coder = None
         self.optimized_coder = None
         
@@ -0,0 +1,174 @@
+"""
+Micro-batched keyword extraction.
+
+Pass 1 of `ICD9LLMTreeSearch.run_search` sends one chat completion per note;
+for short notes the system prompt, the instructions and the round trip cost
+more than the note itself.  `KeywordBatcher.extract(note)` instead queues the
+note and waits: notes that arrive within `window` seconds of the first one,
+up to `max_notes` notes and `max_prompt_tokens` tokens of note text, go out
+together as one `keyword_extraction_batch` request asking for a JSON object
+of keyword lists keyed by note number.
+
+The answer is split back per note.  If the request fails or its answer does
+not parse, the notes it left without keywords fall back to ordinary
+single-note calls, so batching never changes which notes get keywords.
+"""
+import asyncio
+import json
+import re
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .prompt_templates import KEYWORD_SYSTEM_PROMPT, prompt_template_dict
+
+
+def approx_tokens(text: str) -> int:
+    """Rough token count: about four characters per token."""
+    return len(text) // 4 + 1
+
+
+def parse_batch_keywords(llm_output: str, n_notes: int) -> Dict[int, List[str]]:
+    """
+    Keyword lists by 0-based note index from a batch answer; notes missing
+    from it, or given something other than a list or string, are left out.
+    An answer that is not a string (no content) parses to nothing.
+    """
+    if not isinstance(llm_output, str):
+        return {}
+    text = llm_output.strip()
+    # Tolerate a fenced code block or prose around the object.
+    start, end = text.find('{'), text.rfind('}')
+    if start < 0 or end < start:
+        return {}
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    found = {}
+    for key, value in data.items():
+        match = re.search(r'\d+', str(key))
+        if not match or not 1 <= int(match.group()) <= n_notes:
+            continue
+        if isinstance(value, str):
+            value = value.split(',')
+        if not isinstance(value, list):
+            continue
+        found[int(match.group()) - 1] = [str(k).replace('"', '').strip().lower() for k in value]
+    return found
+
+
+class KeywordBatcher:
+    def __init__(self, searcher: Any, client: Any, window: float = 0.02, max_notes: int = 16,
+                 max_prompt_tokens: int = 3000, count_tokens: Callable[[str], int] = approx_tokens):
+        self.searcher = searcher
+        self.client = client
+        self.window = window
+        self.max_notes = max_notes
+        self.max_prompt_tokens = max_prompt_tokens
+        self.count_tokens = count_tokens
+        self.template = prompt_template_dict["keyword_extraction_batch"]
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._pending_tokens = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+        # requests: chat completions sent; batches/batched_notes: multi-note
+        # requests and the notes they carried; single: one-note requests;
+        # fallbacks: notes re-sent alone after a batch failed them
+        self.stats: Counter = Counter()
+        self.latencies: List[float] = []
+
+    async def extract(self, note: str) -> List[str]:
+        """Keywords of `note`, extracted together with the notes queued alongside it."""
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        tokens = self.count_tokens(note)
+        if self._pending and self._pending_tokens + tokens > self.max_prompt_tokens:
+            self._flush()
+        future = loop.create_future()
+        self._pending.append((note, future))
+        self._pending_tokens += tokens
+        if len(self._pending) >= self.max_notes:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        try:
+            return await future
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._pending_tokens = self._pending, [], 0
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            # keep a reference until it is done
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        # Nothing awaits this task: whatever goes wrong must reach the
+        # futures, or their callers wait forever.
+        try:
+            await self._resolve(batch)
+        except BaseException as e:
+            for _, future in batch:
+                if future.done():
+                    continue
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+
+    async def _resolve(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        notes = [note for note, _ in batch]
+        found: Dict[int, List[str]] = {}
+        if len(notes) > 1:
+            found = await self._request_batch(notes)
+        missing = [i for i in range(len(notes)) if i not in found]
+        if len(notes) > 1:
+            self.stats['fallbacks'] += len(missing)
+        results = await asyncio.gather(*(self._request_single(notes[i]) for i in missing), return_exceptions=True)
+        found.update(zip(missing, results))
+        for i, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if isinstance(found[i], BaseException):
+                future.set_exception(found[i])
+            else:
+                future.set_result(found[i])
+
+    async def _request_single(self, note: str) -> List[str]:
+        self.stats['requests'] += 1
+        self.stats['single'] += 1
+        return await self.searcher._aextract_keywords(note, self.client)
+
+    async def _request_batch(self, notes: List[str]) -> Dict[int, List[str]]:
+        numbered = "\n\n".join(f"[Case note {i}]:\n{note}" for i, note in enumerate(notes, 1))
+        messages = [
+            {"role": "system", "content": KEYWORD_SYSTEM_PROMPT},
+            {"role": "user", "content": self.template.format(notes=numbered)}
+        ]
+        self.stats['requests'] += 1
+        self.stats['batches'] += 1
+        self.stats['batched_notes'] += len(notes)
+        try:
+            response = await self.client.chat.completions.create(
+                model=self.searcher.model_name,
+                messages=messages,
+                temperature=0.0,
+                max_tokens=100 * len(notes)
+            )
+            answer = response.choices[0].message.content
+        except Exception as e:
+            print(f"Batched keyword extraction failed: {e}, falling back to single notes")
+            return {}
+        found = parse_batch_keywords(answer, len(notes))
+        print(f"DEBUG: Extracted Keywords for {len(found)}/{len(notes)} batched notes")
+        return found
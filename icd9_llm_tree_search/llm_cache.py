@@ -0,0 +1,260 @@
+"""
+Persistent cache of LLM responses.
+
+Keyword extraction and ranking run at temperature 0, so the same prompt to
+the same model gives the same answer; re-running an evaluation or recoding a
+note should not pay for the call again.  `LLMCache` stores responses in one
+SQLite table in WAL mode, so any number of processes can share the file.
+Entries are keyed on a hash of the model, the messages and every sampling
+parameter, and are bounded by
+
+* `ttl`: seconds an entry stays valid after it was stored;
+* `max_entries` / `max_bytes`: least recently used entries are evicted
+  beyond these.
+
+Wrappers put it in front of the clients `ICD9LLMTreeSearch` uses:
+`CachedChatClient` (and `CachedAsyncChatClient`) for
+`client.chat.completions.create`, and `CachedLM`, a `dspy.BaseLM` wrapping
+the `dspy.LM` configured by `_setup_dspy`.  Only deterministic requests
+(temperature 0) are cached.
+"""
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Optional
+
+import dspy
+
+
+def cache_key(model: str, messages: Any, **params: Any) -> str:
+    """Hash of the request: model, messages (or prompt) and sampling parameters."""
+    request = json.dumps({'model': model, 'messages': messages, 'params': params},
+                         sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path: str, ttl: Optional[float] = None, max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None, clock: Callable[[], float] = time.time):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+        # hits and misses of lookups, entries dropped for age or for space
+        self.stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0}
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, model TEXT, '
+                          'response TEXT NOT NULL, size INTEGER NOT NULL, created REAL NOT NULL, '
+                          'accessed REAL NOT NULL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self.conn.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        """The stored response for `key` (decoded JSON), or None on a miss."""
+        now = self.clock()
+        with self.lock:
+            row = self.conn.execute('SELECT response, created FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] >= self.ttl:
+                self.conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self.conn.commit()
+                self.stats['expired'] += 1
+                row = None
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            self.conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+            self.conn.commit()
+            self.stats['hits'] += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, response: Any, model: Optional[str] = None) -> None:
+        data = json.dumps(response)
+        now = self.clock()
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                              (key, model, data, len(data), now, now))
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self) -> None:
+        if self.ttl is not None:
+            cur = self.conn.execute('DELETE FROM responses WHERE created <= ?', (self.clock() - self.ttl,))
+            self.stats['expired'] += cur.rowcount
+        count, size = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        over_entries = count - self.max_entries if self.max_entries is not None else 0
+        over_bytes = size - self.max_bytes if self.max_bytes is not None else 0
+        if over_entries <= 0 and over_bytes <= 0:
+            return
+        doomed = []
+        for key, entry_size in self.conn.execute('SELECT key, size FROM responses ORDER BY accessed'):
+            if over_entries <= 0 and over_bytes <= 0:
+                break
+            doomed.append((key,))
+            over_entries -= 1
+            over_bytes -= entry_size
+        self.conn.executemany('DELETE FROM responses WHERE key = ?', doomed)
+        self.stats['evicted'] += len(doomed)
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.conn.execute('DELETE FROM responses')
+            self.conn.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def _deterministic(params: Dict[str, Any]) -> bool:
+    return params.get('temperature', 1.0) == 0 and params.get('n', 1) == 1
+
+
+def _namespace(value: Any) -> Any:
+    if isinstance(value, dict):
+        return SimpleNamespace(**{k: _namespace(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [_namespace(v) for v in value]
+    return value
+
+
+def _completion(data: Dict[str, Any]) -> Any:
+    """A cached chat completion, as the openai type when it is importable."""
+    try:
+        from openai.types.chat import ChatCompletion
+        return ChatCompletion.model_validate(data)
+    except Exception:
+        return _namespace(data)
+
+
+class _Completions:
+    def __init__(self, completions: Any, cache: LLMCache):
+        self._completions = completions
+        self._cache = cache
+
+    def _key(self, kwargs: Dict[str, Any]) -> Optional[str]:
+        if kwargs.get('stream') or not _deterministic(kwargs):
+            return None
+        params = {k: v for k, v in kwargs.items() if k not in ('model', 'messages')}
+        return cache_key(kwargs.get('model'), kwargs.get('messages'), **params)
+
+    def _store(self, key: str, response: Any, model: Optional[str]) -> None:
+        data = response.model_dump(mode='json') if hasattr(response, 'model_dump') else response
+        self._cache.put(key, data, model)
+
+    def create(self, **kwargs: Any) -> Any:
+        key = self._key(kwargs)
+        if key is None:
+            return self._completions.create(**kwargs)
+        data = self._cache.get(key)
+        if data is not None:
+            return _completion(data)
+        response = self._completions.create(**kwargs)
+        self._store(key, response, kwargs.get('model'))
+        return response
+
+
+class _AsyncCompletions(_Completions):
+    # SQLite calls block; they run in a thread so the event loop keeps serving other requests.
+    async def create(self, **kwargs: Any) -> Any:
+        key = self._key(kwargs)
+        if key is None:
+            return await self._completions.create(**kwargs)
+        data = await asyncio.to_thread(self._cache.get, key)
+        if data is not None:
+            return _completion(data)
+        response = await self._completions.create(**kwargs)
+        await asyncio.to_thread(self._store, key, response, kwargs.get('model'))
+        return response
+
+
+class CachedChatClient:
+    """An OpenAI(-compatible) client whose `chat.completions.create` goes through `cache`."""
+
+    def __init__(self, client: Any, cache: LLMCache):
+        self._client = client
+        self.cache = cache
+        self.chat = SimpleNamespace(completions=_Completions(client.chat.completions, cache))
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._client, name)
+
+
+class CachedAsyncChatClient(CachedChatClient):
+    """`CachedChatClient` for an `openai.AsyncOpenAI` client."""
+
+    def __init__(self, client: Any, cache: LLMCache):
+        self._client = client
+        self.cache = cache
+        self.chat = SimpleNamespace(completions=_AsyncCompletions(client.chat.completions, cache))
+
+
+class CachedLM(dspy.BaseLM):
+    """
+    A `dspy.BaseLM` in front of a `dspy.LM`: DSPy modules call `forward` /
+    `aforward`, which answer from `cache` before calling the wrapped LM's.
+    The key covers the LM's model and default kwargs as well as the per-call
+    ones.
+    """
+
+    def __init__(self, lm: Any, cache: LLMCache):
+        super().__init__(lm.model, model_type=getattr(lm, 'model_type', 'chat'), cache=False, num_retries=0)
+        self.lm = lm
+        # BaseLM.cache is DSPy's own cache flag
+        self.llm_cache = cache
+        self.kwargs = lm.kwargs
+        self.history = lm.history
+
+    def _key(self, prompt: Optional[str], messages: Optional[Any], kwargs: Dict[str, Any]) -> Optional[str]:
+        params = {k: v for k, v in {**self.kwargs, **kwargs}.items() if k != 'cache'}
+        if not _deterministic(params):
+            return None
+        return cache_key(self.model, messages if messages is not None else prompt, **params)
+
+    def _store(self, key: str, response: Any) -> None:
+        data = response.model_dump(mode='json') if hasattr(response, 'model_dump') else response
+        self.llm_cache.put(key, data, self.model)
+
+    @staticmethod
+    def _hit(data: Dict[str, Any]) -> Dict[str, Any]:
+        # a cached answer costs nothing: keep it out of DSPy's usage tracking
+        return {**data, 'usage': {}}
+
+    def forward(self, prompt: Optional[str] = None, messages: Optional[Any] = None, **kwargs: Any) -> Any:
+        key = self._key(prompt, messages, kwargs)
+        if key is None:
+            return self.lm.forward(prompt=prompt, messages=messages, **kwargs)
+        data = self.llm_cache.get(key)
+        if data is not None:
+            return self._hit(data)
+        response = self.lm.forward(prompt=prompt, messages=messages, **kwargs)
+        self._store(key, response)
+        return response
+
+    async def aforward(self, prompt: Optional[str] = None, messages: Optional[Any] = None, **kwargs: Any) -> Any:
+        key = self._key(prompt, messages, kwargs)
+        if key is None:
+            return await self.lm.aforward(prompt=prompt, messages=messages, **kwargs)
+        data = await asyncio.to_thread(self.llm_cache.get, key)
+        if data is not None:
+            return self._hit(data)
+        response = await self.lm.aforward(prompt=prompt, messages=messages, **kwargs)
+        await asyncio.to_thread(self._store, key, response)
+        return response
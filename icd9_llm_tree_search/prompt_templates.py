@@ -1,9 +1,21 @@
+KEYWORD_SYSTEM_PROMPT = "You are a medical coding assistant that extracts keywords from a clinical note."
+RANKING_SYSTEM_PROMPT = "You are a medical coding assistant that ranks ICD-9 codes."
+DECISION_SYSTEM_PROMPT = "You are a medical coding assistant that decides which ICD-9 codes are relevant to a clinical note."
+# Appended to the tree search templates below so the answer can be parsed per code.
+DECISION_FORMAT = 'Answer with one line per code, in the form "<code>: Yes" or "<code>: No".'
+
 prompt_template_dict = {
     "keyword_extraction": '''[Case note]:
 {note}
 
 [Task]:
 From the case note above, extract the most important medical keywords. Break down compound terms into individual words. List the single keywords separated by commas. For example, for "tuberculous fibrosis of lung", you should extract "tuberculosis, fibrosis, lung".
+''',
+    "keyword_extraction_batch": '''{notes}
+
+[Task]:
+For each numbered case note above, extract the most important medical keywords. Break down compound terms into individual words. For example, for "tuberculous fibrosis of lung", you should extract "tuberculosis, fibrosis, lung".
+Answer with only a JSON object mapping each note number to its list of single keywords, for example {{"1": ["cholera"], "2": ["tuberculosis", "fibrosis", "lung"]}}.
 ''',
     "gpt-3.5-turbo": '''[Case note]:
 {note}
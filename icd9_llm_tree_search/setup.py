@@ -10,6 +10,7 @@ setup(
     install_requires=[
         'openai',
         'simple_icd9cm',
+        'numpy',
     ],
     include_package_data=True,
 ) 
\ No newline at end of file
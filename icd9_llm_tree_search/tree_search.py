@@ -1,9 +1,19 @@
-import openai
-from simple_icd9cm.icd9cm import ICD9
-from .prompt_templates import prompt_template_dict
+import asyncio
 import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import openai
+from simple_icd9cm.lexical import tokenize
+from simple_icd9cm.registry import shared_icd9
+from .prompt_templates import (DECISION_FORMAT, DECISION_SYSTEM_PROMPT, KEYWORD_SYSTEM_PROMPT,
+                               RANKING_SYSTEM_PROMPT, prompt_template_dict)
+from .llm_cache import CachedAsyncChatClient, CachedChatClient, CachedLM, LLMCache
+from .keyword_batching import KeywordBatcher
+from .candidate_budget import DEFAULT_CONTEXT_WINDOW, CandidateBudget, context_window_for, token_counter
 import dspy
-from typing import Optional
+from typing import Iterable, Optional, Union
 
 class RankingSignature(dspy.Signature):
     """Rank ICD-9 codes based on clinical note relevance"""
@@ -13,19 +23,58 @@ class RankingSignature(dspy.Signature):
 
 
 class ICD9LLMTreeSearch:
-    def __init__(self, model_name="gpt-3.5-turbo", api_key=None, base_url=None, use_dspy_optimization=True):
+    def __init__(self, model_name="gpt-3.5-turbo", api_key=None, base_url=None, use_dspy_optimization=True,
+                 llm_cache: Optional[Union[str, LLMCache]] = None, context_window: Optional[int] = None,
+                 lexical_only: bool = False, dense_index=None, dense_k: int = 20):
         self.model_name = model_name
-        self.icd9 = ICD9()
-        self.client = openai.OpenAI(api_key=api_key, base_url=base_url) if base_url else openai.OpenAI(api_key=api_key)
+        self.icd9 = shared_icd9()
+        # Lexical-only searches never call the LLM, so they need no credentials.
+        if lexical_only:
+            self.client = None
+        else:
+            self.client = openai.OpenAI(api_key=api_key, base_url=base_url) if base_url else openai.OpenAI(api_key=api_key)
+        self._client_kwargs = {"api_key": api_key, "base_url": base_url} if base_url else {"api_key": api_key}
+        self._async_client = None
+        # The KeywordBatcher of the last coalescing batch, for its stats.
+        self.keyword_batcher: Optional[KeywordBatcher] = None
+        # Responses to identical temperature-0 requests are reused from here.
+        self.llm_cache = LLMCache(llm_cache) if isinstance(llm_cache, str) else llm_cache
+        if self.llm_cache is not None and self.client is not None:
+            self.client = CachedChatClient(self.client, self.llm_cache)
         self.prompt_template = prompt_template_dict["keyword_extraction"]
-        self.all_leaves = self.icd9.leaves  # Cache leaves for efficiency
+        # Ranking prompts are trimmed to fit `context_window`: by default the
+        # model's own when it is a known hosted model, DEFAULT_CONTEXT_WINDOW
+        # for others (local ones); 0 sends every candidate.  See
+        # candidate_budget.stats.
+        self.count_tokens = token_counter(model_name)
+        if context_window is None:
+            context_window = context_window_for(model_name) or DEFAULT_CONTEXT_WINDOW
+        self.candidate_budget = CandidateBudget(self.count_tokens, context_window) if context_window else None
+        # Answer with the best BM25 match, without calling the LLM.
+        self.lexical_only = lexical_only
+        # A simple_icd9cm.vectorindex.DenseIndex whose `dense_k` nearest
+        # leaves join the substring hits, so paraphrases are candidates too.
+        self.dense_index = dense_index
+        self.dense_k = dense_k
+        # run_tree_search: the nodes accepted below each (note, node), most
+        # recent last (shared by concurrent searches, under the lock), and the
+        # call-count/latency report of the last search.
+        self._decisions: OrderedDict = OrderedDict()
+        self._decisions_lock = threading.Lock()
+        self.decision_memo_size = 4096
+        self.tree_search_report: dict = {}
         self.use_dspy_optimization = use_dspy_optimization
         self.dspy_ranker = None
         
         # Setup DSPy if optimization is enabled
-        if self.use_dspy_optimization and base_url:
+        if self.use_dspy_optimization and base_url and not lexical_only:
             self._setup_dspy(base_url, api_key or "not-needed")
     
+    @property
+    def all_leaves(self):
+        # Leaves are a slice of the shared tree; reading them loads it on first use.
+        return self.icd9.leaves
+
     def _setup_dspy(self, base_url: str, api_key: str):
         """Setup DSPy for optimized ranking"""
         try:
@@ -36,6 +85,8 @@ class ICD9LLMTreeSearch:
                 temperature=0.0,
                 max_tokens=50
             )
+            if self.llm_cache is not None:
+                lm = CachedLM(lm, self.llm_cache)
             dspy.configure(lm=lm)
             self.dspy_ranker = dspy.Predict(RankingSignature)
             print("DSPy optimization enabled for ranking")
@@ -64,50 +115,128 @@ class ICD9LLMTreeSearch:
             print(f"Failed to load optimized model: {e}")
             return False
 
+    def _keyword_messages(self, note: str) -> list[dict]:
+        prompt = self.prompt_template.format(note=note)
+        return [
+            {"role": "system", "content": KEYWORD_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+
+    @staticmethod
+    def _parse_keywords(llm_output: str) -> list[str]:
+        # Clean up the output and split into a list of keywords
+        keywords = [k.strip().lower() for k in llm_output.replace('"', '').split(',')]
+        print(f"DEBUG: Extracted Keywords: {keywords}")
+        return keywords
+
     def _extract_keywords(self, note: str) -> list[str]:
         """
         Pass 1: Use LLM to extract keywords from the clinical note.
         """
-        prompt = self.prompt_template.format(note=note)
-        messages = [
-            {"role": "system", "content": "You are a medical coding assistant that extracts keywords from a clinical note."},
-            {"role": "user", "content": prompt}
-        ]
         response = self.client.chat.completions.create(
             model=self.model_name,
-            messages=messages,
+            messages=self._keyword_messages(note),
             temperature=0.0,
             max_tokens=100
         )
-        llm_output = response.choices[0].message.content
-        # Clean up the output and split into a list of keywords
-        keywords = [k.strip().lower() for k in llm_output.replace('"', '').split(',')]
-        print(f"DEBUG: Extracted Keywords: {keywords}")
-        return keywords
+        return self._parse_keywords(response.choices[0].message.content)
+
+    def _candidate_lines(self, codes: list[str]) -> list[str]:
+        """Candidate codes with descriptions, one line each, for the ranking prompt."""
+        code_descriptions = []
+        for code, node in zip(codes, self.icd9.find_many(codes)):
+            if node:
+                code_descriptions.append(f"{code}: {node.description}")
+            else:
+                code_descriptions.append(f"{code}: Unknown description")
+        return code_descriptions
+
+    def lexical_search(self, note: str, k: int = 10) -> list[tuple[str, float]]:
+        """The `k` leaves whose descriptions best match the note under BM25, as (code, score)."""
+        return self.icd9.bm25_index.search(note, k)
+
+    def _lexical_best(self, note: str) -> Optional[str]:
+        best = self.lexical_search(note, 1)
+        return best[0][0] if best else None
 
-    def _rank_codes_with_llm(self, note: str, codes: list[str]) -> str:
+    def _lexical_order(self, note: str, codes: list[str]) -> list[str]:
+        """Candidates ordered by BM25 against the note, best first."""
+        return [code for code, _ in self.icd9.bm25_index.rank(note, codes)]
+
+    def _candidates(self, note: str, keywords: list[str], dense_codes: Optional[list[str]] = None) -> list[str]:
+        """Leaves containing a keyword, then the note's nearest leaves in `dense_index`."""
+        found_codes = self.icd9.substring_index.search(keywords)
+        if self.dense_index is None:
+            return found_codes
+        if dense_codes is None:
+            dense_codes = [code for code, _ in self.dense_index.search([note], self.dense_k)[0]]
+        return list(dict.fromkeys(found_codes + dense_codes))
+
+    def _ranking_candidates(self, note: str, codes: list[str], keywords=None) -> tuple[list[str], str]:
+        """The candidates in BM25 order, trimmed to the context window, and their list for the prompt."""
+        # Best lexical match first: it is also the answer when the LLM's is unusable.
+        codes = self._lexical_order(note, codes)
+        return self._budgeted_candidates(note, codes, keywords)
+
+    def _budgeted_candidates(self, note: str, codes: list[str], keywords=None) -> tuple[list[str], str]:
+        """The candidates that fit the context window, and their list for the ranking prompt."""
+        lines = self._candidate_lines(codes)
+        if self.candidate_budget is not None:
+            codes, lines = self.candidate_budget.select(
+                codes, lines, keywords, lambda code_list_str: self._ranking_messages(note, code_list_str))
+        return codes, "\n".join(lines)
+
+    @staticmethod
+    def _ranking_messages(note: str, code_list_str: str) -> list[dict]:
+        ranking_prompt = (
+            f"Given the following clinical note, please rank the following ICD-9 codes by how likely they are to be the correct code for the note.\n\n"
+            f"Clinical Note:\n{note}\n\n"
+            f"ICD-9 Codes:\n{code_list_str}\n\n"
+            f"Please return only the single best code, with no other text."
+        )
+        return [
+            {"role": "system", "content": RANKING_SYSTEM_PROMPT},
+            {"role": "user", "content": ranking_prompt}
+        ]
+
+    @staticmethod
+    def _dspy_choice(result, codes: list[str]) -> str:
+        best_code = result.best_code.strip()
+        print(f"DEBUG: Best code selected by DSPy: {best_code}")
+
+        # Validate the result is one of our candidate codes
+        for code in codes:
+            if code in best_code:
+                return code
+
+        # Fallback to the first (best lexical) code if parsing fails
+        return codes[0]
+
+    @staticmethod
+    def _llm_choice(llm_output: str, codes: list[str]) -> str:
+        best_code = llm_output.strip()
+        print(f"DEBUG: Best code selected by manual LLM: {best_code}")
+
+        # Basic validation to ensure the returned code is one of the options
+        if best_code in codes:
+            return best_code
+        else:
+            # Fallback to the first (best lexical) code if the LLM returns something unexpected
+            return codes[0]
+
+    def _rank_codes_with_llm(self, note: str, codes: list[str], keywords=None) -> str:
         """
         Pass 2: Use LLM to rank the retrieved codes and return the best one.
         Uses DSPy optimization if available, otherwise falls back to manual prompting.
+        Candidates beyond the context window are dropped, keeping those that
+        best match `keywords`.
         """
         if not codes:
             return None
         if len(codes) == 1:
             return codes[0]
 
-        # Format candidate codes with descriptions
-        code_descriptions = []
-        for code in codes:
-            try:
-                node = self.icd9.find(code)
-                if node:
-                    code_descriptions.append(f"{code}: {node.description}")
-                else:
-                    code_descriptions.append(f"{code}: Unknown description")
-            except:
-                code_descriptions.append(f"{code}: Unknown description")
-        
-        code_list_str = "\n".join(code_descriptions)
+        codes, code_list_str = self._ranking_candidates(note, codes, keywords)
 
         # Use DSPy optimization if available
         if self.use_dspy_optimization and self.dspy_ranker:
@@ -116,49 +245,19 @@ class ICD9LLMTreeSearch:
                     clinical_note=note,
                     candidate_codes=code_list_str
                 )
-                best_code = result.best_code.strip()
-                print(f"DEBUG: Best code selected by DSPy: {best_code}")
-                
-                # Validate the result is one of our candidate codes
-                for code in codes:
-                    if code in best_code:
-                        return code
-                
-                # Fallback to first code if parsing fails
-                return codes[0]
-                
+                return self._dspy_choice(result, codes)
             except Exception as e:
                 print(f"DSPy ranking failed: {e}, falling back to manual ranking")
                 self.use_dspy_optimization = False
 
         # Manual ranking as fallback
-        ranking_prompt = (
-            f"Given the following clinical note, please rank the following ICD-9 codes by how likely they are to be the correct code for the note.\n\n"
-            f"Clinical Note:\n{note}\n\n"
-            f"ICD-9 Codes:\n{code_list_str}\n\n"
-            f"Please return only the single best code, with no other text."
-        )
-
-        messages = [
-            {"role": "system", "content": "You are a medical coding assistant that ranks ICD-9 codes."},
-            {"role": "user", "content": ranking_prompt}
-        ]
-
         response = self.client.chat.completions.create(
             model=self.model_name,
-            messages=messages,
+            messages=self._ranking_messages(note, code_list_str),
             temperature=0.0,
             max_tokens=10
         )
-        best_code = response.choices[0].message.content.strip()
-        print(f"DEBUG: Best code selected by manual LLM: {best_code}")
-        
-        # Basic validation to ensure the returned code is one of the options
-        if best_code in codes:
-            return best_code
-        else:
-            # Fallback to the first code if the LLM returns something unexpected
-            return codes[0]
+        return self._llm_choice(response.choices[0].message.content, codes)
 
     def run_search(self, note: str) -> str:
         """
@@ -166,22 +265,263 @@ class ICD9LLMTreeSearch:
         1. Extract keywords from the note using an LLM.
         2. Search for those keywords in the descriptions of all terminal ICD-9 codes.
         3. Rank the results with an LLM and return the best code.
+        With `lexical_only`, returns the best BM25 match with no LLM call.
         """
+        if self.lexical_only:
+            return self._lexical_best(note)
+
         # Pass 1: Extract Keywords
         keywords = self._extract_keywords(note)
 
-        # Pass 2: Targeted Search in leaf nodes
-        found_codes = set()
-        for leaf in self.all_leaves:
-            description = leaf.description.lower()
-            for keyword in keywords:
-                if not keyword:
-                    continue
-                # Use a general substring search, removing word boundaries for robustness
-                if re.search(re.escape(keyword), description):
-                    found_codes.add(leaf.code)
+        # Pass 2: Targeted Search in leaf nodes.  A general substring search,
+        # answered from the tree's shared trigram/token index, plus the
+        # nearest leaves in the dense index when there is one.
+        found_codes = self._candidates(note, keywords)
         
         # Pass 3: Rank the found codes
-        ranked_code = self._rank_codes_with_llm(note, list(found_codes))
+        ranked_code = self._rank_codes_with_llm(note, found_codes, keywords)
+
+        return ranked_code
+
+    def _decision_messages(self, note: str, nodes) -> list[dict]:
+        template = prompt_template_dict.get(self.model_name, prompt_template_dict["gpt-3.5-turbo"])
+        code_descriptions = "\n".join(f"{node.code}: {node.description}" for node in nodes)
+        prompt = template.format(note=note, code_descriptions=code_descriptions) + "\n" + DECISION_FORMAT
+        return [
+            {"role": "system", "content": DECISION_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _llm_decide(self, note: str, nodes) -> str:
+        """The LLM's answer on which of `nodes` apply to the note: one "code: Yes/No" line each."""
+        response = self.client.chat.completions.create(
+            model=self.model_name,
+            messages=self._decision_messages(note, nodes),
+            temperature=0.0,
+            max_tokens=20 * len(nodes) + 20
+        )
+        return response.choices[0].message.content
+
+    @staticmethod
+    def _parse_decisions(llm_output: str, nodes) -> list:
+        """The nodes answered Yes, in order.  A line may repeat the description before the colon."""
+        accepted = []
+        for node in nodes:
+            # '011' must not match the line of '011.4' or '011-018'
+            pattern = rf"^[\s*\-•]*{re.escape(node.code)}(?![\w.\-])[^\n:]*:[\s*]*yes\b"
+            if re.search(pattern, llm_output, re.IGNORECASE | re.MULTILINE):
+                accepted.append(node)
+        return accepted
+
+    def _decide(self, note: str, node) -> tuple:
+        """
+        (children of `node` that apply to the note, None), or (None, the
+        exception) when the LLM call or its parsing failed.
+        """
+        try:
+            return self._parse_decisions(self._llm_decide(note, node.children), node.children), None
+        except Exception as e:
+            return None, e
+
+    @staticmethod
+    def _beam(note: str, nodes: list, beam_width: Optional[int]) -> list:
+        """The `beam_width` nodes sharing most words with the note, in tree order."""
+        if beam_width is None or len(nodes) <= beam_width:
+            return nodes
+        words = set(tokenize(note))
+        overlap = [len(words.intersection(tokenize(node.description))) for node in nodes]
+        keep = sorted(range(len(nodes)), key=lambda i: -overlap[i])[:beam_width]
+        return [nodes[i] for i in sorted(keep)]
+
+    def run_tree_search(self, note: str, max_depth: int = 7, beam_width: Optional[int] = 3,
+                        workers: int = 8) -> list[str]:
+        """
+        Walk the ICD-9 tree down from the root: at each level the LLM decides
+        which children of every node in the beam apply to the note, and at
+        most `beam_width` of the accepted nodes that have children (None:
+        all, as a depth-first search would) are expanded further, for at most
+        `max_depth` levels.  The decisions of a level are requested
+        concurrently on up to `workers` threads and memoized per (note,
+        node).  A failed decision accepts nothing below its node in this
+        search and is not memoized; its exception is kept in
+        `tree_search_report['failures']` under the node's code.  Stops early
+        once every accepted node is a leaf.  Returns the codes of every
+        accepted node, level by level; `tree_search_report` has the LLM call
+        counts and latencies of the search that finished last.  Searches may
+        run on several threads at once and share the memo.
+        """
+        start = time.perf_counter()
+        report = {'calls': 0, 'memo_hits': 0, 'pruned': 0, 'failures': {}, 'levels': []}
+        beam = [self.icd9] if self.icd9.children else []
+        accepted_codes = []
+        pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            for depth in range(max_depth):
+                expand = beam
+                if not expand:
+                    break
+                level_start = time.perf_counter()
+                memo = {}
+                with self._decisions_lock:
+                    for node in expand:
+                        key = (note, node.code)
+                        if key in self._decisions:
+                            self._decisions.move_to_end(key)
+                            memo[node.code] = self._decisions[key]
+                todo = [node for node in expand if node.code not in memo]
+                report['memo_hits'] += len(expand) - len(todo)
+                report['calls'] += len(todo)
+                results = pool.map(lambda node: self._decide(note, node), todo) if pool else \
+                    map(lambda node: self._decide(note, node), todo)
+                decided = {}
+                for node, (children, error) in zip(todo, results):
+                    if error is not None:
+                        report['failures'][node.code] = error
+                    decided[node.code] = children
+                accepted = []
+                for node in expand:
+                    if node.code in decided:
+                        accepted.extend(decided[node.code] or [])
+                    else:
+                        accepted.extend(memo[node.code])
+                with self._decisions_lock:
+                    for code, children in decided.items():
+                        if children is not None:
+                            self._decisions[(note, code)] = children
+                    while len(self._decisions) > self.decision_memo_size:
+                        self._decisions.popitem(last=False)
+                accepted_codes.extend(node.code for node in accepted)
+                # accepted leaves are final; only the rest compete for the beam
+                inner = [node for node in accepted if node.children]
+                beam = self._beam(note, inner, beam_width)
+                report['pruned'] += len(inner) - len(beam)
+                report['levels'].append({'depth': depth, 'expanded': len(expand), 'calls': len(todo),
+                                         'accepted': len(accepted), 'latency': time.perf_counter() - level_start})
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        report['elapsed'] = time.perf_counter() - start
+        self.tree_search_report = report
+        return accepted_codes
+
+    def make_async_client(self, max_connections: int = 8):
+        """
+        An `openai.AsyncOpenAI` for this searcher's endpoint whose connection
+        pool keeps up to `max_connections` connections alive.
+        """
+        import httpx
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        client = openai.AsyncOpenAI(**self._client_kwargs,
+                                    http_client=openai.DefaultAsyncHttpxClient(limits=limits))
+        if self.llm_cache is not None:
+            client = CachedAsyncChatClient(client, self.llm_cache)
+        return client
+
+    @property
+    def async_client(self):
+        """Async client used by `arun_search` when none is passed; created on first use."""
+        if self._async_client is None:
+            self._async_client = self.make_async_client()
+        return self._async_client
+
+    async def _aextract_keywords(self, note: str, client) -> list[str]:
+        response = await client.chat.completions.create(
+            model=self.model_name,
+            messages=self._keyword_messages(note),
+            temperature=0.0,
+            max_tokens=100
+        )
+        return self._parse_keywords(response.choices[0].message.content)
+
+    async def _arank_codes_with_llm(self, note: str, codes: list[str], client, keywords=None) -> str:
+        if not codes:
+            return None
+        if len(codes) == 1:
+            return codes[0]
+
+        # Scoring and token counting are CPU work; they run in a thread
+        # while the event loop serves the other notes' requests.
+        codes, code_list_str = await asyncio.to_thread(self._ranking_candidates, note, codes, keywords)
+
+        if self.use_dspy_optimization and self.dspy_ranker:
+            try:
+                # DSPy is synchronous; keep the event loop free while it runs.
+                result = await asyncio.to_thread(self.dspy_ranker, clinical_note=note,
+                                                 candidate_codes=code_list_str)
+                return self._dspy_choice(result, codes)
+            except Exception as e:
+                print(f"DSPy ranking failed: {e}, falling back to manual ranking")
+                self.use_dspy_optimization = False
+
+        response = await client.chat.completions.create(
+            model=self.model_name,
+            messages=self._ranking_messages(note, code_list_str),
+            temperature=0.0,
+            max_tokens=10
+        )
+        return self._llm_choice(response.choices[0].message.content, codes)
+
+    async def arun_search(self, note: str, client=None, batcher: Optional[KeywordBatcher] = None,
+                          dense_codes: Optional[list[str]] = None) -> str:
+        """
+        `run_search` on an async client (`async_client` unless one is passed).
+        With a `batcher`, the keywords are extracted together with other
+        notes queued on it.  `dense_codes` are the note's nearest leaves in
+        `dense_index`, when already looked up.
+        """
+        if self.lexical_only:
+            return self._lexical_best(note)
+        if client is None:
+            client = self.async_client
+        if batcher is not None:
+            keywords = await batcher.extract(note)
+        else:
+            keywords = await self._aextract_keywords(note, client)
+        found_codes = await asyncio.to_thread(self._candidates, note, keywords, dense_codes)
+        return await self._arank_codes_with_llm(note, found_codes, client, keywords)
+
+    async def arun_search_batch(self, notes: Iterable[str], concurrency: int = 8,
+                                return_exceptions: bool = True, client=None,
+                                coalesce_keywords: bool = False, **batcher_options) -> list:
+        """
+        `arun_search` over `notes`, at most `concurrency` notes in flight, all
+        sharing one connection pool.  Results are in input order; a note that
+        fails gives its exception in its place (or raises, without
+        `return_exceptions`).  `coalesce_keywords` extracts the keywords of
+        notes in flight together through a `KeywordBatcher`, configured by
+        `batcher_options` (window, max_notes, max_prompt_tokens).  With a
+        `dense_index`, the nearest leaves of all notes are looked up at once.
+        """
+        notes = list(notes)
+        dense_codes = [None] * len(notes)
+        if not self.lexical_only:
+            # Build the lazy indexes once, here, rather than in every note's thread.
+            await asyncio.to_thread(lambda: (self.icd9.substring_index, self.icd9.bm25_index))
+            if self.dense_index is not None:
+                hits = await asyncio.to_thread(self.dense_index.search, notes, self.dense_k)
+                dense_codes = [[code for code, _ in note_hits] for note_hits in hits]
+        own_client = client is None and not self.lexical_only
+        if own_client:
+            client = self.make_async_client(concurrency)
+        semaphore = asyncio.Semaphore(concurrency)
+        batcher_options.setdefault('count_tokens', self.count_tokens)
+        batcher = KeywordBatcher(self, client, **batcher_options) if coalesce_keywords else None
+        self.keyword_batcher = batcher
+
+        async def search(note: str, dense: Optional[list[str]]) -> str:
+            async with semaphore:
+                return await self.arun_search(note, client, batcher, dense)
+
+        try:
+            return await asyncio.gather(*(search(note, dense) for note, dense in zip(notes, dense_codes)),
+                                        return_exceptions=return_exceptions)
+        finally:
+            if own_client:
+                await client.close()
 
-        return ranked_code 
\ No newline at end of file
+    def run_search_batch(self, notes: Iterable[str], concurrency: int = 8,
+                         return_exceptions: bool = True, coalesce_keywords: bool = False,
+                         **batcher_options) -> list:
+        """Blocking `arun_search_batch`, for callers without an event loop."""
+        return asyncio.run(self.arun_search_batch(notes, concurrency, return_exceptions,
+                                                  coalesce_keywords=coalesce_keywords, **batcher_options))
@@ -0,0 +1,83 @@
+"""
+Structured diff between two `codes.json` files.
+
+Every code in a codes.json hierarchy is indexed with its description and its
+parent (the code one level up), so a re-crawl can be summarised as
+
+* `added`: codes only in the new file, with their description and parent;
+* `removed`: codes only in the old file;
+* `redescribed`: codes whose description changed (old and new text);
+* `moved`: codes that now sit under a different parent.
+
+    python -m scraper.codesdiff old/codes.json codes.json --output diff.json
+"""
+import argparse
+import json
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+Index = Dict[str, Tuple[Optional[str], Optional[str]]]
+
+
+def index_codes(hierarchies: List[List[Dict[str, Any]]]) -> Index:
+    """code -> (descr, parent code) for every level of every hierarchy."""
+    index: Index = {}
+    for hierarchy in hierarchies:
+        parent = None
+        for entry in hierarchy:
+            code = entry.get('code')
+            if code is None:
+                # the dummy root, or a level the extractor could not parse
+                continue
+            index[code] = (entry.get('descr'), parent)
+            parent = code
+    return index
+
+
+def load_codes(path: str) -> Index:
+    with open(path) as f:
+        return index_codes(json.load(f))
+
+
+def diff_codes(old: Union[str, Index], new: Union[str, Index]) -> Dict[str, List[Dict[str, Any]]]:
+    """The changes from `old` to `new` (codes.json paths or `index_codes` results), sorted by code."""
+    if isinstance(old, str):
+        old = load_codes(old)
+    if isinstance(new, str):
+        new = load_codes(new)
+    diff: Dict[str, List[Dict[str, Any]]] = {'added': [], 'removed': [], 'redescribed': [], 'moved': []}
+    for code in sorted(new.keys() - old.keys()):
+        descr, parent = new[code]
+        diff['added'].append({'code': code, 'descr': descr, 'parent': parent})
+    for code in sorted(old.keys() - new.keys()):
+        descr, parent = old[code]
+        diff['removed'].append({'code': code, 'descr': descr, 'parent': parent})
+    for code in sorted(old.keys() & new.keys()):
+        (old_descr, old_parent), (new_descr, new_parent) = old[code], new[code]
+        if old_descr != new_descr:
+            diff['redescribed'].append({'code': code, 'old': old_descr, 'new': new_descr})
+        if old_parent != new_parent:
+            diff['moved'].append({'code': code, 'old': old_parent, 'new': new_parent})
+    return diff
+
+
+def summary(diff: Dict[str, List[Dict[str, Any]]]) -> str:
+    return ', '.join(f"{len(changes)} {kind}" for kind, changes in diff.items())
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Diff two codes.json files.')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--output', default=None, help='write the diff here as JSON (default: stdout)')
+    args = parser.parse_args(argv)
+    diff = diff_codes(args.old, args.new)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(diff, f, indent=1)
+        print(summary(diff))
+    else:
+        print(json.dumps(diff, indent=1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""
+Compiled link extraction for `levelFactory` handlers.
+
+A handler built by `levelFactory(asel, textsel, extractor)` wraps every
+element matching `asel` in a new PyQuery object and runs two more CSS queries
+on it, translating each selector to XPath again every time.  `CompiledLevels`
+translates all the selectors once, with cssselect's `HTMLTranslator` (which
+PyQuery's translator extends), into `lxml.etree.XPath` objects:
+
+* one walk per document finds the items of every level (which also makes
+  `Scraper`'s fallback to the next level's handler free).  Only the elements
+  carrying an attribute some item selector needs (`@class` for `div.lvl1`)
+  are visited, and each is assigned to its levels by a plain Python test of
+  its tag, id and classes;
+* per level, the relative XPaths for the text and the first `a` below an item.
+
+Documents are parsed the way `PyQuery(html)` parses them, and text is taken
+with `PyQuery.text()` (directly, for elements holding only text), so the
+links are identical to the handlers'.  Handlers using jQuery's own
+pseudo-classes (`:first`, `:eq(n)`) are not compiled.
+Item selectors with attribute tests are checked with a `self::` XPath
+instead, and selectors with combinators or pseudo-classes are matched by
+evaluating their own XPath.
+"""
+import re
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import lxml.html
+from cssselect import HTMLTranslator, SelectorError, parse
+from cssselect.parser import Attrib, Class, Element, Hash
+from lxml import etree
+from pyquery import PyQuery as pq
+
+Level = Tuple[str, str, Callable[[str], Dict[str, Any]]]
+
+
+# XPath's normalize-space() splits @class on these.
+XML_SPACE = re.compile('[ \t\r\n]+')
+# PyQuery.text() collapses runs of HTML whitespace.
+HTML_SPACE = re.compile('[\x20\x09\x0C\u200B\x0A\x0D]+')
+
+
+def _compound(selector: str) -> Optional[Any]:
+    """The parsed tree of a single compound selector (no combinators), else None."""
+    try:
+        selectors = parse(selector)
+    except Exception:
+        return None
+    if len(selectors) != 1 or selectors[0].pseudo_element is not None:
+        return None
+    tree = selectors[0].parsed_tree
+    node = tree
+    while isinstance(node, (Class, Hash, Attrib)):
+        node = node.selector
+    return tree if isinstance(node, Element) else None
+
+
+def _matcher(tree: Any, lower_case: bool) -> Optional[Callable[[Any], bool]]:
+    """
+    A Python test equivalent to the `self::` XPath of a compound selector
+    made of a type, classes and ids; None when it has attribute tests.
+    """
+    classes, ids = set(), set()
+    while isinstance(tree, (Class, Hash)):
+        if isinstance(tree, Class):
+            classes.add(tree.class_name)
+        else:
+            ids.add(tree.id)
+        tree = tree.selector
+    if not isinstance(tree, Element) or tree.namespace not in (None, '*'):
+        return None
+    tag = tree.element
+    if tag is not None and lower_case:
+        tag = tag.lower()
+    if len(ids) > 1:
+        return lambda el: False
+
+    def match(el: Any) -> bool:
+        if tag is not None and el.tag != tag:
+            return False
+        if ids and el.get('id') not in ids:
+            return False
+        if classes:
+            value = el.get('class')
+            if value is None or not classes.issubset(XML_SPACE.split(value)):
+                return False
+        return True
+    return match
+
+
+def _a_class(tree: Any) -> Optional[str]:
+    """A class every element matching the compound selector has, if any."""
+    while isinstance(tree, (Class, Hash, Attrib)):
+        if isinstance(tree, Class):
+            return tree.class_name
+        tree = tree.selector
+    return None
+
+
+def _needs(tree: Any) -> Optional[str]:
+    """An attribute every element matching the compound selector has, if any."""
+    while isinstance(tree, (Class, Hash, Attrib)):
+        if isinstance(tree, Class):
+            return 'class'
+        if isinstance(tree, Hash):
+            return 'id'
+        if tree.namespace is None and tree.attrib.isidentifier():
+            return tree.attrib
+        tree = tree.selector
+    return None
+
+
+def _tag_text(tag: Any) -> str:
+    """`PyQuery(tag).text()`, short-cut for the common element holding only text."""
+    if len(tag) == 0 and tag.tag != 'br':
+        return HTML_SPACE.sub(' ', tag.text or '').strip()
+    return pq(tag).text()
+
+
+def _text(tags: List[Any]) -> str:
+    """`PyQuery(tags).text()`."""
+    if not tags:
+        return ''
+    return ' '.join(pq(tag).html(escape=False) if tag.tag == 'textarea' else _tag_text(tag)
+                    for tag in tags)
+
+
+class CompiledLevels:
+    """Precompiled extraction for a list of (item selector, text selector, extractor) levels."""
+
+    def __init__(self, levels: Sequence[Level]):
+        self.levels = list(levels)
+        # PyQuery's translation: selectors are applied with a
+        # 'descendant-or-self::' prefix to every child of the context node,
+        # i.e. 'descendant::' from the context node itself.
+        translator = HTMLTranslator(xhtml=False)
+
+        def xpath(selector: str, prefix: str) -> str:
+            return translator.css_to_xpath(selector.replace('[@', '['), prefix)
+
+        self.items = [etree.XPath(xpath(asel, 'descendant::')) for asel, _, _ in self.levels]
+        # Per level: a test for one element, or None to evaluate `items`.
+        # Tests of selectors requiring a class are only run on elements
+        # having it: `by_class` maps the class to its (level, test) pairs.
+        self.is_item: List[Optional[Callable[[Any], bool]]] = []
+        self.by_class: Dict[str, List[Tuple[int, Callable[[Any], bool]]]] = {}
+        self.unkeyed: List[Tuple[int, Callable[[Any], bool]]] = []
+        needs = set()
+        for i, (asel, _, _) in enumerate(self.levels):
+            tree = _compound(asel)
+            test = None
+            if tree is not None:
+                test = _matcher(tree, translator.lower_case_element_names)
+                if test is None:
+                    test = etree.XPath(f"boolean({xpath(asel, 'self::')})")
+                needs.add(_needs(tree))
+                key = _a_class(tree)
+                if key is None:
+                    self.unkeyed.append((i, test))
+                else:
+                    self.by_class.setdefault(key, []).append((i, test))
+            self.is_item.append(test)
+        if not any(self.is_item):
+            self.candidates = None
+        elif None in needs:
+            self.candidates = etree.XPath('descendant::*')
+        else:
+            self.candidates = etree.XPath(f"descendant::*[{' or '.join('@' + a for a in sorted(needs))}]")
+        self.texts = [etree.XPath(xpath(textsel, 'descendant::')) for _, textsel, _ in self.levels]
+        self.first_a = etree.XPath(xpath('a', 'descendant::'))
+
+    @classmethod
+    def from_handlers(cls, handlers: Sequence[Callable]) -> Optional['CompiledLevels']:
+        """Compile handlers made by `levelFactory`; None if any handler is custom."""
+        if not all(hasattr(h, 'selectors') for h in handlers):
+            return None
+        try:
+            return cls([h.selectors for h in handlers])
+        except SelectorError:
+            return None
+
+    def parse(self, html: bytes) -> List[Any]:
+        """Root elements, exactly as `PyQuery(html)` parses them."""
+        if not html.strip():
+            return []
+        try:
+            root = etree.fromstring(html)
+        except etree.XMLSyntaxError:
+            root = lxml.html.fromstring(html)
+        return [root]
+
+    def items_by_level(self, roots: List[Any]) -> List[List[Any]]:
+        """The items of every level, in document order, from one walk per root."""
+        found: List[List[Any]] = [[] for _ in self.levels]
+        slow = [i for i, test in enumerate(self.is_item) if test is None]
+        by_class, unkeyed = self.by_class, self.unkeyed
+        for root in roots:
+            for el in self.candidates(root) if self.candidates is not None else ():
+                tests = unkeyed
+                value = el.get('class')
+                if value and by_class:
+                    tests = [t for c in set(XML_SPACE.split(value)) for t in by_class.get(c, ())]
+                    tests += unkeyed
+                for i, test in tests:
+                    if test(el):
+                        found[i].append(el)
+            for i in slow:
+                found[i].extend(self.items[i](root))
+        return found
+
+    def level_links(self, level: int, items: List[Any]) -> List[Dict[str, Any]]:
+        """The handler for `level` applied to its `items`."""
+        _, _, extractor = self.levels[level]
+        texts = self.texts[level]
+        links = []
+        for el in items:
+            code = extractor(_text(texts(el)))
+            anchors = self.first_a(el)
+            ret = {'href': anchors[0].get('href') if anchors else None}
+            ret.update(code)
+            links.append(ret)
+        return list(filter(bool, links))
+
+    def extract(self, html: bytes) -> List[List[Dict[str, Any]]]:
+        """Every level's links in `html`."""
+        found = self.items_by_level(self.parse(html))
+        return [self.level_links(i, items) for i, items in enumerate(found)]
+
+    def links(self, html: bytes, depth: int) -> List[Dict[str, Any]]:
+        """
+        The links `Scraper` extracts from a page at `depth`: the level-`depth`
+        handler's, or the next level's when that finds nothing.
+        """
+        found = self.items_by_level(self.parse(html))
+        links = self.level_links(depth, found[depth])
+        if len(links) == 0 and depth < len(self.levels) - 1:
+            links = self.level_links(depth + 1, found[depth + 1])
+        return links
@@ -0,0 +1,286 @@
+"""
+Persistent page cache for `Scraper`.
+
+A `PageCache` keeps, per URL, the raw HTML, the links the handlers extracted
+from it (as JSON, the same string `Scraper.cache` holds) and the response
+validators.  `Scraper` consults it before every fetch, so a second crawl, or a
+rebuild of `codes.json`, runs offline from disk.
+
+Two policies decide when a cached page is used:
+
+* `max_age`: seconds a page stays fresh after it was fetched (None: forever);
+* `revalidate`: a stale page that has an ETag or Last-Modified is re-requested
+  conditionally, and a 304 keeps the cached links.
+
+Backends: `SQLitePageCache` (one table, safe to share between the crawl
+threads) and `DbmPageCache` (whatever `dbm` module is available).
+
+The repo's `scraper/cache` is the link cache of an earlier crawl, written as a
+Berkeley DB hash file.  `read_bdb_hash` reads that format directly, so it
+needs no bsddb bindings, and `import_legacy` copies it into a `PageCache`:
+
+    python -m scraper.pagecache scraper/cache pages.sqlite
+"""
+import abc
+import argparse
+import dbm
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+
+class Page(NamedTuple):
+    url: str
+    links: str                      # JSON list of link dicts, as extracted
+    html: Optional[bytes] = None    # None for pages imported from the legacy cache
+    fetched_at: float = 0.0
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+class PageCache(abc.ABC):
+    """Base class: the freshness policy, and the storage interface subclasses implement."""
+
+    def __init__(self, max_age: Optional[float] = None, revalidate: bool = False):
+        self.max_age = max_age
+        self.revalidate = revalidate
+        self.lock = threading.RLock()
+
+    def is_fresh(self, page: Page, now: Optional[float] = None) -> bool:
+        if self.max_age is None:
+            return True
+        if now is None:
+            now = time.time()
+        return now - page.fetched_at < self.max_age
+
+    def validators(self, page: Optional[Page], always: bool = False) -> Dict[str, str]:
+        """Conditional request headers for refreshing a stale `page` (with `always`, even without `revalidate`)."""
+        headers = {}
+        if page is None or not (self.revalidate or always):
+            return headers
+        if page.etag:
+            headers['If-None-Match'] = page.etag
+        if page.last_modified:
+            headers['If-Modified-Since'] = page.last_modified
+        return headers
+
+    def touch(self, url: str, fetched_at: Optional[float] = None) -> None:
+        """Mark the cached page for `url` as fetched now (after a 304)."""
+        with self.lock:
+            page = self.get(url)
+            if page is not None:
+                self.put(page._replace(fetched_at=time.time() if fetched_at is None else fetched_at))
+
+    @abc.abstractmethod
+    def get(self, url: str) -> Optional[Page]:
+        ...
+
+    @abc.abstractmethod
+    def put(self, page: Page) -> None:
+        ...
+
+    def put_many(self, pages: List[Page]) -> None:
+        for page in pages:
+            self.put(page)
+
+    @abc.abstractmethod
+    def urls(self) -> List[str]:
+        ...
+
+    def __len__(self) -> int:
+        return len(self.urls())
+
+    def __contains__(self, url: str) -> bool:
+        return self.get(url) is not None
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class SQLitePageCache(PageCache):
+    """Pages in one SQLite table; the HTML is stored zlib-compressed."""
+
+    def __init__(self, path: str, max_age: Optional[float] = None, revalidate: bool = False):
+        super().__init__(max_age, revalidate)
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, links TEXT NOT NULL, '
+                          'html BLOB, fetched_at REAL NOT NULL, etag TEXT, last_modified TEXT)')
+        self.conn.commit()
+
+    @staticmethod
+    def _row(page: Page) -> Tuple:
+        html = zlib.compress(page.html) if page.html is not None else None
+        return page.url, page.links, html, page.fetched_at, page.etag, page.last_modified
+
+    def get(self, url: str) -> Optional[Page]:
+        with self.lock:
+            row = self.conn.execute('SELECT url, links, html, fetched_at, etag, last_modified '
+                                    'FROM pages WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+        html = zlib.decompress(row[2]) if row[2] is not None else None
+        return Page(row[0], row[1], html, *row[3:])
+
+    def put(self, page: Page) -> None:
+        self.put_many([page])
+
+    def put_many(self, pages: List[Page]) -> None:
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)',
+                                  [self._row(page) for page in pages])
+            self.conn.commit()
+
+    def urls(self) -> List[str]:
+        with self.lock:
+            return [url for url, in self.conn.execute('SELECT url FROM pages')]
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+class DbmPageCache(PageCache):
+    """
+    Pages in a `dbm` database.  Each value is the page metadata and links as
+    JSON, a NUL byte, then the zlib-compressed HTML.
+    """
+
+    def __init__(self, path: str, max_age: Optional[float] = None, revalidate: bool = False):
+        super().__init__(max_age, revalidate)
+        self.path = path
+        self.db = dbm.open(path, 'c')
+
+    def get(self, url: str) -> Optional[Page]:
+        with self.lock:
+            value = self.db.get(url.encode('utf-8'))
+        if value is None:
+            return None
+        meta, _, html = value.partition(b'\0')
+        meta = json.loads(meta)
+        return Page(url, meta['links'], zlib.decompress(html) if meta['has_html'] else None,
+                    meta['fetched_at'], meta['etag'], meta['last_modified'])
+
+    def put(self, page: Page) -> None:
+        meta = {'links': page.links, 'has_html': page.html is not None, 'fetched_at': page.fetched_at,
+                'etag': page.etag, 'last_modified': page.last_modified}
+        value = json.dumps(meta).encode('utf-8') + b'\0'
+        if page.html is not None:
+            value += zlib.compress(page.html)
+        with self.lock:
+            self.db[page.url.encode('utf-8')] = value
+
+    def urls(self) -> List[str]:
+        with self.lock:
+            return [key.decode('utf-8') for key in self.db.keys()]
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+
+def open_page_cache(path: str, max_age: Optional[float] = None, revalidate: bool = False) -> PageCache:
+    """SQLite for *.sqlite / *.db paths, dbm otherwise."""
+    if path.endswith(('.sqlite', '.sqlite3', '.db')):
+        return SQLitePageCache(path, max_age, revalidate)
+    return DbmPageCache(path, max_age, revalidate)
+
+
+# Berkeley DB hash files (db 4.x/5.x, hash versions 8 and 9).
+BDB_HASH_MAGIC = 0x061561
+PAGE_HEADER = struct.Struct('QIIIHHBB')   # lsn, pgno, prev, next, entries, hf_offset, level, type
+P_HASH_UNSORTED, P_OVERFLOW, P_HASH = 2, 7, 13
+H_KEYDATA, H_OFFPAGE = 1, 3
+
+
+def read_bdb_hash(path: str) -> Iterator[Tuple[bytes, bytes]]:
+    """
+    Yield the (key, value) pairs of a Berkeley DB hash file.  Every hash page
+    is visited in file order; values too large for a page are read from their
+    overflow chain.  Duplicate-key databases are not supported.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    for order in '<>':
+        magic, version, pagesize = struct.unpack_from(order + 'III', data, 12)
+        if magic == BDB_HASH_MAGIC:
+            break
+    else:
+        raise ValueError(f'{path}: not a Berkeley DB hash file')
+    if version not in (8, 9):
+        raise ValueError(f'{path}: unsupported hash version {version}')
+    header = struct.Struct(order + PAGE_HEADER.format)
+
+    def overflow(pgno: int, length: int) -> bytes:
+        out = bytearray()
+        while pgno and len(out) < length:
+            base = pgno * pagesize
+            _, _, _, pgno, _, used, _, ptype = header.unpack_from(data, base)
+            if ptype != P_OVERFLOW:
+                raise ValueError(f'{path}: broken overflow chain')
+            out += data[base + header.size:base + header.size + used]
+        return bytes(out[:length])
+
+    for base in range(pagesize, len(data) - pagesize + 1, pagesize):
+        _, _, _, _, entries, _, _, ptype = header.unpack_from(data, base)
+        if ptype not in (P_HASH, P_HASH_UNSORTED):
+            continue
+        offsets = struct.unpack_from(f'{order}{entries}H', data, base + header.size)
+        items = []
+        end = pagesize
+        for offset in offsets:
+            item = data[base + offset:base + end]
+            end = offset
+            if item[0] == H_KEYDATA:
+                items.append(item[1:])
+            elif item[0] == H_OFFPAGE:
+                pgno, length = struct.unpack_from(order + 'II', item, 4)
+                items.append(overflow(pgno, length))
+            else:
+                raise ValueError(f'{path}: unsupported hash item type {item[0]}')
+        yield from zip(items[::2], items[1::2])
+
+
+def import_legacy(cache: PageCache, path: str, fetched_at: Optional[float] = None) -> int:
+    """
+    Copy the URL -> links JSON entries of the legacy `scraper/cache` file
+    into `cache`, dated `fetched_at` (default: the file's mtime).  Returns the
+    number of pages imported.
+    """
+    if fetched_at is None:
+        fetched_at = os.path.getmtime(path)
+    pages = [Page(key.decode('utf-8'), value.decode('utf-8'), None, fetched_at)
+             for key, value in read_bdb_hash(path)]
+    cache.put_many(pages)
+    return len(pages)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Import the legacy scraper/cache file into a page cache.')
+    parser.add_argument('legacy', help='Berkeley DB hash file, e.g. scraper/cache')
+    parser.add_argument('cache', help='page cache path (*.sqlite or *.db for SQLite, dbm otherwise)')
+    args = parser.parse_args(argv)
+    with open_page_cache(args.cache) as cache:
+        n = import_legacy(cache, args.legacy)
+    print(f'imported {n} pages into {args.cache}')
+
+
+if __name__ == '__main__':
+    main()
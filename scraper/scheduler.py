@@ -0,0 +1,264 @@
+"""
+Politeness and retries between the scraper's frontier and its HTTP client.
+
+`FetchScheduler.fetch` wraps `session.get` with three mechanisms:
+
+* `TokenBucket`: one per host, caps the sustained request rate at `rate`
+  requests/second with bursts of up to `burst`.  A 429/503 with a Retry-After
+  header pauses the host's bucket for that long.
+* `AIMDLimiter`: caps the requests in flight.  The cap grows by about one per
+  window of successful requests (additive increase) and is halved on an error,
+  a throttling status, or latency well above the fastest seen
+  (multiplicative decrease); at most one decrease per window, so one burst of
+  failures does not collapse it to the minimum.
+* `RetryPolicy`: connection errors, timeouts, truncated bodies and 429/5xx
+  responses are retried with full-jitter exponential backoff.
+
+`metrics()` reports the achieved request rate, retries, errors and the
+current concurrency limit.  Clock and sleep are injectable for tests.
+"""
+import random
+import threading
+import time
+from collections import defaultdict
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+THROTTLE_STATUSES = frozenset({429, 503})
+# ChunkedEncodingError: the connection dropped partway through the body
+TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+
+class TokenBucket:
+    """Blocking token bucket: `rate` tokens/second, holding at most `burst`."""
+
+    def __init__(self, rate: float, burst: float = 1, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = burst
+        self.updated = clock()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _wait_time(self) -> float:
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.paused_until:
+            return self.paused_until - now
+        # Sleeping exactly the computed wait can leave the bucket a rounding
+        # error short of a whole token.
+        if self.tokens >= 1 - 1e-9:
+            self.tokens = max(0.0, self.tokens - 1)
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def acquire(self) -> float:
+        """Take a token, sleeping until one is available; returns the time waited."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                delay = self._wait_time()
+            if delay <= 0:
+                return waited
+            self.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds: float) -> None:
+        """Hand out no tokens for `seconds` (e.g. a server's Retry-After)."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, self.clock() + seconds)
+            self.tokens = 0
+
+
+class AIMDLimiter:
+    """Concurrency gate whose limit adapts additively up and multiplicatively down."""
+
+    def __init__(self, initial: float = 2, minimum: float = 1, maximum: float = 16,
+                 decrease: float = 0.5, latency_factor: float = 3.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.in_flight = 0
+        self.fastest: Optional[float] = None
+        self.smoothed: Optional[float] = None
+        # completions to wait out after a decrease before the next one
+        self.cooldown = 0
+        self.cond = threading.Condition()
+
+    def acquire(self) -> None:
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+
+    def release(self, ok: bool, latency: Optional[float] = None) -> None:
+        """Record one finished request: `ok` is False for errors and throttling."""
+        with self.cond:
+            self.in_flight -= 1
+            congested = not ok
+            if ok and latency is not None:
+                self.fastest = latency if self.fastest is None else min(self.fastest, latency)
+                self.smoothed = latency if self.smoothed is None else 0.8 * self.smoothed + 0.2 * latency
+                congested = self.smoothed > self.latency_factor * self.fastest
+            if congested and self.cooldown == 0:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+                # Requests already in flight were sent under the old limit;
+                # their outcomes must not trigger another decrease.
+                self.cooldown = self.in_flight
+                # Likewise forget the latency history, or the decrease
+                # repeats until the average catches up.
+                self.smoothed = None
+            else:
+                if self.cooldown > 0:
+                    self.cooldown -= 1
+                if not congested:
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+
+class RetryPolicy:
+    """Up to `retries` retries, waiting uniform(0, min(cap, base * 2**attempt)) seconds."""
+
+    def __init__(self, retries: int = 4, base: float = 0.5, cap: float = 30.0,
+                 statuses: frozenset = RETRY_STATUSES, rng: Optional[random.Random] = None):
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+        self.statuses = statuses
+        self.rng = rng or random.Random()
+
+    def backoff(self, attempt: int) -> float:
+        return self.rng.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+
+def retry_after(resp: requests.Response) -> Optional[float]:
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), if any."""
+    value = resp.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class FetchScheduler:
+    """
+    Rate-limited, adaptive, retrying `session.get`.  `rate=None` disables the
+    per-host token buckets and `max_concurrency=None` the AIMD gate, so
+    `FetchScheduler()` only retries.
+    """
+
+    def __init__(self, rate: Optional[float] = None, burst: float = 1,
+                 max_concurrency: Optional[int] = None, min_concurrency: int = 1,
+                 retry: Optional[RetryPolicy] = None, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.retry = retry or RetryPolicy()
+        self.clock = clock
+        self.sleep = sleep
+        self.limiter = None
+        if max_concurrency is not None:
+            self.limiter = AIMDLimiter(initial=min(2, max_concurrency), minimum=min_concurrency,
+                                       maximum=max_concurrency)
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.lock = threading.Lock()
+        self.counts: Dict[str, int] = defaultdict(int)
+        self.latency_total = 0.0
+        self.started: Optional[float] = None
+
+    def bucket(self, url: str) -> Optional[TokenBucket]:
+        if self.rate is None:
+            return None
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.burst, self.clock, self.sleep)
+            return self.buckets[host]
+
+    def _count(self, **deltas: Any) -> None:
+        with self.lock:
+            for key, n in deltas.items():
+                self.counts[key] += n
+
+    def fetch(self, session: requests.Session, url: str, **kwargs: Any) -> requests.Response:
+        """
+        `session.get(url, **kwargs)` under the rate limit and concurrency
+        gate, retrying transient failures.  Returns the last response, or
+        re-raises the last exception, once the retries are used up.
+        """
+        if self.started is None:
+            self.started = self.clock()
+        bucket = self.bucket(url)
+        attempt = 0
+        while True:
+            if bucket is not None:
+                bucket.acquire()
+            if self.limiter is not None:
+                self.limiter.acquire()
+            start = self.clock()
+            resp, error, retryable = None, None, True
+            try:
+                resp = session.get(url, **kwargs)
+                retryable = resp.status_code in self.retry.statuses
+            except TRANSIENT_ERRORS as e:
+                error = e
+            finally:
+                # Other exceptions propagate, but the slot must still be
+                # released or workers end up blocked in acquire().
+                latency = self.clock() - start
+                if self.limiter is not None:
+                    self.limiter.release(not retryable, latency)
+                self._count(requests=1, errors=int(resp is None),
+                            throttled=int(resp is not None and resp.status_code in THROTTLE_STATUSES))
+                with self.lock:
+                    self.latency_total += latency
+
+            if not retryable:
+                return resp
+            if attempt >= self.retry.retries:
+                self._count(failures=1)
+                if error is not None:
+                    raise error
+                return resp
+            delay = self.retry.backoff(attempt)
+            wait = retry_after(resp) if resp is not None else None
+            if wait is not None:
+                delay = max(delay, wait)
+                if bucket is not None:
+                    bucket.pause(wait)
+            attempt += 1
+            self._count(retries=1)
+            self.sleep(delay)
+
+    def metrics(self) -> Dict[str, float]:
+        """Counters plus the achieved request rate and mean latency so far."""
+        with self.lock:
+            counts = dict(self.counts)
+            latency_total = self.latency_total
+        elapsed = self.clock() - self.started if self.started is not None else 0.0
+        n = counts.get('requests', 0)
+        ret = {key: counts.get(key, 0) for key in ('requests', 'retries', 'errors', 'throttled', 'failures')}
+        ret.update({
+            'elapsed': elapsed,
+            'request_rate': n / elapsed if elapsed > 0 else 0.0,
+            'mean_latency': latency_total / n if n else 0.0,
+        })
+        if self.limiter is not None:
+            ret['concurrency_limit'] = self.limiter.limit
+        return ret
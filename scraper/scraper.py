@@ -1,18 +1,55 @@
+import asyncio
 import json
+import os
 import re
+import threading
+import time
 import requests
 from pyquery import PyQuery as pq
 from urllib.parse import urlparse
-from collections import deque
-from typing import Any, Callable, List, Dict, Optional
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterator, List, Dict, Optional
+
+try:
+    from .pagecache import Page, PageCache
+    from .scheduler import FetchScheduler, RetryPolicy
+    from .extract import CompiledLevels
+except ImportError:  # run as a script from inside scraper/
+    from pagecache import Page, PageCache
+    from scheduler import FetchScheduler, RetryPolicy
+    from extract import CompiledLevels
 
 
 class Scraper:
-    def __init__(self, handlers: List[Callable]):
+    def __init__(self, handlers: List[Callable], timeout: float = 30,
+                 page_cache: Optional[PageCache] = None, scheduler: Optional[FetchScheduler] = None,
+                 compiled: bool = True, incremental: bool = False, skip_unchanged_subtrees: bool = True):
         self.stack: deque = deque()
         self.hostname: str = ''
         self.handlers: List[Callable] = handlers
         self.cache: Dict[str, str] = {}
+        self.timeout = timeout
+        self.page_cache = page_cache
+        # Rate limits, adaptive concurrency and retries; by default only retries.
+        self.scheduler = scheduler if scheduler is not None else FetchScheduler()
+        # Precompiled extraction, when every handler comes from levelFactory.
+        self.compiled = CompiledLevels.from_handlers(handlers) if compiled else None
+        # Incremental re-scrape: every cached page is revalidated, whatever
+        # its age, and only pages whose content changed are parsed again.
+        # The pages below an unchanged page are taken from the cache unless
+        # `skip_unchanged_subtrees` is off.
+        self.incremental = incremental
+        self.skip_unchanged_subtrees = skip_unchanged_subtrees
+        self.trusted: set = set()
+        # How each page was obtained: 'new', 'changed', 'unchanged', 'skipped', 'cached'.
+        self.page_counts: Counter = Counter()
+        self.lock = threading.Lock()
+        self.pages_done = 0
+        # Called after each page is fully expanded, when the stack and the
+        # hierarchies yielded so far agree; `crawl_to` checkpoints here.
+        self.on_page_done: Optional[Callable[[], None]] = None
+        self.session = requests.Session()
 
     def path(self, url: str) -> str:
         parsed = urlparse(url)
@@ -43,27 +80,226 @@ class Scraper:
                 print("cache hit")
                 links = json.loads(self.cache[url])
             else:
-                resp = requests.get(url)
-                html = resp.content
-                dom = pq(html)
-
-                handler = self.handlers[depth]
-                links = handler(dom)
-                if len(links) == 0 and depth < len(self.handlers) - 1:
-                    links = self.handlers[depth + 1](dom)
+                links = self.fetch_links(self.session, depth, url)
                 self.cache[url] = json.dumps(links)
 
-            for link in reversed(links):
-                link['depth'] = depth + 1
-                path = link['href']
-                newparents = list(parents)
-                newparents.append(link)
-                newurl = f"{self.hostname}/{path}"
-                if path:
-                    self.push(depth + 1, newurl, newparents)
+            yield from self._expand(depth, parents, links)
+            self._page_done()
+
+    def _page_done(self) -> None:
+        self.pages_done += 1
+        if self.on_page_done is not None:
+            self.on_page_done()
+
+    def fetch_links(self, session: requests.Session, depth: int, url: str) -> List[Dict[str, Any]]:
+        """
+        Links of `url`: from the page cache while its copy is fresh, otherwise
+        fetched (conditionally, if the cache revalidates) and extracted with
+        the handler for `depth`.  In incremental mode a page is parsed only
+        if its content differs from the cached copy.
+        """
+        pages = self.page_cache
+        page = pages.get(url) if pages is not None else None
+        if page is not None and url in self.trusted:
+            return self._unchanged(page.links, 'skipped')
+        if page is not None and not self.incremental and pages.is_fresh(page):
+            self._count('cached')
+            return json.loads(page.links)
+        headers = pages.validators(page, always=self.incremental) if pages is not None else {}
+        resp = self.scheduler.fetch(session, url, headers=headers, timeout=self.timeout)
+        if resp.status_code in self.scheduler.retry.statuses:
+            # Still failing after the retries: don't cache an error page as a leaf.
+            resp.raise_for_status()
+        if resp.status_code == 304 and page is not None:
+            pages.touch(url)
+            return self._unchanged(page.links, 'unchanged')
+        etag, last_modified = resp.headers.get('ETag'), resp.headers.get('Last-Modified')
+        if self.incremental and page is not None and page.html == resp.content:
+            pages.put(page._replace(fetched_at=time.time(), etag=etag, last_modified=last_modified))
+            return self._unchanged(page.links, 'unchanged')
+        self._count('new' if page is None else 'changed')
+        links = self.extract_links(resp.content, depth)
+        if pages is not None:
+            pages.put(Page(url, json.dumps(links), resp.content, time.time(), etag, last_modified))
+        return links
+
+    def _count(self, kind: str) -> None:
+        with self.lock:
+            self.page_counts[kind] += 1
+
+    def _unchanged(self, links_json: str, kind: str) -> List[Dict[str, Any]]:
+        """The cached links of an unchanged page; in incremental mode its children are trusted."""
+        self._count(kind)
+        links = json.loads(links_json)
+        if self.incremental and self.skip_unchanged_subtrees:
+            with self.lock:
+                self.trusted.update(f"{self.hostname}/{link['href']}" for link in links if link['href'])
+        return links
+
+    def extract_links(self, html: bytes, depth: int) -> List[Dict[str, Any]]:
+        if self.compiled is not None:
+            return self.compiled.links(html, depth)
+        dom = pq(html)
+        links = self.handlers[depth](dom)
+        if len(links) == 0 and depth < len(self.handlers) - 1:
+            links = self.handlers[depth + 1](dom)
+        return links
+
+    def _expand(self, depth: int, parents: List[Any], links: List[Dict[str, Any]]) -> Iterator[List[Any]]:
+        """Push the links of a processed page and yield the hierarchies that end in a leaf."""
+        for link in reversed(links):
+            link['depth'] = depth + 1
+            path = link['href']
+            newparents = list(parents)
+            newparents.append(link)
+            newurl = f"{self.hostname}/{path}"
+            if path:
+                self.push(depth + 1, newurl, newparents)
+            else:
+                print(link)
+                yield newparents
+
+    async def arun(self, concurrency: int = 8) -> AsyncIterator[List[Any]]:
+        """
+        Like `run`, but with up to `concurrency` pages fetched at once.
+
+        Pages are still processed one at a time in stack order, so hierarchies
+        come out in exactly the order `run` yields them; the workers only
+        fetch and parse ahead, on the first `concurrency` fetchable entries
+        of the stack.  Fetches share one keep-alive connection pool.
+        """
+        loop = asyncio.get_running_loop()
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        pending: Dict[str, Future] = {}
+
+        def prefetch() -> None:
+            ahead = 0
+            for depth, url, _ in self.stack:
+                if ahead >= concurrency:
+                    break
+                url = str(url)
+                if depth >= len(self.handlers) or url in self.cache:
+                    continue
+                if url not in pending:
+                    pending[url] = executor.submit(self.fetch_links, session, depth, url)
+                ahead += 1
+
+        try:
+            while len(self.stack):
+                prefetch()
+                depth, url, parents = self.stack.popleft()
+                url = str(url)
+                print(f"proc: {depth}\t{len(self.stack)}\t{url}")
+
+                if depth >= len(self.handlers):
+                    print(f"reached max-depth {depth} on {url}")
+                    continue
+
+                if url in self.cache:
+                    print("cache hit")
+                    links = json.loads(self.cache[url])
                 else:
-                    print(link)
+                    future = pending.pop(url, None)
+                    if future is None:
+                        future = executor.submit(self.fetch_links, session, depth, url)
+                    links = await asyncio.wrap_future(future, loop=loop)
+                    self.cache[url] = json.dumps(links)
+
+                for newparents in self._expand(depth, parents, links):
                     yield newparents
+                self._page_done()
+        finally:
+            for future in pending.values():
+                future.cancel()
+            executor.shutdown(wait=True)
+            session.close()
+
+    def run_async(self, concurrency: int = 8) -> Iterator[List[Any]]:
+        """Blocking iterator over `arun`, for callers without an event loop."""
+        loop = asyncio.new_event_loop()
+        agen = self.arun(concurrency)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(agen.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(agen.aclose())
+            loop.close()
+
+
+    def state(self) -> Dict[str, Any]:
+        """The crawl frontier and progress, as JSON-serializable data."""
+        return {'hostname': self.hostname, 'stack': list(self.stack), 'pages_done': self.pages_done,
+                'trusted': sorted(self.trusted)}
+
+    def restore(self, state: Dict[str, Any]) -> None:
+        """Replace the frontier and progress with a saved `state()`."""
+        self.hostname = state['hostname']
+        self.stack = deque(state['stack'])
+        self.pages_done = state['pages_done']
+        self.trusted = set(state.get('trusted', []))
+
+    def crawl_to(self, jsonl_path: str, checkpoint_path: Optional[str] = None,
+                 checkpoint_every: int = 50, concurrency: int = 1) -> int:
+        """
+        Crawl from the current stack, appending each hierarchy to `jsonl_path`
+        as one JSON line, and return the number of hierarchies written.
+
+        Every `checkpoint_every` pages the output is flushed and the frontier,
+        progress and output size are saved to `checkpoint_path` (default:
+        `jsonl_path` + '.ckpt').  If that checkpoint exists, the crawl resumes
+        from it instead: output written after the checkpoint is truncated and
+        produced again, so every hierarchy is written exactly once.  The
+        checkpoint of a finished crawl is not resumed: the crawl starts over
+        from the current stack and rewrites `jsonl_path`.
+        """
+        if checkpoint_path is None:
+            checkpoint_path = f"{jsonl_path}.ckpt"
+        checkpoint = None
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                checkpoint = json.load(f)
+        if checkpoint is not None and not checkpoint.get('done'):
+            self.restore(checkpoint['scraper'])
+            written, offset = checkpoint['written'], checkpoint['offset']
+            if not os.path.exists(jsonl_path) or os.path.getsize(jsonl_path) < offset:
+                raise ValueError(f"{jsonl_path} is shorter than its checkpoint {checkpoint_path}")
+            with open(jsonl_path, 'ab') as out:
+                out.truncate(offset)
+        else:
+            written = 0
+            open(jsonl_path, 'wb').close()
+
+        with open(jsonl_path, 'ab') as out:
+            def save(done: bool = False) -> None:
+                out.flush()
+                os.fsync(out.fileno())
+                tmp = f"{checkpoint_path}.tmp"
+                with open(tmp, 'w') as f:
+                    json.dump({'scraper': self.state(), 'written': written,
+                               'offset': out.tell(), 'done': done}, f)
+                os.replace(tmp, checkpoint_path)
+
+            def on_page_done() -> None:
+                if self.pages_done % checkpoint_every == 0:
+                    save()
+
+            self.on_page_done = on_page_done
+            try:
+                hierarchies = self.run() if concurrency <= 1 else self.run_async(concurrency)
+                for hierarchy in hierarchies:
+                    out.write(json.dumps(hierarchy).encode('utf-8') + b'\n')
+                    written += 1
+                save(done=True)
+            finally:
+                self.on_page_done = None
+        return written
 
 
 def levelFactory(asel: str, textsel: str, extractor: Callable) -> Callable:
@@ -79,6 +315,8 @@ def levelFactory(asel: str, textsel: str, extractor: Callable) -> Callable:
             ret.update(code)
             links.append(ret)
         return list(filter(bool, links))
+    # read by extract.CompiledLevels
+    f.selectors = (asel, textsel, extractor)
     return f
 
 def startendExtractorFactory(regex: str) -> Callable:
@@ -113,7 +351,34 @@ def singleExtractorFactory(regex: str) -> Callable:
     return f
 
 
-if __name__ == '__main__':
+def codes_layout(hierarchy: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """A scraped hierarchy in the codes.json layout: a dummy root, then code and descr per level."""
+    return [{'code': None}] + [{'code': link['code'], 'descr': link.get('descr')} for link in hierarchy]
+
+
+def finalize(jsonl_path: str, codes_path: str) -> int:
+    """
+    Stream the hierarchies in `jsonl_path` into a codes.json array at
+    `codes_path`, one hierarchy in memory at a time.  Returns the count.
+    """
+    n = 0
+    tmp = f"{codes_path}.tmp"
+    with open(jsonl_path) as src, open(tmp, 'w') as out:
+        out.write('[')
+        for line in src:
+            if not line.strip():
+                continue
+            if n:
+                out.write(', ')
+            out.write(json.dumps(codes_layout(json.loads(line))))
+            n += 1
+        out.write(']')
+    os.replace(tmp, codes_path)
+    return n
+
+
+def icd9_handlers() -> List[Callable]:
+    """Link extractors for the five levels of icd9cm.chrisendres.com."""
     regex1 = r'^(\d+\.\s*)?(?P<descr>[\-\d\w\s\,\.]*)\s*\((?P<start>\w?\d+)(-(?P<end>\w?\d+)\))?'
     regex2 = r'^(?P<descr>[\-\d\w\s\,\.]*)\s*\((?P<start>\w?\d+)(-(?P<end>\w?\d+)\))?'
     regex3 = r'^\s*(?P<code>\w?\d+(\.\d*)?)\s+(?P<descr>.*)'
@@ -122,12 +387,68 @@ if __name__ == '__main__':
     l3links = levelFactory('.lvl3', 'div.dlvl', singleExtractorFactory(regex3))
     l4links = levelFactory('.lvl4', 'div.dlvl', singleExtractorFactory(regex3))
     l5links = levelFactory('.lvl5', 'div.dlvl', singleExtractorFactory(regex3))
-    handlers = [l1links, l2links, l3links, l4links, l5links]
-    scraper = Scraper(handlers)
-    scraper.push(0, 'http://icd9cm.chrisendres.com/index.php?action=contents')
-    hierarchies = scraper.run()
+    return [l1links, l2links, l3links, l4links, l5links]
+
 
-    with open('./codes.json', 'w') as f:
-        codes = [x for x in hierarchies]
-        f.write(json.dumps(codes))
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Crawl icd9cm.chrisendres.com into codes.json.')
+    parser.add_argument('--concurrency', type=int, default=1, help='pages fetched at once')
+    parser.add_argument('--cache', default=None, help='persistent page cache (*.sqlite for SQLite, dbm otherwise)')
+    parser.add_argument('--import-legacy', default=None, metavar='PATH',
+                        help='first import the Berkeley DB link cache at PATH (scraper/cache)')
+    parser.add_argument('--max-age', type=float, default=None, help='seconds a cached page stays fresh')
+    parser.add_argument('--revalidate', action='store_true', help='refresh stale pages with conditional requests')
+    parser.add_argument('--rate', type=float, default=None, help='requests per second per host')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='adapt the requests in flight (up to --concurrency) to latency and errors')
+    parser.add_argument('--retries', type=int, default=4, help='retries per page on transient errors')
+    parser.add_argument('--output', default='./codes.json')
+    parser.add_argument('--jsonl', default=None,
+                        help='hierarchies stream here as JSON lines (default: OUTPUT with .jsonl)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='revalidate every cached page and re-parse only those that changed; '
+                             'write a diff against the previous OUTPUT')
+    parser.add_argument('--no-skip', action='store_true',
+                        help='with --incremental, also revalidate the pages below unchanged pages')
+    parser.add_argument('--diff', default=None,
+                        help='with --incremental, write the diff here (default: OUTPUT with .diff.json)')
+    parser.add_argument('--checkpoint-every', type=int, default=50, metavar='PAGES',
+                        help='checkpoint the crawl every PAGES pages; an existing checkpoint is resumed')
+    args = parser.parse_args()
+    if args.incremental and not args.cache:
+        parser.error('--incremental needs a --cache to compare against')
 
+    page_cache = None
+    if args.cache:
+        try:
+            from .pagecache import import_legacy, open_page_cache
+        except ImportError:
+            from pagecache import import_legacy, open_page_cache
+        page_cache = open_page_cache(args.cache, args.max_age, args.revalidate)
+        if args.import_legacy:
+            print(f"imported {import_legacy(page_cache, args.import_legacy)} pages")
+    scheduler = FetchScheduler(rate=args.rate, max_concurrency=args.concurrency if args.adaptive else None,
+                               retry=RetryPolicy(retries=args.retries))
+    scraper = Scraper(icd9_handlers(), page_cache=page_cache, scheduler=scheduler,
+                      incremental=args.incremental, skip_unchanged_subtrees=not args.no_skip)
+    scraper.push(0, 'http://icd9cm.chrisendres.com/index.php?action=contents')
+    jsonl = args.jsonl or f"{os.path.splitext(args.output)[0]}.jsonl"
+    old_codes = None
+    if args.incremental:
+        try:
+            from .codesdiff import diff_codes, load_codes, summary
+        except ImportError:
+            from codesdiff import diff_codes, load_codes, summary
+        if os.path.exists(args.output):
+            old_codes = load_codes(args.output)
+    scraper.crawl_to(jsonl, checkpoint_every=args.checkpoint_every, concurrency=args.concurrency)
+    print(f"wrote {finalize(jsonl, args.output)} hierarchies to {args.output}")
+    if old_codes is not None:
+        diff = diff_codes(old_codes, args.output)
+        diff_path = args.diff or f"{os.path.splitext(args.output)[0]}.diff.json"
+        with open(diff_path, 'w') as f:
+            json.dump(diff, f, indent=1)
+        print(f"{summary(diff)}; written to {diff_path}")
+    print(json.dumps(dict(scraper.page_counts)))
+    print(json.dumps(scheduler.metrics()))
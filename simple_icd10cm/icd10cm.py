@@ -1,34 +1,206 @@
 import csv
+from array import array
 from typing import List, Dict, Optional
 
+from . import orderfile
+
+
 class ICD10CM:
     def __init__(self, data: Optional[List[Dict[str, str]]] = None):
         # For demo, use a small sample if no data is provided
         if data is None:
-            self.data = [
+            data = [
                 {"code": "A00", "desc": "Cholera"},
                 {"code": "A00.0", "desc": "Cholera due to Vibrio cholerae 01, biovar cholerae", "parent": "A00"},
                 {"code": "A00.1", "desc": "Cholera due to Vibrio cholerae 01, biovar eltor", "parent": "A00"},
                 {"code": "A01", "desc": "Typhoid and paratyphoid fevers"},
                 {"code": "A01.0", "desc": "Typhoid fever", "parent": "A01"},
             ]
-        else:
-            self.data = data
-        self.code_map = {row["code"]: row for row in self.data}
+        self.data = data
+
+    @classmethod
+    def from_order_file(cls, path: str, cache_path: Optional[str] = None,
+                        use_cache: bool = True, long_descriptions: bool = True) -> 'ICD10CM':
+        """
+        Load the CMS order file (`icd10cm_order_<year>.txt`) without building
+        a row dict per code; codes are dotted and parents come from the code
+        structure (see `orderfile`).  The index is saved to `cache_path`
+        (default: `path` + '.cache') and reused while the order file is
+        unchanged.
+        """
+        if cache_path is None:
+            cache_path = f"{path}.cache"
+        self = cls.__new__(cls)
+        self._data = None
+        self._code_map = None
+        cached = orderfile.read_cache(cache_path, path) if use_cache else None
+        if cached is not None:
+            self._load_preorder(*cached)
+            return self
+        self._build_hierarchy(*orderfile.read_order_file(path, long_descriptions))
+        if use_cache:
+            try:
+                orderfile.write_cache(cache_path, path, self._order, self._descs,
+                                      self._parent, self._end, array('b', self._depth))
+            except OSError:
+                pass
+        return self
+
+    def _load_preorder(self, order: List[str], descs: List[str], parent: array,
+                       end: array, depth: array) -> None:
+        self._codes = self._order = order
+        self._pre = dict(zip(order, range(len(order))))
+        self._descs = descs
+        self._parent = parent
+        self._end = end
+        self._depth = depth
+        self._orphans = {}
+        self._unknown_parents = {}
+
+    @property
+    def data(self) -> List[Dict[str, str]]:
+        """Rows as dicts with code, desc and (when present) parent; built on first use."""
+        if self._data is None:
+            rows = []
+            for code in self._codes:
+                row = {"code": code, "desc": self.get_description(code)}
+                parent = self.get_parent(code)
+                if parent:
+                    row["parent"] = parent
+                rows.append(row)
+            self._data = rows
+        return self._data
+
+    @data.setter
+    def data(self, data: List[Dict[str, str]]) -> None:
+        """
+        Replace the rows; the hierarchy is re-indexed from them.  Lookups
+        answer from that index, so rows edited in place take effect once
+        `data` is assigned again.
+        """
+        self._data = data
+        self._code_map = None
+        descs: Dict[str, str] = {}
+        parents: Dict[str, Optional[str]] = {}
+        for row in data:
+            descs[row["code"]] = row["desc"]
+            parents[row["code"]] = row.get("parent") or None
+        self._build_hierarchy(list(descs), list(descs.values()), list(parents.values()))
+
+    @property
+    def code_map(self) -> Dict[str, Dict[str, str]]:
+        if self._code_map is None:
+            self._code_map = {row["code"]: row for row in self.data}
+        return self._code_map
+
+    @code_map.setter
+    def code_map(self, code_map: Dict[str, Dict[str, str]]) -> None:
+        """Replace the rows by a code -> row map; re-indexed like `data`."""
+        self.data = list(code_map.values())
+        self._code_map = code_map
+
+    def _build_hierarchy(self, codes: List[str], descs: List[str],
+                         parents: List[Optional[str]]) -> None:
+        """
+        Index the parent links once from parallel per-code lists.  Codes are
+        numbered in pre-order: `_pre[code]` is the position of a code in
+        `_order`, its descendants are the contiguous run up to `_end[pos]`,
+        and descriptions, parent positions and depths are stored by position.
+        Codes whose parent is missing or unknown are roots; links to unknown
+        parents are kept aside in `_unknown_parents` and `_orphans`.
+        """
+        known = dict(zip(codes, range(len(codes))))
+        children: Dict[str, List[str]] = {}
+        roots = []
+        for code, parent in zip(codes, parents):
+            if parent:
+                children.setdefault(parent, []).append(code)
+            if not parent or parent not in known:
+                roots.append(code)
+        order: List[str] = []
+        pre: Dict[str, int] = {}
+        end = array('i', bytes(4 * len(codes)))
+        depths = array('i', bytes(4 * len(codes)))
+        # Codes left over after walking from the roots sit on a parent
+        # cycle; each becomes a root of its own.
+        for start in (roots, codes):
+            stack = [(code, 0, False) for code in reversed(start)]
+            while stack:
+                code, depth, done = stack.pop()
+                if done:
+                    end[pre[code]] = len(order)
+                    continue
+                if code in pre:
+                    continue
+                pre[code] = len(order)
+                depths[len(order)] = depth
+                order.append(code)
+                stack.append((code, depth, True))
+                stack.extend((child, depth + 1, False) for child in reversed(children.get(code, [])))
+        self._codes = codes
+        self._order = order
+        self._pre = pre
+        self._descs = [descs[known[code]] for code in order]
+        self._parent = array('i', (pre.get(parents[known[code]], -1) for code in order))
+        self._end = end
+        self._depth = depths
+        self._orphans = {parent: kids for parent, kids in children.items() if parent not in known}
+        self._unknown_parents = {code: parent for code, parent in zip(codes, parents)
+                                 if parent and parent not in known}
 
     def is_valid_item(self, code: str) -> bool:
-        return code in self.code_map
+        return code in self._pre
 
     def get_description(self, code: str) -> Optional[str]:
-        row = self.code_map.get(code)
-        return row["desc"] if row else None
+        i = self._pre.get(code)
+        return self._descs[i] if i is not None else None
 
     def get_parent(self, code: str) -> Optional[str]:
-        row = self.code_map.get(code)
-        return row.get("parent") if row and "parent" in row else None
+        i = self._pre.get(code)
+        if i is None:
+            return None
+        p = self._parent[i]
+        return self._order[p] if p >= 0 else self._unknown_parents.get(code)
 
     def get_children(self, code: str) -> List[str]:
-        return [row["code"] for row in self.data if row.get("parent") == code]
+        i = self._pre.get(code)
+        if i is None:
+            return list(self._orphans.get(code, []))
+        # The children are the subtrees tiling (i, end[i]).
+        ret = []
+        j, stop = i + 1, self._end[i]
+        while j < stop:
+            ret.append(self._order[j])
+            j = self._end[j]
+        return ret
+
+    def get_depth(self, code: str) -> Optional[int]:
+        """Depth below the root codes (which have depth 0), or None for unknown codes."""
+        i = self._pre.get(code)
+        return self._depth[i] if i is not None else None
+
+    def get_ancestors(self, code: str) -> List[str]:
+        """Ancestors of `code`, nearest first."""
+        ret = []
+        parent = self.get_parent(code)
+        while parent and parent in self._pre and len(ret) <= len(self._order):
+            ret.append(parent)
+            parent = self.get_parent(parent)
+        return ret
+
+    def get_descendants(self, code: str) -> List[str]:
+        """All codes below `code`, in pre-order."""
+        i = self._pre.get(code)
+        if i is None:
+            return []
+        return self._order[i + 1:self._end[i]]
+
+    def is_descendant(self, a: str, b: str) -> bool:
+        """True if `a` is a (strict) descendant of `b`."""
+        i, j = self._pre.get(a), self._pre.get(b)
+        if i is None or j is None:
+            return False
+        return j < i < self._end[j]
 
     def get_all_codes(self) -> List[str]:
-        return list(self.code_map.keys()) 
\ No newline at end of file
+        return list(self._codes)
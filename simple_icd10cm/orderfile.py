@@ -0,0 +1,142 @@
+"""
+Reader for the CMS ICD-10-CM order file and its binary cache.
+
+The order file (`icd10cm_order_<year>.txt`) is fixed width, one code per line
+in tabular order:
+
+    cols  1-5   order number, zero padded
+    cols  7-13  code, without the dot
+    col   15    1 if the code is billable, 0 for a header
+    cols 17-76  short description
+    cols 78-    long description
+
+`read_order_file` streams it line by line.  Parents are derived from the code
+structure: the parent of a code is its longest proper prefix already seen,
+ignoring trailing `X` placeholders, so `S0000XA` hangs under `S0000` even though
+there is no `S0000X` row.
+
+Because the file is in tabular order, it is already a pre-order walk of the
+hierarchy, and `write_cache` stores it as such: the codes and descriptions
+newline-joined and the parent, subtree end and depth of every position as
+arrays.  `read_cache` rebuilds an index from those with a handful of bulk
+operations instead of reparsing 95k lines.
+
+Layout (little-endian header, arrays in native byte order):
+
+    header      HEADER struct
+    codes       UTF-8, newline separated
+    descs       UTF-8, newline separated
+    parent      int32 per code, -1 for roots
+    end         int32 per code, one past the last descendant
+    depth       int8 per code
+"""
+import os
+import struct
+import sys
+from array import array
+from typing import Iterator, List, Optional, Tuple
+
+MAGIC = b'ICD10IDX'
+VERSION = 1
+# magic, version, byteorder (0 little / 1 big), code count,
+# codes and descs blob sizes, order file size + mtime_ns
+HEADER = struct.Struct('<8sIIIQQqq')
+
+
+def format_code(code: str) -> str:
+    """Dotted form of an undotted code: 'A000' -> 'A00.0'."""
+    return code if len(code) <= 3 else f"{code[:3]}.{code[3:]}"
+
+
+def iter_order_file(path: str) -> Iterator[Tuple[str, bool, str, str]]:
+    """Yield (undotted code, billable, short description, long description) per line."""
+    with open(path, encoding='latin-1') as f:
+        for line in f:
+            if len(line) < 16 or not line[:5].strip().isdigit():
+                continue
+            yield (line[6:13].strip(), line[14] == '1',
+                   line[16:76].strip(), line[77:].strip())
+
+
+def read_order_file(path: str, long_descriptions: bool = True
+                    ) -> Tuple[List[str], List[str], List[Optional[str]]]:
+    """
+    Parse the order file into parallel lists of dotted codes, descriptions and
+    dotted parent codes (None for the categories), in file order.
+    """
+    codes: List[str] = []
+    descs: List[str] = []
+    parents: List[Optional[str]] = []
+    seen = {}
+    for raw, _, short, long in iter_order_file(path):
+        code = format_code(raw)
+        parent = None
+        for n in range(len(raw) - 1, 2, -1):
+            prefix = raw[:n]
+            if prefix in seen:
+                parent = seen[prefix]
+                break
+        seen[raw] = code
+        codes.append(code)
+        descs.append(long if long_descriptions else short)
+        parents.append(parent)
+    return codes, descs, parents
+
+
+def _stat(path: str) -> Tuple[int, int]:
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def write_cache(path: str, source: str, order: List[str], descs: List[str],
+                parent: array, end: array, depth: array) -> None:
+    """Write the pre-order arrays of an index built from `source` to `path`."""
+    codes_blob = '\n'.join(order).encode('utf-8')
+    descs_blob = '\n'.join(descs).encode('utf-8')
+    size, mtime = _stat(source)
+    header = HEADER.pack(MAGIC, VERSION, 0 if sys.byteorder == 'little' else 1,
+                         len(order), len(codes_blob), len(descs_blob), size, mtime)
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        for chunk in (header, codes_blob, descs_blob, parent.tobytes(), end.tobytes(), depth.tobytes()):
+            f.write(chunk)
+    os.replace(tmp, path)
+
+
+def read_cache(path: str, source: Optional[str] = None
+               ) -> Optional[Tuple[List[str], List[str], array, array, array]]:
+    """
+    Return (codes, descs, parent, end, depth) from the cache at `path`, or None
+    if it is missing, invalid, or older than `source`.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        (magic, version, byteorder, n, codes_size, descs_size,
+         size, mtime) = HEADER.unpack_from(data)
+    except (OSError, struct.error):
+        return None
+    if (magic != MAGIC or version != VERSION
+            or byteorder != (0 if sys.byteorder == 'little' else 1)):
+        return None
+    if source is not None:
+        try:
+            if _stat(source) != (size, mtime):
+                return None
+        except OSError:
+            pass
+    pos = HEADER.size
+    codes = data[pos:pos + codes_size].decode('utf-8').split('\n') if n else []
+    pos += codes_size
+    descs = data[pos:pos + descs_size].decode('utf-8').split('\n') if n else []
+    pos += descs_size
+    arrays = []
+    for typecode in ('i', 'i', 'b'):
+        a = array(typecode)
+        nbytes = n * a.itemsize
+        a.frombytes(data[pos:pos + nbytes])
+        pos += nbytes
+        arrays.append(a)
+    if len(codes) != n or len(descs) != n or pos != len(data):
+        return None
+    return (codes, descs) + tuple(arrays)
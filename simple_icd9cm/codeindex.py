@@ -0,0 +1,113 @@
+"""
+Sorted index of ICD9 codes for prefix and range queries.
+
+ICD9 codes are numeric (`001`-`999`), supplementary V codes (`V01`-`V91`)
+and external-cause E codes (`E800`-`E999`), optionally followed by a decimal
+part.  `code_key` maps a code to a tuple that sorts them in code-book order:
+numeric codes, then V codes, then E codes; by category number; then by the
+decimal digits compared as strings, so `250` < `250.0` < `250.01` < `250.1`.
+
+Chapter and section nodes carry range codes such as `390-459`; `CodeIndex`
+keeps those separately and uses them to answer which ranges contain a code.
+"""
+import re
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_CODE = re.compile(r'^([VE]?)(\d+)(?:\.(\d*))?$')
+_RANK = {'': 0, 'V': 1, 'E': 2}
+# Sorts after any decimal digits, so (rank, n, d + _AFTER) bounds d's descendants.
+_AFTER = '\uffff'
+
+CodeKey = Tuple[int, int, str]
+
+
+def code_key(code: str) -> Optional[CodeKey]:
+    """Code-book sort key for a single code, or None if it is not one."""
+    m = _CODE.match(code.strip().upper())
+    if not m:
+        return None
+    prefix, number, decimals = m.groups()
+    return _RANK[prefix], int(number), decimals or ''
+
+
+def range_bounds(code: str) -> Optional[Tuple[CodeKey, CodeKey]]:
+    """
+    Inclusive key bounds of a range code such as '390-459'; the upper bound
+    covers the end code's descendants (459.9 is inside 390-459).
+    """
+    if '-' not in code:
+        return None
+    start, _, end = code.partition('-')
+    lo, hi = code_key(start), code_key(end)
+    if lo is None or hi is None:
+        return None
+    return lo, hi[:2] + (hi[2] + _AFTER,)
+
+
+class CodeIndex:
+    """
+    Code-ordered index over `nodes` (any objects with `code` and `depth`).
+    Queries return nodes.
+    """
+
+    def __init__(self, nodes: Iterable):
+        entries = []
+        ranges: Dict[int, list] = {}
+        for node in nodes:
+            key = code_key(node.code)
+            if key is not None:
+                entries.append((key, node.code, node))
+                continue
+            bounds = range_bounds(node.code)
+            if bounds is not None:
+                ranges.setdefault(node.depth, []).append(bounds + (node,))
+        entries.sort(key=lambda e: e[:2])
+        self._keys: List[CodeKey] = [key for key, _, _ in entries]
+        self._nodes = [node for _, _, node in entries]
+        lex = sorted(range(len(entries)), key=lambda i: entries[i][1])
+        self._lex_codes: List[str] = [entries[i][1] for i in lex]
+        self._lex_pos: List[int] = lex
+        # Ranges at one depth never overlap, so each depth is searched by
+        # bisecting on the start keys.
+        self._ranges = []
+        for depth in sorted(ranges):
+            level = sorted(ranges[depth], key=lambda r: r[0])
+            self._ranges.append(([r[0] for r in level], level))
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def prefix_search(self, prefix: str) -> List:
+        """Nodes whose code starts with `prefix` (e.g. '250.'), in code order."""
+        prefix = prefix.strip().upper()
+        lo = bisect_left(self._lex_codes, prefix)
+        hi = bisect_left(self._lex_codes, prefix + _AFTER)
+        return [self._nodes[i] for i in sorted(self._lex_pos[lo:hi])]
+
+    def range_search(self, start: str, end: Optional[str] = None) -> List:
+        """
+        Nodes with codes from `start` to `end` inclusive, including the
+        descendants of `end`.  A single range code ('390-459') also works.
+        """
+        if end is None:
+            start, _, end = start.partition('-')
+            end = end or start
+        lo_key, hi_key = code_key(start), code_key(end)
+        if lo_key is None or hi_key is None:
+            raise ValueError(f"not an ICD9 code range: {start}-{end}")
+        lo = bisect_left(self._keys, lo_key)
+        hi = bisect_right(self._keys, hi_key[:2] + (hi_key[2] + _AFTER,))
+        return self._nodes[lo:hi]
+
+    def containing_range(self, code: str) -> List:
+        """Range nodes (chapters, sections) containing `code`, outermost first."""
+        key = code_key(code)
+        if key is None:
+            return []
+        ret = []
+        for starts, level in self._ranges:
+            i = bisect_right(starts, key) - 1
+            if i >= 0 and key <= level[i][1]:
+                ret.append(level[i][2])
+        return ret
@@ -0,0 +1,351 @@
+"""
+Struct-of-arrays representation of the ICD9 hierarchy.
+
+`CompactICD9` loads the same `codes.json` as `icd9cm.ICD9`, but keeps the tree
+in a handful of flat `array` buffers instead of one Python object per node.
+Nodes are numbered in pre-order, so a subtree is the index range
+[i, end[i]) and its leaves are a contiguous run of `leaf_index`.  Codes and
+descriptions are stored once each in a shared string table.
+
+`CompactNode` is a two-slot view over a row of those arrays and exposes the
+same read-only API as `icd9cm.Node`.
+"""
+import json
+import sys
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .icd9cm import DEFAULT_CODES
+from .codeindex import CodeIndex
+from .matcher import DescriptionMatcher, match_notes
+from .textindex import SubstringIndex
+
+NO_NODE = -1
+
+
+class CompactStore:
+    """
+    Flat arrays describing the tree.  Row 0 is the root.
+
+    parent, first_child, next_sibling -- node indices, NO_NODE when absent
+    depth                             -- position in the codes.json hierarchy (root is -1)
+    end                               -- one past the last node of the subtree
+    code, descr                       -- indices into `strings`
+    leaf_lo, leaf_hi                  -- range of the subtree's leaves in `leaf_index`
+    leaf_index                        -- node indices of all leaves, in pre-order
+    by_code                           -- node indices sorted by code string
+    """
+
+    # Every per-node buffer, with its `array` typecode.  `snapshot` writes and
+    # maps them in this order.
+    ARRAYS = (('parent', 'i'), ('depth', 'b'), ('code', 'i'), ('descr', 'i'),
+              ('first_child', 'i'), ('next_sibling', 'i'), ('end', 'i'),
+              ('leaf_lo', 'i'), ('leaf_hi', 'i'), ('leaf_index', 'i'), ('by_code', 'i'))
+
+    def __init__(self, parent: Sequence[int], depth: Sequence[int], code: Sequence[int],
+                 descr: Sequence[int], strings: Sequence[str], **derived: Sequence[int]):
+        self.parent = parent
+        self.depth = depth
+        self.code = code
+        self.descr = descr
+        self.strings = strings
+        if derived:
+            self.__dict__.update(derived)
+        else:
+            self._derive()
+
+    def _derive(self) -> None:
+        """Compute the linkage and index arrays from parent/code."""
+        parent, code, strings = self.parent, self.code, self.strings
+        n = len(parent)
+        self.first_child = array('i', [NO_NODE]) * n
+        self.next_sibling = array('i', [NO_NODE]) * n
+        self.end = array('i', range(1, n + 1))
+        # Pre-order numbering means children appear in order and after their
+        # parent, so one backwards pass links siblings and sizes subtrees.
+        for i in range(n - 1, 0, -1):
+            p = parent[i]
+            self.next_sibling[i] = self.first_child[p]
+            self.first_child[p] = i
+            if self.end[i] > self.end[p]:
+                self.end[p] = self.end[i]
+        self.leaf_index = array('i', (i for i in range(n) if self.first_child[i] == NO_NODE))
+        self.leaf_lo = array('i', [0]) * n
+        self.leaf_hi = array('i', [0]) * n
+        k = 0
+        for i in range(n):
+            self.leaf_lo[i] = k
+            if self.first_child[i] == NO_NODE:
+                k += 1
+        for i in range(n - 1, -1, -1):
+            e = self.end[i]
+            self.leaf_hi[i] = self.leaf_lo[e] if e < n else k
+        self.by_code = array('i', sorted(range(n), key=lambda i: strings[code[i]]))
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    @classmethod
+    def from_hierarchies(cls, allcodes: Iterable[Any]) -> 'CompactStore':
+        """Build the arrays from codes.json-style hierarchies."""
+        # First pass mirrors ICD9.add: nodes are keyed by (depth, code) and
+        # keep their first description; the last parent seen wins.
+        keys: Dict[Tuple[int, str], int] = {}
+        descrs: List[str] = []
+        parents: List[int] = [NO_NODE]
+        children: List[List[int]] = [[]]
+        for hierarchy in allcodes:
+            prev = 0
+            for depth, link in enumerate(hierarchy):
+                if not link['code']:
+                    continue
+                key = (depth, link['code'])
+                node = keys.get(key)
+                if node is None:
+                    node = keys[key] = len(parents)
+                    descrs.append(link.get('descr') or link['code'])
+                    parents.append(prev)
+                    children.append([])
+                    children[prev].append(node)
+                elif parents[node] != prev:
+                    parents[node] = prev
+                    children[prev].append(node)
+                prev = node
+        codes = ['ROOT'] + [code for _, code in keys]
+        depths = [-1] + [d for d, _ in keys]
+        descrs.insert(0, 'ROOT')
+
+        # Renumber in pre-order and intern strings.
+        interned: Dict[str, int] = {}
+        strings: List[str] = []
+
+        def intern(s: str) -> int:
+            idx = interned.get(s)
+            if idx is None:
+                idx = interned[s] = len(strings)
+                strings.append(sys.intern(s))
+            return idx
+
+        parent = array('i')
+        depth = array('b')
+        code = array('i')
+        descr = array('i')
+        stack = [(0, NO_NODE)]
+        while stack:
+            old, new_parent = stack.pop()
+            new = len(parent)
+            parent.append(new_parent)
+            depth.append(depths[old])
+            code.append(intern(codes[old]))
+            descr.append(intern(descrs[old]))
+            stack.extend((child, new) for child in reversed(children[old])
+                         if parents[child] == old)
+        return cls(parent, depth, code, descr, strings)
+
+
+class CompactNode:
+    __slots__ = ('_store', '_i')
+
+    def __init__(self, store: CompactStore, i: int):
+        self._store = store
+        self._i = i
+
+    @property
+    def depth(self) -> int:
+        return self._store.depth[self._i]
+
+    @property
+    def code(self) -> str:
+        s = self._store
+        return s.strings[s.code[self._i]]
+
+    @property
+    def descr(self) -> str:
+        s = self._store
+        return s.strings[s.descr[self._i]]
+
+    @property
+    def description(self) -> str:
+        return self.descr
+
+    @property
+    def parent(self) -> Optional['CompactNode']:
+        p = self._store.parent[self._i]
+        return CompactNode(self._store, p) if p != NO_NODE else None
+
+    @property
+    def children(self) -> List['CompactNode']:
+        s = self._store
+        ret = []
+        c = s.first_child[self._i]
+        while c != NO_NODE:
+            ret.append(CompactNode(s, c))
+            c = s.next_sibling[c]
+        return ret
+
+    @property
+    def root(self) -> 'CompactNode':
+        return CompactNode(self._store, 0)
+
+    @property
+    def parents(self) -> List['CompactNode']:
+        s = self._store
+        ret = []
+        i = self._i
+        while i != NO_NODE:
+            ret.append(CompactNode(s, i))
+            i = s.parent[i]
+        ret.reverse()
+        return ret
+
+    @property
+    def siblings(self) -> List['CompactNode']:
+        parent = self.parent
+        if not parent:
+            return []
+        return parent.children
+
+    @property
+    def leaves(self) -> List['CompactNode']:
+        return list(self.iter_leaves())
+
+    def iter_leaves(self) -> Iterator['CompactNode']:
+        s = self._store
+        for k in range(s.leaf_lo[self._i], s.leaf_hi[self._i]):
+            yield CompactNode(s, s.leaf_index[k])
+
+    @property
+    def codes(self) -> List[str]:
+        return [n.code for n in self.iter_leaves()]
+
+    def leaves_at_depth(self, depth: int) -> List['CompactNode']:
+        return [n for n in self.iter_leaves() if n.depth == depth]
+
+    def walk(self, depth: Optional[int] = None) -> Iterator['CompactNode']:
+        s = self._store
+        i = self._i
+        while i < s.end[self._i]:
+            yield CompactNode(s, i)
+            if depth is not None and s.depth[i] >= depth:
+                i = s.end[i]
+            else:
+                i += 1
+
+    @property
+    def subtree_size(self) -> int:
+        return self._store.end[self._i] - self._i
+
+    def has_descendant(self, node: 'CompactNode') -> bool:
+        return node._store is self._store and self._i <= node._i < self._store.end[self._i]
+
+    def search(self, code: str) -> List['CompactNode']:
+        return [n for n in self.walk() if code in n.code]
+
+    def find(self, code: str) -> Optional['CompactNode']:
+        s = self._store
+        lo, hi = 0, len(s.by_code)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if s.strings[s.code[s.by_code[mid]]] < code:
+                lo = mid + 1
+            else:
+                hi = mid
+        while lo < len(s.by_code):
+            i = s.by_code[lo]
+            if s.strings[s.code[i]] != code:
+                break
+            node = CompactNode(s, i)
+            if self.has_descendant(node):
+                return node
+            lo += 1
+        # Partial codes keep the substring semantics of `search`.
+        nodes = self.search(code)
+        if nodes:
+            return nodes[0]
+        return None
+
+    def find_many(self, codes: Iterable[str]) -> List[Optional['CompactNode']]:
+        return [self.find(code) for code in codes]
+
+    def __eq__(self, other: object) -> bool:
+        return (isinstance(other, CompactNode)
+                and other._store is self._store and other._i == self._i)
+
+    def __hash__(self) -> int:
+        return hash((id(self._store), self._i))
+
+    def __str__(self) -> str:
+        return f"{self.depth}\t{self.code}"
+
+
+class CompactICD9(CompactNode):
+    """Drop-in, read-only alternative to `icd9cm.ICD9` backed by `CompactStore`."""
+
+    def __init__(self, codesfname: Optional[str] = None, store: Optional[CompactStore] = None):
+        if store is None:
+            if codesfname is None:
+                codesfname = DEFAULT_CODES
+            with open(codesfname, 'r') as f:
+                store = CompactStore.from_hierarchies(json.load(f))
+        super().__init__(store, 0)
+        self._matcher: Optional[DescriptionMatcher] = None
+        self._substring_index: Optional[SubstringIndex] = None
+        self._bm25_index = None
+        self._code_index: Optional[CodeIndex] = None
+
+    @property
+    def code_index(self) -> CodeIndex:
+        if self._code_index is None:
+            self._code_index = CodeIndex(self.walk())
+        return self._code_index
+
+    def prefix_search(self, prefix: str) -> List[CompactNode]:
+        return self.code_index.prefix_search(prefix)
+
+    def range_search(self, start: str, end: Optional[str] = None) -> List[CompactNode]:
+        return self.code_index.range_search(start, end)
+
+    def containing_range(self, code: str) -> List[CompactNode]:
+        return self.code_index.containing_range(code)
+
+    @property
+    def matcher(self) -> DescriptionMatcher:
+        if self._matcher is None:
+            self._matcher = DescriptionMatcher(self.iter_leaves())
+        return self._matcher
+
+    @property
+    def substring_index(self) -> SubstringIndex:
+        if self._substring_index is None:
+            self._substring_index = SubstringIndex(self.iter_leaves())
+        return self._substring_index
+
+    @property
+    def bm25_index(self):
+        if self._bm25_index is None:
+            from .lexical import BM25Index
+            self._bm25_index = BM25Index(self.iter_leaves())
+        return self._bm25_index
+
+    def find_codes_for_note(self, note: str, word_boundary: bool = False,
+                            longest_only: bool = False) -> List[Tuple[str, str]]:
+        return self.matcher.find(note, word_boundary, longest_only)
+
+    def find_codes_for_notes(self, notes: Iterable[str], workers: Optional[int] = 1,
+                             chunksize: int = 64, word_boundary: bool = False,
+                             longest_only: bool = False) -> Iterator[List[Tuple[str, str]]]:
+        return match_notes(self.matcher, notes, workers, chunksize, word_boundary, longest_only)
+
+    @classmethod
+    def from_snapshot(cls, path: str, codesfname: Optional[str] = None) -> 'CompactICD9':
+        """
+        Memory-map a snapshot built by `snapshot.build_snapshot`; the arrays
+        stay in the mapping.  Falls back to parsing `codesfname` (or the
+        codes.json the snapshot was built from) when the snapshot is missing,
+        corrupt or stale.
+        """
+        from .snapshot import SnapshotError, load_snapshot
+        try:
+            return cls(store=load_snapshot(path))
+        except SnapshotError as e:
+            return cls(codesfname or e.source)
@@ -0,0 +1,118 @@
+"""
+Lazy lookups in `descriptions.csv` (icd9code, long_description,
+short_description; latin-1, one record per line).
+
+`DescriptionStore` memory-maps the file and, on the first lookup, scans it
+once for the start of every record.  The record offsets are kept sorted by
+normalized code, so a lookup is a bisection and decodes only the one matching
+line.  Nothing else of the file is held in memory.
+
+Codes are normalized by dropping the dot and upper-casing, so '001.0',
+'0010' and 'e800.0' find the same records as the codes in the file.
+"""
+import csv
+import mmap
+import os
+from array import array
+from bisect import bisect_left
+from typing import Iterator, List, Optional, Tuple
+
+ENCODING = 'latin-1'
+
+
+def normalize(code: str) -> str:
+    """Dotless, upper-case form of a code: '001.0' -> '0010'."""
+    return code.strip().replace('.', '').upper()
+
+
+class DescriptionStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._mm: Optional[mmap.mmap] = None
+        self._keys: Optional[List[str]] = None
+        self._offsets: array = array('I')
+
+    def __reduce__(self):
+        # Reopen (and re-index on demand) instead of pickling the mapping.
+        return type(self), (self.path,)
+
+    def _index(self) -> None:
+        with open(self.path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                self._keys = []
+                return
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        entries = []
+        pos = mm.find(b'\n') + 1  # skip the header
+        size = len(mm)
+        while 0 < pos < size:
+            end = mm.find(b'\n', pos)
+            if end < 0:
+                end = size
+            comma = mm.find(b',', pos, end)
+            if comma > pos:
+                entries.append((normalize(mm[pos:comma].decode(ENCODING)), pos))
+            pos = end + 1
+        entries.sort()
+        self._keys = [key for key, _ in entries]
+        self._offsets = array('I', (offset for _, offset in entries))
+        self._mm = mm
+
+    def _record(self, i: int) -> Tuple[str, str, str]:
+        mm = self._mm
+        start = self._offsets[i]
+        end = mm.find(b'\n', start)
+        line = mm[start:end if end >= 0 else len(mm)].decode(ENCODING).rstrip('\r')
+        row = next(csv.reader([line]))
+        row += [''] * (3 - len(row))
+        return row[0], row[1], row[2]
+
+    def _find(self, code: str) -> int:
+        if self._keys is None:
+            self._index()
+        key = normalize(code)
+        i = bisect_left(self._keys, key)
+        return i if i < len(self._keys) and self._keys[i] == key else -1
+
+    def get(self, code: str) -> Optional[Tuple[str, str]]:
+        """(long, short) description of `code`, dotted or dotless, or None."""
+        i = self._find(code)
+        if i < 0:
+            return None
+        _, long, short = self._record(i)
+        return long, short
+
+    def long(self, code: str) -> Optional[str]:
+        found = self.get(code)
+        return found[0] if found else None
+
+    def short(self, code: str) -> Optional[str]:
+        found = self.get(code)
+        return found[1] if found else None
+
+    def __contains__(self, code: str) -> bool:
+        return self._find(code) >= 0
+
+    def __len__(self) -> int:
+        if self._keys is None:
+            self._index()
+        return len(self._keys)
+
+    def __iter__(self) -> Iterator[str]:
+        """The codes as written in the file, in normalized-code order."""
+        if self._keys is None:
+            self._index()
+        for i in range(len(self._keys)):
+            yield self._record(i)[0]
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+        self._mm = None
+        self._keys = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -1,10 +1,23 @@
 import json
 import os
 from collections import defaultdict, Counter
-from typing import List, Optional, Any
-import re
+from bisect import bisect_left
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple, Any, Union
+
+from .codeindex import CodeIndex
+from .descriptions import DescriptionStore
+from .matcher import DescriptionMatcher, match_notes
+from .textindex import SubstringIndex
+
+if TYPE_CHECKING:
+    from .lexical import BM25Index
+
+DEFAULT_CODES = os.path.join(os.path.dirname(__file__), 'codes.json')
 
 class Node:
+    # Set by ICD9.get_node so lookups can use the tree-wide code index.
+    _tree: Optional['ICD9'] = None
+
     def __init__(self, depth: int, code: str, descr: Optional[str] = None):
         self.depth: int = depth
         self.descr: str = descr or code
@@ -25,21 +38,74 @@ class Node:
         return ret
 
     def find(self, code: str) -> Optional['Node']:
+        tree = self._tree
+        if tree is not None:
+            node = tree.lookup(code, within=self)
+            if node is not None:
+                return node
+        # Partial codes keep the substring semantics of `search`.
         nodes = self.search(code)
         if nodes:
             return nodes[0]
         return None
 
+    def find_many(self, codes: Iterable[str]) -> List[Optional['Node']]:
+        return [self.find(code) for code in codes]
+
+    def has_descendant(self, node: 'Node') -> bool:
+        """True if `node` is in the subtree rooted here (including self)."""
+        tree = self._numbered()
+        if tree is not None and node._tree is tree:
+            return self._pre <= node._pre < self._post
+        while node is not None and node.depth > self.depth:
+            node = node.parent
+        return node is self
+
+    def _numbered(self) -> Optional['ICD9']:
+        """The owning tree with up-to-date interval numbering, if any."""
+        tree = self._tree
+        if tree is None:
+            return None
+        tree.number()
+        return tree
+
     @property
     def root(self) -> 'Node':
         return self.parents[0]
 
     @property
     def description(self) -> str:
+        """
+        The description from codes.json; for nodes that have none, the long
+        description from the tree's `descriptions` store, looked up on access.
+        """
+        if self.descr == self.code:
+            store = self._descriptions()
+            if store is not None:
+                return store.long(self.code) or self.descr
         return self.descr
 
+    @property
+    def long_description(self) -> Optional[str]:
+        """Long description from the tree's `descriptions` store, if attached and listed."""
+        store = self._descriptions()
+        return store.long(self.code) if store is not None else None
+
+    @property
+    def short_description(self) -> Optional[str]:
+        """Short description from the tree's `descriptions` store, if attached and listed."""
+        store = self._descriptions()
+        return store.short(self.code) if store is not None else None
+
+    def _descriptions(self) -> Optional[DescriptionStore]:
+        tree = self._tree
+        return tree.descriptions if tree is not None else None
+
     @property
     def codes(self) -> List[str]:
+        tree = self._numbered()
+        if tree is not None:
+            return tree._leaf_codes[self._leaf_lo:self._leaf_hi]
         return [n.code for n in self.leaves]
 
     @property
@@ -54,6 +120,9 @@ class Node:
 
     @property
     def leaves(self) -> List['Node']:
+        tree = self._numbered()
+        if tree is not None:
+            return tree._leaves[self._leaf_lo:self._leaf_hi]
         leaves = set()
         if not self.children:
             return [self]
@@ -62,8 +131,44 @@ class Node:
         return list(leaves)
 
     def leaves_at_depth(self, depth: int) -> List['Node']:
+        tree = self._numbered()
+        if tree is not None:
+            pres, nodes = tree._depth2leaves.get(depth, ([], []))
+            return nodes[bisect_left(pres, self._pre):bisect_left(pres, self._post)]
         return [n for n in self.leaves if n.depth == depth]
 
+    def iter_leaves(self) -> Iterator['Node']:
+        """Yield the leaves under this node in pre-order, without building a list."""
+        tree = self._numbered()
+        if tree is not None:
+            leaves = tree._leaves
+            for i in range(self._leaf_lo, self._leaf_hi):
+                yield leaves[i]
+            return
+        for node in self.walk():
+            if not node.children:
+                yield node
+
+    def walk(self, depth: Optional[int] = None) -> Iterator['Node']:
+        """
+        Yield this node and its descendants in pre-order.  With `depth`, nodes
+        deeper than that (absolute) depth are not visited.
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            if depth is None or node.depth < depth:
+                stack.extend(reversed(node.children))
+
+    @property
+    def subtree_size(self) -> int:
+        """Number of nodes in the subtree rooted here, including self."""
+        tree = self._numbered()
+        if tree is not None:
+            return self._post - self._pre
+        return sum(1 for _ in self.walk())
+
     @property
     def siblings(self) -> List['Node']:
         parent = self.parent
@@ -78,26 +183,159 @@ class Node:
         return hash(str(self))
 
 class ICD9(Node):
-    def __init__(self, codesfname: Optional[str] = None):
+    _code2node: Optional[Dict[str, Node]] = None
+    # Interval numbering, rebuilt by `number` after the tree changes.
+    _leaves: Optional[List[Node]] = None
+    _leaf_codes: List[str]
+    _depth2leaves: Dict[int, Tuple[List[int], List[Node]]]
+    _matcher: Optional[DescriptionMatcher] = None
+    _substring_index: Optional[SubstringIndex] = None
+    _bm25_index: Optional['BM25Index'] = None
+    _code_index: Optional[CodeIndex] = None
+    # Long/short descriptions by code (see `attach_descriptions`).
+    descriptions: Optional[DescriptionStore] = None
+
+    def __init__(self, codesfname: Optional[str] = None,
+                 descriptions: Optional[Union[str, DescriptionStore]] = None):
         self.depth2nodes: dict[int, dict[str, Node]] = defaultdict(dict)
         super().__init__(-1, 'ROOT')
+        self.attach_descriptions(descriptions)
         if codesfname is None:
-            codesfname = os.path.join(os.path.dirname(__file__), 'codes.json')
+            codesfname = DEFAULT_CODES
         with open(codesfname, 'r') as f:
             allcodes = json.load(f)
             self.process(allcodes)
 
+    def attach_descriptions(self, descriptions: Optional[Union[str, DescriptionStore]]) -> None:
+        """
+        Resolve descriptions through `descriptions` (a descriptions.csv path
+        or a `DescriptionStore`); the file is only read on the first lookup.
+        """
+        if isinstance(descriptions, str):
+            descriptions = DescriptionStore(descriptions)
+        self.descriptions = descriptions
+
+    @classmethod
+    def from_snapshot(cls, path: str, codesfname: Optional[str] = None,
+                      descriptions: Optional[Union[str, DescriptionStore]] = None) -> 'ICD9':
+        """
+        Load the tree from a binary snapshot built by `snapshot.build_snapshot`.
+        Falls back to parsing `codesfname` (or the codes.json the snapshot was
+        built from) when the snapshot is missing, corrupt or stale.
+        """
+        from .snapshot import SnapshotError, load_snapshot
+        try:
+            store = load_snapshot(path)
+        except SnapshotError as e:
+            return cls(codesfname or e.source, descriptions)
+        tree = cls.__new__(cls)
+        tree.depth2nodes = defaultdict(dict)
+        Node.__init__(tree, -1, 'ROOT')
+        tree.attach_descriptions(descriptions)
+        strings = store.strings
+        nodes: List[Node] = [tree]
+        for i in range(1, len(store)):
+            node = Node(store.depth[i], strings[store.code[i]], strings[store.descr[i]])
+            node._tree = tree
+            parent = nodes[store.parent[i]]
+            node.parent = parent
+            parent.children.append(node)
+            tree.depth2nodes[node.depth].setdefault(node.code, node)
+            nodes.append(node)
+        tree.number()
+        return tree
+
     def process(self, allcodes: Any) -> None:
         for hierarchy in allcodes:
             self.add(hierarchy)
+        self.number()
+
+    def number(self) -> None:
+        """
+        Assign each node its pre-order interval [_pre, _post) and the range
+        [_leaf_lo, _leaf_hi) of its leaves, which are laid out contiguously in
+        pre-order.  Subtree queries then become slices of `_leaves`.  No-op
+        unless the tree changed since the last call.  A code listed under
+        several parents is numbered once, under its `parent`.
+        """
+        if self._leaves is not None:
+            return
+        leaves: List[Node] = []
+        depth2leaves: Dict[int, Tuple[List[int], List[Node]]] = {}
+        pre = 0
+        stack: List[Tuple[Node, bool]] = [(self, False)]
+        while stack:
+            node, done = stack.pop()
+            if done:
+                node._post = pre
+                node._leaf_hi = len(leaves)
+                continue
+            node._pre = pre
+            node._leaf_lo = len(leaves)
+            pre += 1
+            if not node.children:
+                leaves.append(node)
+                pres, nodes = depth2leaves.setdefault(node.depth, ([], []))
+                pres.append(node._pre)
+                nodes.append(node)
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node.children)
+                         if child.parent is node)
+        self._leaf_codes = [n.code for n in leaves]
+        self._depth2leaves = depth2leaves
+        self._leaves = leaves
+
+    @property
+    def _tree(self) -> 'ICD9':
+        return self
+
+    @property
+    def code2node(self) -> Dict[str, Node]:
+        """
+        Hash index from code to node, built lazily from `depth2nodes`.
+        A code present at several depths maps to its shallowest node.
+        """
+        if self._code2node is None:
+            index: Dict[str, Node] = {}
+            for depth in sorted(self.depth2nodes):
+                for code, node in self.depth2nodes[depth].items():
+                    index.setdefault(code, node)
+            self._code2node = index
+        return self._code2node
+
+    def lookup(self, code: str, within: Optional[Node] = None) -> Optional[Node]:
+        """
+        Exact-code lookup through the index.  With `within`, only nodes in
+        that subtree are returned.
+        """
+        if within is None:
+            within = self
+        if code == within.code:
+            return within
+        node = self.code2node.get(code)
+        if node is None or within is self or within.has_descendant(node):
+            return node
+        for depth, nodes in self.depth2nodes.items():
+            if depth > within.depth:
+                node = nodes.get(code)
+                if node is not None and within.has_descendant(node):
+                    return node
+        return None
 
     def get_node(self, depth: int, code: str, descr: str) -> Node:
         d = self.depth2nodes[depth]
         if code not in d:
-            d[code] = Node(depth, code, descr)
+            node = d[code] = Node(depth, code, descr)
+            node._tree = self
+            self._code2node = None
         return d[code]
 
     def add(self, hierarchy: Any) -> None:
+        self._leaves = None
+        self._matcher = None
+        self._substring_index = None
+        self._bm25_index = None
+        self._code_index = None
         prev_node = self
         for depth, link in enumerate(hierarchy):
             if not link['code']:
@@ -105,17 +343,70 @@ class ICD9(Node):
             code = link['code']
             descr = link['descr'] if 'descr' in link else code
             node = self.get_node(depth, code, descr)
-            node.parent = prev_node
-            prev_node.add_child(node)
+            # Skip the linear membership check when the edge already exists.
+            if node.parent is not prev_node:
+                node.parent = prev_node
+                prev_node.add_child(node)
             prev_node = node 
 
-    def find_codes_for_note(self, note: str) -> list[tuple[str, str]]:
+    @property
+    def code_index(self) -> CodeIndex:
+        """Code-ordered index over every node, built once per tree."""
+        if self._code_index is None:
+            self._code_index = CodeIndex(self.walk())
+        return self._code_index
+
+    def prefix_search(self, prefix: str) -> List[Node]:
+        """Nodes whose code starts with `prefix` (e.g. '250.'), in code order."""
+        return self.code_index.prefix_search(prefix)
+
+    def range_search(self, start: str, end: Optional[str] = None) -> List[Node]:
+        """Nodes with codes in [start, end], e.g. ('390', '459') or '390-459'."""
+        return self.code_index.range_search(start, end)
+
+    def containing_range(self, code: str) -> List[Node]:
+        """Chapter/section range nodes containing `code`, outermost first."""
+        return self.code_index.containing_range(code)
+
+    @property
+    def matcher(self) -> DescriptionMatcher:
+        """Aho-Corasick automaton over the leaf descriptions, built once per tree."""
+        if self._matcher is None:
+            self._matcher = DescriptionMatcher(self.iter_leaves())
+        return self._matcher
+
+    @property
+    def substring_index(self) -> SubstringIndex:
+        """Keyword-to-leaf index over the leaf descriptions, built once per tree."""
+        if self._substring_index is None:
+            self._substring_index = SubstringIndex(self.iter_leaves())
+        return self._substring_index
+
+    @property
+    def bm25_index(self) -> 'BM25Index':
+        """BM25 index over the leaf descriptions, built once per tree (needs NumPy)."""
+        if self._bm25_index is None:
+            from .lexical import BM25Index
+            self._bm25_index = BM25Index(self.iter_leaves())
+        return self._bm25_index
+
+    def find_codes_for_note(self, note: str, word_boundary: bool = False,
+                            longest_only: bool = False) -> list[tuple[str, str]]:
         """
         Return all codes whose description matches the note (case-insensitive substring match).
+        With `word_boundary`, matches must not start or end inside a word; with
+        `longest_only`, matches contained in a longer match are dropped.
+        """
+        return self.matcher.find(note, word_boundary, longest_only)
+
+    def find_codes_for_notes(self, notes: Iterable[str], workers: Optional[int] = 1,
+                             chunksize: int = 64, word_boundary: bool = False,
+                             longest_only: bool = False) -> Iterator[list[tuple[str, str]]]:
+        """
+        Streaming `find_codes_for_note` over many notes; yields one result per
+        note, in input order.  `workers` > 1 (or None for one per CPU) fans the
+        notes out to a process pool in chunks of `chunksize`; each worker gets
+        the matcher once.  Input is consumed lazily, so unbounded iterables are
+        fine.
         """
-        note = note.lower()
-        results = []
-        for leaf in self.leaves:
-            if leaf.description and re.search(re.escape(leaf.description.lower()), note):
-                results.append((leaf.code, leaf.description))
-        return results 
\ No newline at end of file
+        return match_notes(self.matcher, notes, workers, chunksize, word_boundary, longest_only) 
\ No newline at end of file
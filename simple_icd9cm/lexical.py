@@ -0,0 +1,101 @@
+"""
+BM25 ranking of ICD9 leaves against free text.
+
+`SubstringIndex` says which leaves contain a keyword, not which fit a note
+best.  `BM25Index` scores a note against every leaf description with Okapi
+BM25.  The term-document matrix is built once, term-major (CSC-like: for each
+term, the leaves containing it and their precomputed BM25 weights, in flat
+NumPy arrays), so scoring a note is one `np.bincount` over the postings of
+its terms, and the top k come from `np.argpartition`.
+
+Requires NumPy.
+"""
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+_TOKEN = re.compile(r'[^\W_]+')
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    BM25 over the descriptions of `leaves` (any objects with `code` and
+    `description`), with the usual `k1` and `b` parameters.
+    """
+
+    def __init__(self, leaves: Iterable, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.codes: List[str] = []
+        docs: List[Counter] = []
+        for leaf in leaves:
+            self.codes.append(leaf.code)
+            docs.append(Counter(tokenize(leaf.description or '')))
+        self.position: Dict[str, int] = {code: i for i, code in enumerate(self.codes)}
+        n_docs = len(docs)
+
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        for doc, counts in enumerate(docs):
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc, tf))
+        self.vocabulary: Dict[str, int] = {term: i for i, term in enumerate(postings)}
+        # postings of term t: doc_ids[indptr[t]:indptr[t + 1]], weights likewise
+        self.indptr = np.zeros(len(postings) + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum([len(p) for p in postings.values()])
+        pairs = np.array([pair for p in postings.values() for pair in p], dtype=np.int64).reshape(-1, 2)
+        self.doc_ids = pairs[:, 0].astype(np.int32)
+        tf = pairs[:, 1].astype(np.float32)
+
+        lengths = np.array([sum(c.values()) for c in docs], dtype=np.float32)
+        avg_length = float(lengths.mean()) if n_docs and lengths.mean() > 0 else 1.0
+        df = np.diff(self.indptr).astype(np.float32)
+        self.idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        term_of = np.repeat(np.arange(len(postings)), np.diff(self.indptr))
+        norm = k1 * (1 - b + b * lengths[self.doc_ids] / avg_length)
+        self.weights = (self.idf[term_of] * tf * (k1 + 1) / (tf + norm)).astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def scores(self, text: str) -> np.ndarray:
+        """BM25 score of `text` against every leaf, in leaf order."""
+        slices, factors = [], []
+        for term, count in Counter(tokenize(text)).items():
+            t = self.vocabulary.get(term)
+            if t is not None:
+                slices.append(slice(self.indptr[t], self.indptr[t + 1]))
+                factors.append(np.full(self.indptr[t + 1] - self.indptr[t], count, dtype=np.float32))
+        if not slices:
+            return np.zeros(len(self.codes), dtype=np.float32)
+        docs = np.concatenate([self.doc_ids[s] for s in slices])
+        weights = np.concatenate([self.weights[s] for s in slices]) * np.concatenate(factors)
+        return np.bincount(docs, weights=weights, minlength=len(self.codes)).astype(np.float32)
+
+    def search(self, text: str, k: int = 10) -> List[Tuple[str, float]]:
+        """The `k` best-scoring leaves as (code, score), best first; leaves scoring 0 are left out."""
+        scores = self.scores(text)
+        k = min(k, int(np.count_nonzero(scores)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((top, -scores[top]))]
+        return [(self.codes[i], float(scores[i])) for i in top]
+
+    def rank(self, text: str, codes: Sequence[str],
+             scores: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
+        """
+        `codes` as (code, score), best first; ties and codes that are not
+        leaves of the index keep their order, after the scored ones.
+        """
+        if scores is None:
+            scores = self.scores(text)
+        positions = np.array([self.position.get(code, -1) for code in codes], dtype=np.int64)
+        ranked = np.where(positions >= 0, scores[positions], -np.inf)
+        order = np.argsort(-ranked, kind='stable')
+        return [(codes[i], float(max(ranked[i], 0.0))) for i in order]
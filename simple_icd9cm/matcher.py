@@ -0,0 +1,210 @@
+"""
+Aho-Corasick matcher over ICD9 leaf descriptions.
+
+`ICD9.find_codes_for_note` used to run one regex search per leaf.  The
+`DescriptionMatcher` compiles every lowercased leaf description into a single
+automaton, so a note is scanned once, in time linear in its length plus the
+number of matches.
+
+The trie is built breadth-first from the sorted, de-duplicated patterns, so
+the children of every state are a contiguous, character-sorted run of state
+ids.  Transitions are then a bisect over that run, and the whole automaton
+lives in a few flat `array`s rather than one dict per state.
+"""
+import os
+from array import array
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+
+def _is_word_char(c: str) -> bool:
+    return c.isalnum() or c == '_'
+
+
+class DescriptionMatcher:
+    """
+    Match notes against the descriptions of `leaves` (any objects with `code`
+    and `description`).  Results keep the order of `leaves`.
+    """
+
+    def __init__(self, leaves: Iterable):
+        self.entries: List[Tuple[str, str]] = [(leaf.code, leaf.description) for leaf in leaves]
+        by_pattern = {}
+        for i, (_, descr) in enumerate(self.entries):
+            if descr:
+                by_pattern.setdefault(descr.lower(), []).append(i)
+        self.patterns: List[str] = sorted(by_pattern)
+        # entry indices for each pattern id
+        self.pattern_entries: List[List[int]] = [by_pattern[p] for p in self.patterns]
+        self._build()
+
+    def _build(self) -> None:
+        patterns = self.patterns
+        edge = array('I', [0])        # character leading into each state
+        child_lo = array('i')         # children of state s are ids child_lo[s]:child_hi[s]
+        child_hi = array('i')
+        terminal = array('i')         # pattern id ending at the state, or -1
+
+        # Each queued state covers patterns[lo:hi], which share its first
+        # `depth` characters; state ids are handed out in queue order.
+        queue = deque([(0, len(patterns), 0)])
+        next_id = 1
+        while queue:
+            lo, hi, depth = queue.popleft()
+            if lo < hi and len(patterns[lo]) == depth:
+                terminal.append(lo)
+                lo += 1
+            else:
+                terminal.append(-1)
+            child_lo.append(next_id)
+            i = lo
+            while i < hi:
+                c = patterns[i][depth]
+                j = i + 1
+                while j < hi and patterns[j][depth] == c:
+                    j += 1
+                edge.append(ord(c))
+                queue.append((i, j, depth + 1))
+                next_id += 1
+                i = j
+            child_hi.append(next_id)
+
+        # Failure links, breadth-first so parents are done before children.
+        n = next_id
+        fail = array('i', [0]) * n
+        out_link = array('i', [0]) * n  # nearest proper suffix state that is terminal
+        self.edge, self.child_lo, self.child_hi, self.terminal = edge, child_lo, child_hi, terminal
+        self.fail, self.out_link = fail, out_link
+        for s in range(n):
+            for child in range(child_lo[s], child_hi[s]):
+                if s == 0:
+                    f = 0
+                else:
+                    f = self._step(fail[s], edge[child])
+                fail[child] = f
+                out_link[child] = f if terminal[f] >= 0 else out_link[f]
+
+    def _goto(self, s: int, c: int) -> int:
+        lo, hi = self.child_lo[s], self.child_hi[s]
+        j = bisect_left(self.edge, c, lo, hi)
+        if j < hi and self.edge[j] == c:
+            return j
+        return -1
+
+    def _step(self, s: int, c: int) -> int:
+        while True:
+            nxt = self._goto(s, c)
+            if nxt >= 0:
+                return nxt
+            if s == 0:
+                return 0
+            s = self.fail[s]
+
+    def _occurrences(self, text: str) -> Iterable[Tuple[int, int]]:
+        """Yield (pattern id, end index exclusive) for every occurrence in `text`."""
+        terminal, out_link = self.terminal, self.out_link
+        s = 0
+        for end, ch in enumerate(text, 1):
+            s = self._step(s, ord(ch))
+            t = s if terminal[s] >= 0 else out_link[s]
+            while t:
+                yield terminal[t], end
+                t = out_link[t]
+
+    def match_patterns(self, note: str, word_boundary: bool = False,
+                       longest_only: bool = False) -> List[int]:
+        """Sorted ids of the patterns found in `note`."""
+        text = note.lower()
+        if not word_boundary and not longest_only:
+            return sorted({pid for pid, _ in self._occurrences(text)})
+
+        spans = []
+        for pid, end in self._occurrences(text):
+            start = end - len(self.patterns[pid])
+            if word_boundary and ((start > 0 and _is_word_char(text[start - 1])
+                                   and _is_word_char(text[start]))
+                                  or (end < len(text) and _is_word_char(text[end])
+                                      and _is_word_char(text[end - 1]))):
+                continue
+            spans.append((start, -end, pid))
+        if not longest_only:
+            return sorted({pid for _, _, pid in spans})
+        # Keep occurrences not covered by a longer one: sorted by start and
+        # then by decreasing end, a span is covered iff an earlier span
+        # reaches at least as far.
+        spans.sort()
+        kept = set()
+        reach = -1
+        for start, neg_end, pid in spans:
+            if -neg_end > reach:
+                kept.add(pid)
+                reach = -neg_end
+        return sorted(kept)
+
+    def find(self, note: str, word_boundary: bool = False,
+             longest_only: bool = False) -> List[Tuple[str, str]]:
+        """
+        (code, description) of every entry whose description occurs in `note`,
+        case-insensitively.  `word_boundary` only accepts matches that do not
+        start or end inside a word; `longest_only` drops matches contained in a
+        longer match.
+        """
+        hits: List[int] = []
+        for pid in self.match_patterns(note, word_boundary, longest_only):
+            hits.extend(self.pattern_entries[pid])
+        hits.sort()
+        return [self.entries[i] for i in hits]
+
+
+# Per-process matcher for `match_notes` workers, installed once by the pool
+# initializer rather than shipped with every chunk.
+_worker_matcher: Optional[DescriptionMatcher] = None
+
+
+def _init_worker(matcher: DescriptionMatcher) -> None:
+    global _worker_matcher
+    _worker_matcher = matcher
+
+
+def _match_chunk(notes: List[str], word_boundary: bool,
+                 longest_only: bool) -> List[List[Tuple[str, str]]]:
+    return [_worker_matcher.find(note, word_boundary, longest_only) for note in notes]
+
+
+def match_notes(matcher: DescriptionMatcher, notes: Iterable[str], workers: Optional[int] = None,
+                chunksize: int = 64, word_boundary: bool = False, longest_only: bool = False,
+                max_pending: Optional[int] = None) -> Iterator[List[Tuple[str, str]]]:
+    """
+    Yield `matcher.find(note)` for each note, in input order.
+
+    With more than one worker, notes are cut into chunks of `chunksize` and
+    fanned out to a process pool whose workers each receive the matcher once.
+    At most `max_pending` chunks (default: twice the worker count) are in
+    flight, so memory stays bounded however long `notes` is.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        for note in notes:
+            yield matcher.find(note, word_boundary, longest_only)
+        return
+    if max_pending is None:
+        max_pending = 2 * workers
+    notes = iter(notes)
+    executor = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(matcher,))
+    pending = deque()
+    try:
+        while True:
+            while len(pending) < max_pending:
+                chunk = list(islice(notes, chunksize))
+                if not chunk:
+                    break
+                pending.append(executor.submit(_match_chunk, chunk, word_boundary, longest_only))
+            if not pending:
+                return
+            yield from pending.popleft().result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,102 @@
+"""
+Process-wide registry of shared ICD9 trees.
+
+Every `ICD9()` call parses codes.json again.  `shared_icd9` instead returns a
+`SharedICD9` proxy that loads the tree on first attribute access, through a
+registry keyed by the resolved path and mtime of the file, so every consumer
+in the process shares one tree.  Nothing stops a consumer from changing the
+tree (`add`, or editing a node's `children`), and every other consumer sees
+the change, so leave it as loaded.  The proxy only refuses attribute
+assignment on itself, and copying or pickling it re-attaches to the registry
+instead of duplicating the tree.
+"""
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from .icd9cm import DEFAULT_CODES, ICD9
+
+
+class ICD9Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._trees: Dict[str, Tuple[int, ICD9]] = {}
+        # loads: trees actually parsed; hits: loads avoided by sharing;
+        # reloads: trees replaced because their file changed on disk
+        self.stats: Dict[str, int] = {'loads': 0, 'hits': 0, 'reloads': 0}
+
+    def load(self, codesfname: Optional[str] = None) -> ICD9:
+        """Return the shared tree for `codesfname`, parsing it only if needed."""
+        path = os.path.realpath(codesfname or DEFAULT_CODES)
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            entry = self._trees.get(path)
+            if entry is not None and entry[0] == mtime:
+                self.stats['hits'] += 1
+                return entry[1]
+            tree = ICD9(path)
+            self.stats['reloads' if entry is not None else 'loads'] += 1
+            self._trees[path] = (mtime, tree)
+            return tree
+
+    def get(self, codesfname: Optional[str] = None) -> 'SharedICD9':
+        """A lazy proxy; nothing is read until it is first used."""
+        return SharedICD9(codesfname, self)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._trees.clear()
+            for key in self.stats:
+                self.stats[key] = 0
+
+
+class SharedICD9:
+    """Lazily loading stand-in for a shared `ICD9` tree."""
+    __slots__ = ('_codesfname', '_registry', '_tree')
+
+    def __init__(self, codesfname: Optional[str], registry: ICD9Registry):
+        object.__setattr__(self, '_codesfname', codesfname)
+        object.__setattr__(self, '_registry', registry)
+        object.__setattr__(self, '_tree', None)
+
+    def _load(self) -> ICD9:
+        tree = self._tree
+        if tree is None:
+            tree = self._registry.load(self._codesfname)
+            object.__setattr__(self, '_tree', tree)
+        return tree
+
+    def __getattr__(self, name: str):
+        return getattr(self._load(), name)
+
+    # isinstance(proxy, ICD9) holds, as for the tree itself.
+    @property
+    def __class__(self):
+        return type(self._load())
+
+    def __setattr__(self, name: str, value) -> None:
+        raise AttributeError('cannot rebind attributes of a shared ICD9 tree')
+
+    def __copy__(self) -> 'SharedICD9':
+        return self
+
+    def __deepcopy__(self, memo) -> 'SharedICD9':
+        return self
+
+    def __reduce__(self):
+        return shared_icd9, (self._codesfname,)
+
+    def __str__(self) -> str:
+        return str(self._load())
+
+    def __repr__(self) -> str:
+        state = 'loaded' if self._tree is not None else 'not loaded'
+        return f"<SharedICD9 {self._codesfname or DEFAULT_CODES} ({state})>"
+
+
+registry = ICD9Registry()
+
+
+def shared_icd9(codesfname: Optional[str] = None) -> SharedICD9:
+    """Shared, lazily loaded ICD9 tree from the process-wide registry."""
+    return registry.get(codesfname)
@@ -0,0 +1,223 @@
+"""
+Versioned binary snapshot of the ICD9 hierarchy.
+
+`build_snapshot` compiles `codes.json` (and optionally `descriptions.csv`) into
+a single file holding the `CompactStore` arrays and string table.
+`load_snapshot` memory-maps that file and hands back a `CompactStore` whose
+arrays are zero-copy views into the mapping, so loading costs a checksum and a
+few `memoryview.cast` calls.
+
+Layout (little-endian header, arrays in native byte order):
+
+    header      HEADER struct, then the source paths as length-prefixed UTF-8
+    directory   one DIRENT per entry in CompactStore.ARRAYS, plus one each for
+                the string offsets and the string blob
+    sections    the raw buffers, each aligned to 8 bytes
+
+The CRC32 in the header covers everything after the header.  The header also
+records the size and mtime of the source files; a snapshot whose sources have
+changed since it was built is reported as stale.
+
+    python -m simple_icd9cm.snapshot codes.json codes.snap --descriptions descriptions.csv
+"""
+import argparse
+import csv
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .compact import CompactStore
+
+MAGIC = b'ICD9SNAP'
+VERSION = 1
+# magic, version, byteorder (0 little / 1 big), node count, crc32,
+# codes.json size + mtime_ns, descriptions size + mtime_ns (-1 when absent)
+HEADER = struct.Struct('<8sIIIIqqqq')
+DIRENT = struct.Struct('<cxxxIQ')
+ALIGN = 8
+
+
+class SnapshotError(Exception):
+    """
+    The snapshot is missing, corrupt, from another version or stale.
+    `source` is the codes.json it was built from, when the header was readable.
+    """
+
+    def __init__(self, msg: str, source: Optional[str] = None):
+        super().__init__(msg)
+        self.source = source
+
+
+class StringTable(Sequence[str]):
+    """Read-only string table decoded on access from an offsets buffer and a UTF-8 blob."""
+
+    def __init__(self, offsets: Sequence[int], blob: memoryview):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return str(self._blob[self._offsets[i]:self._offsets[i + 1]], 'utf-8')
+
+
+def _stat(path: Optional[str]) -> Tuple[int, int]:
+    if not path:
+        return -1, -1
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def _pack_str(s: str) -> bytes:
+    b = s.encode('utf-8')
+    return struct.pack('<H', len(b)) + b
+
+
+def _pad(n: int) -> int:
+    return -n % ALIGN
+
+
+def read_descriptions(path: str) -> Dict[str, str]:
+    """Map code -> long description from a descriptions.csv file."""
+    with open(path, newline='', encoding='latin-1') as f:
+        return {row['icd9code']: row['long_description'] for row in csv.DictReader(f)}
+
+
+def build_snapshot(codesfname: str, path: str, descriptionsfname: Optional[str] = None) -> CompactStore:
+    """
+    Compile `codesfname` into a snapshot at `path`.  Nodes that have no
+    description in codes.json take the long description from
+    `descriptionsfname`, when given.
+    """
+    with open(codesfname, 'r') as f:
+        store = CompactStore.from_hierarchies(json.load(f))
+    if descriptionsfname:
+        descriptions = read_descriptions(descriptionsfname)
+        strings = list(store.strings)
+        index = {s: i for i, s in enumerate(strings)}
+        for i in range(len(store)):
+            code = strings[store.code[i]]
+            if store.descr[i] == store.code[i] and code in descriptions:
+                descr = descriptions[code]
+                if descr not in index:
+                    index[descr] = len(strings)
+                    strings.append(descr)
+                store.descr[i] = index[descr]
+        store.strings = strings
+
+    encoded = [s.encode('utf-8') for s in store.strings]
+    offsets = array('I', [0])
+    for b in encoded:
+        offsets.append(offsets[-1] + len(b))
+    buffers: List[Tuple[str, bytes, int]] = []
+    for name, typecode in CompactStore.ARRAYS:
+        data = getattr(store, name)
+        buffers.append((typecode, data.tobytes(), len(data)))
+    buffers.append(('I', offsets.tobytes(), len(offsets)))
+    buffers.append(('B', b''.join(encoded), offsets[-1]))
+
+    codes_size, codes_mtime = _stat(codesfname)
+    descr_size, descr_mtime = _stat(descriptionsfname)
+    paths = _pack_str(os.path.abspath(codesfname)) + _pack_str(
+        os.path.abspath(descriptionsfname) if descriptionsfname else '')
+    body_start = HEADER.size + len(paths)
+    body_start += _pad(body_start)
+    pos = body_start + DIRENT.size * len(buffers)
+    directory = bytearray()
+    sections = bytearray()
+    for typecode, data, count in buffers:
+        pad = _pad(pos)
+        sections += b'\0' * pad
+        pos += pad
+        directory += DIRENT.pack(typecode.encode(), count, pos)
+        sections += data
+        pos += len(data)
+    body = bytes(directory + sections)
+    header = HEADER.pack(MAGIC, VERSION, 0 if sys.byteorder == 'little' else 1, len(store),
+                         zlib.crc32(body), codes_size, codes_mtime, descr_size, descr_mtime)
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(header + paths)
+        f.write(b'\0' * (body_start - HEADER.size - len(paths)))
+        f.write(body)
+    os.replace(tmp, path)
+    return store
+
+
+def load_snapshot(path: str, check_sources: bool = True) -> CompactStore:
+    """
+    Memory-map the snapshot at `path` and return a `CompactStore` over it.
+    Raises SnapshotError if the file is invalid, or if `check_sources` and a
+    source file changed since the snapshot was built.
+    """
+    try:
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError) as e:
+        raise SnapshotError(f'cannot map {path}: {e}')
+    try:
+        return _load(path, memoryview(mm), mm, check_sources)
+    except (struct.error, UnicodeDecodeError, ValueError, TypeError) as e:
+        raise SnapshotError(f'{path}: malformed snapshot: {e}')
+
+
+def _load(path: str, buf: memoryview, mm: mmap.mmap, check_sources: bool) -> CompactStore:
+    if len(buf) < HEADER.size:
+        raise SnapshotError(f'{path}: truncated header')
+    (magic, version, byteorder, n, crc,
+     codes_size, codes_mtime, descr_size, descr_mtime) = HEADER.unpack_from(buf)
+    if magic != MAGIC:
+        raise SnapshotError(f'{path}: not an ICD9 snapshot')
+    pos = HEADER.size
+    sources = []
+    for _ in range(2):
+        (length,) = struct.unpack_from('<H', buf, pos)
+        sources.append(str(buf[pos + 2:pos + 2 + length], 'utf-8') or None)
+        pos += 2 + length
+    codesfname, descriptionsfname = sources
+    if version != VERSION:
+        raise SnapshotError(f'{path}: version {version}, expected {VERSION}', codesfname)
+    if byteorder != (0 if sys.byteorder == 'little' else 1):
+        raise SnapshotError(f'{path}: built on a machine with another byte order', codesfname)
+    pos += _pad(pos)
+    if zlib.crc32(buf[pos:]) != crc:
+        raise SnapshotError(f'{path}: checksum mismatch', codesfname)
+    if check_sources:
+        for source, size, mtime in ((codesfname, codes_size, codes_mtime),
+                                    (descriptionsfname, descr_size, descr_mtime)):
+            if source and os.path.exists(source) and _stat(source) != (size, mtime):
+                raise SnapshotError(f'{path}: {source} changed since the snapshot was built', codesfname)
+
+    names = [name for name, _ in CompactStore.ARRAYS] + ['offsets', 'blob']
+    views: Dict[str, Any] = {}
+    for i, name in enumerate(names):
+        typecode, count, offset = DIRENT.unpack_from(buf, pos + i * DIRENT.size)
+        typecode = typecode.decode()
+        size = count * array(typecode).itemsize
+        views[name] = buf[offset:offset + size].cast(typecode)
+    strings = StringTable(views.pop('offsets'), views.pop('blob'))
+    store = CompactStore(strings=strings, **views)
+    store.mmap = mm
+    return store
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Compile codes.json into a binary ICD9 snapshot.')
+    parser.add_argument('codes', help='path to codes.json')
+    parser.add_argument('snapshot', help='output snapshot path')
+    parser.add_argument('--descriptions', default=None, help='optional descriptions.csv to merge')
+    args = parser.parse_args(argv)
+    store = build_snapshot(args.codes, args.snapshot, args.descriptions)
+    print(f'wrote {len(store)} nodes to {args.snapshot}')
+
+
+if __name__ == '__main__':
+    main()
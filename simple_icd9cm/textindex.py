@@ -0,0 +1,88 @@
+"""
+Substring index over ICD9 leaf descriptions.
+
+`ICD9LLMTreeSearch.run_search` asks which leaves contain any of a handful of
+keywords as a case-insensitive substring of their description.  Scanning every
+leaf for every keyword is O(leaves x keywords) regex work per note;
+`SubstringIndex` answers the same question from posting lists:
+
+* a trigram index (trigram -> sorted description ids) for keywords of three or
+  more characters: candidates are the postings of the keyword's rarest
+  trigram, confirmed with a plain `in` test;
+* a token index (word -> description ids) for shorter keywords: an
+  alphanumeric keyword can only occur inside a word, so matching the keyword
+  against the word vocabulary and taking the union of postings is exact.
+
+Anything else (short keywords with punctuation or spaces) falls back to a scan.
+"""
+import re
+from array import array
+from typing import Dict, Iterable, List, Set
+
+_TOKEN = re.compile(r'[^\W_]+')
+
+
+class SubstringIndex:
+    """
+    Keyword-to-leaf lookup for `leaves` (any objects with `code` and
+    `description`).  Results keep the order of `leaves`.
+    """
+
+    def __init__(self, leaves: Iterable):
+        self.codes: List[str] = []
+        doc_ids: Dict[str, int] = {}
+        # leaf indices for each distinct lowercased description
+        self.doc_leaves: List[List[int]] = []
+        for i, leaf in enumerate(leaves):
+            self.codes.append(leaf.code)
+            descr = (leaf.description or '').lower()
+            doc = doc_ids.get(descr)
+            if doc is None:
+                doc = doc_ids[descr] = len(self.doc_leaves)
+                self.doc_leaves.append([])
+            self.doc_leaves[doc].append(i)
+        self.docs: List[str] = list(doc_ids)
+
+        trigrams: Dict[str, array] = {}
+        tokens: Dict[str, array] = {}
+        for doc, text in enumerate(self.docs):
+            for gram in {text[i:i + 3] for i in range(len(text) - 2)}:
+                trigrams.setdefault(gram, array('i')).append(doc)
+            for token in set(_TOKEN.findall(text)):
+                tokens.setdefault(token, array('i')).append(doc)
+        self.trigrams = trigrams
+        self.tokens = tokens
+
+    def match_docs(self, keyword: str) -> Set[int]:
+        """Ids of the distinct descriptions containing `keyword`."""
+        keyword = keyword.lower()
+        if not keyword:
+            return set()
+        if len(keyword) >= 3:
+            grams = {keyword[i:i + 3] for i in range(len(keyword) - 2)}
+            postings = []
+            for gram in grams:
+                p = self.trigrams.get(gram)
+                if p is None:
+                    return set()
+                postings.append(p)
+            # Intersecting further posting lists costs more per candidate than
+            # the `in` test, so the rarest trigram alone bounds the work.
+            candidates = min(postings, key=len)
+            texts = self.docs
+            return {doc for doc in candidates if keyword in texts[doc]}
+        if _TOKEN.fullmatch(keyword):
+            docs: Set[int] = set()
+            for token, p in self.tokens.items():
+                if keyword in token:
+                    docs.update(p)
+            return docs
+        return {doc for doc, text in enumerate(self.docs) if keyword in text}
+
+    def search(self, keywords: Iterable[str]) -> List[str]:
+        """Codes of the leaves whose description contains any of `keywords`, in leaf order."""
+        docs: Set[int] = set()
+        for keyword in keywords:
+            docs |= self.match_docs(keyword)
+        hits = sorted(i for doc in docs for i in self.doc_leaves[doc])
+        return [self.codes[i] for i in hits]
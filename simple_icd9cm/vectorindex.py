@@ -0,0 +1,241 @@
+"""
+Dense vector index over ICD9 leaf descriptions.
+
+Keyword and BM25 matching only find leaves that share words with a note;
+`DenseIndex` finds paraphrases too, by cosine similarity between embeddings.
+The embeddings of all leaf descriptions are precomputed, L2-normalized, into
+one float32 matrix saved as `<path>` (a `.npy` file, opened memory-mapped) with
+an id map beside it in `<path minus .npy>.ids.json`:
+
+    {"version": 1, "embedder": ..., "dim": ..., "source": {path, size, mtime_ns},
+     "codes": [...], "digests": [...]}
+
+`search(notes, k)` embeds a batch of notes and scores it against every leaf
+with a single matrix multiply.
+
+`DenseIndex.build` is incremental: rows whose code and description digest are
+unchanged, under the same embedder, are copied from the existing index and
+only new or changed descriptions are embedded.  `DenseIndex.open` reuses the
+index as it is while its codes.json has the size and mtime recorded at build
+time, and rebuilds it otherwise.
+
+An embedder is any callable taking a list of texts and returning an
+(n, dim) array, with a `name` that identifies it and its settings (an index
+built by another embedder is rebuilt from scratch).  `HashedNgramEmbedder`
+needs no model, network or GPU; `OpenAIEmbedder` calls an OpenAI-compatible
+embeddings endpoint.
+
+Requires NumPy.
+"""
+import hashlib
+import json
+import os
+import re
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+VERSION = 1
+_TOKEN = re.compile(r'[^\W_]+')
+
+
+class VectorIndexError(Exception):
+    """The index is missing, unreadable, or its matrix and id map disagree."""
+
+
+def _digest(text: str) -> str:
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1)
+
+
+def _source(codesfname: Optional[str]) -> Optional[Dict[str, Any]]:
+    if not codesfname:
+        return None
+    st = os.stat(codesfname)
+    return {'path': os.path.abspath(codesfname), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+class HashedNgramEmbedder:
+    """
+    Character n-grams of each word (with boundary marks, '<word>'), and the
+    word itself, hashed with CRC32 into `dim` signed buckets.  Deterministic
+    and offline; similar spellings ("nephropathy", "nephropathies") land
+    close together.
+    """
+
+    def __init__(self, dim: int = 256, ngrams: Tuple[int, int] = (3, 5)):
+        self.dim = dim
+        self.ngrams = ngrams
+        self.name = f'hashed-char-ngrams:dim={dim}:n={ngrams[0]}-{ngrams[1]}'
+        self._words: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def _features(self, word: str) -> Tuple[np.ndarray, np.ndarray]:
+        features = self._words.get(word)
+        if features is None:
+            marked = f'<{word}>'
+            grams = {marked}
+            for n in range(self.ngrams[0], self.ngrams[1] + 1):
+                grams.update(marked[i:i + n] for i in range(len(marked) - n + 1))
+            hashes = np.array([zlib.crc32(g.encode('utf-8')) for g in grams], dtype=np.uint32)
+            features = self._words[word] = ((hashes % self.dim).astype(np.int64),
+                                            np.where(hashes >> 31, -1.0, 1.0))
+        return features
+
+    def __call__(self, texts: Sequence[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = _TOKEN.findall(text.lower())
+            if words:
+                buckets, signs = zip(*(self._features(w) for w in words))
+                out[row] = np.bincount(np.concatenate(buckets), weights=np.concatenate(signs),
+                                       minlength=self.dim)
+        return out
+
+
+class OpenAIEmbedder:
+    """Embeddings from `client.embeddings.create` (an OpenAI-compatible client)."""
+
+    def __init__(self, client: Any, model: str = 'text-embedding-3-small', batch_size: int = 256):
+        self.client = client
+        self.model = model
+        self.batch_size = batch_size
+        self.name = f'openai:{model}'
+
+    def __call__(self, texts: Sequence[str]) -> np.ndarray:
+        rows = []
+        for start in range(0, len(texts), self.batch_size):
+            response = self.client.embeddings.create(model=self.model, input=list(texts[start:start + self.batch_size]))
+            rows.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+        return np.array(rows, dtype=np.float32)
+
+
+def ids_path(path: str) -> str:
+    return (path[:-4] if path.endswith('.npy') else path) + '.ids.json'
+
+
+class DenseIndex:
+    """
+    Memory-mapped embeddings of leaf descriptions at `path`; queries are
+    embedded with `embedder` (which must be the one the index was built with).
+    """
+
+    def __init__(self, path: str, embedder: Any):
+        self.path = path
+        self.embedder = embedder
+        try:
+            with open(ids_path(path)) as f:
+                meta = json.load(f)
+            self.matrix = np.load(path, mmap_mode='r')
+        except (OSError, ValueError) as e:
+            raise VectorIndexError(f'cannot read vector index {path}: {e}') from e
+        if meta.get('version') != VERSION:
+            raise VectorIndexError(f'{path}: unsupported version {meta.get("version")}')
+        self.meta = meta
+        self.codes: List[str] = meta['codes']
+        if self.matrix.ndim != 2 or self.matrix.shape[0] != len(self.codes):
+            raise VectorIndexError(f'{path}: {self.matrix.shape} matrix for {len(self.codes)} codes')
+        if meta['embedder'] != getattr(embedder, 'name', None):
+            raise VectorIndexError(f'{path}: built with {meta["embedder"]}, not {getattr(embedder, "name", None)}')
+        # reused / embedded / removed rows of the last build, when this index was built here
+        self.stats: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @classmethod
+    def build(cls, path: str, leaves: Iterable, embedder: Any, codesfname: Optional[str] = None,
+              batch_size: int = 1024) -> 'DenseIndex':
+        """
+        Index the descriptions of `leaves` (objects with `code` and
+        `description`) at `path`, reusing the rows of an existing index there
+        that are still current.  `codesfname` is recorded for `open`.
+        """
+        leaves = list(leaves)
+        codes = [leaf.code for leaf in leaves]
+        texts = [leaf.description or '' for leaf in leaves]
+        digests = [_digest(text) for text in texts]
+        try:
+            old: Optional[DenseIndex] = cls(path, embedder)
+        except VectorIndexError:
+            old = None
+        reuse: Dict[Tuple[str, str], int] = {}
+        if old is not None:
+            reuse = {key: row for row, key in enumerate(zip(old.codes, old.meta['digests']))}
+
+        rows = [reuse.get(key, -1) for key in zip(codes, digests)]
+        todo = [i for i, row in enumerate(rows) if row < 0]
+        fresh = []
+        for start in range(0, len(todo), batch_size):
+            fresh.append(_normalize(embedder([texts[i] for i in todo[start:start + batch_size]])))
+        if fresh:
+            dim = fresh[0].shape[1]
+        elif old is not None:
+            dim = old.matrix.shape[1]
+        else:
+            dim = getattr(embedder, 'dim', 0)
+
+        tmp = path + '.tmp.npy'
+        matrix = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float32, shape=(len(codes), dim))
+        kept = [i for i, row in enumerate(rows) if row >= 0]
+        if kept:
+            matrix[kept] = old.matrix[[rows[i] for i in kept]]
+        if todo:
+            matrix[todo] = np.concatenate(fresh)
+        matrix.flush()
+        del matrix
+        meta = {'version': VERSION, 'embedder': embedder.name, 'dim': dim, 'source': _source(codesfname),
+                'codes': codes, 'digests': digests}
+        with open(ids_path(tmp), 'w') as f:
+            json.dump(meta, f)
+        if old is not None:
+            del old.matrix
+        # the matrix first: a crash in between leaves an id map that does not match, and a rebuild
+        os.replace(tmp, path)
+        os.replace(ids_path(tmp), ids_path(path))
+        index = cls(path, embedder)
+        index.stats = {'reused': len(kept), 'embedded': len(todo),
+                       'removed': len(old.codes) - len(kept) if old is not None else 0}
+        return index
+
+    @classmethod
+    def open(cls, path: str, embedder: Any, codesfname: str, tree: Any = None) -> 'DenseIndex':
+        """
+        The index at `path` if it was built from `codesfname` as it is now by
+        the same embedder; otherwise rebuilt (incrementally) from the leaves
+        of `tree`, or of `codesfname` loaded as an `ICD9`.
+        """
+        try:
+            index = cls(path, embedder)
+            source = index.meta.get('source') or {}
+            if source == _source(codesfname):
+                return index
+        except VectorIndexError:
+            pass
+        if tree is None:
+            from .icd9cm import ICD9
+            tree = ICD9(codesfname)
+        return cls.build(path, tree.iter_leaves(), embedder, codesfname)
+
+    def search(self, texts: Sequence[str], k: int = 10) -> List[List[Tuple[str, float]]]:
+        """
+        The `k` leaves most similar to each of `texts`, as (code, cosine)
+        pairs, best first: one list per text, from one matrix multiply.
+        """
+        if not len(texts) or not len(self.codes):
+            return [[] for _ in texts]
+        k = min(k, len(self.codes))
+        queries = _normalize(self.embedder(list(texts)))
+        scores = queries @ self.matrix.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        return [[(self.codes[i], float(s)) for i, s in zip(row, row_scores)]
+                for row, row_scores in zip(top, top_scores)]
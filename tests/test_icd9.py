@@ -75,4 +75,66 @@ def test_icd9_tree():
     # Test leaves
     leaves = icd.leaves
     codes = [n.code for n in leaves]
-    assert '001.0' in codes and '002.0' in codes 
\ No newline at end of file
+    assert '001.0' in codes and '002.0' in codes
+
+
+def test_find_uses_code_index():
+    icd = DummyICD9(test_hierarchy)
+    assert set(icd.code2node) == {'001-139', '001-009', '001', '001.0', '002', '002.0'}
+    assert icd.find('001.0') is icd.code2node['001.0']
+    assert icd.find('ROOT') is icd
+    assert icd.find('999.9') is None
+
+
+def test_find_scoped_to_subtree():
+    icd = DummyICD9(test_hierarchy)
+    cholera = icd.find('001')
+    assert cholera.find('001.0').code == '001.0'
+    assert cholera.find('002.0') is None
+    assert icd.find('001-009').find('002.0').code == '002.0'
+    assert cholera.has_descendant(icd.find('001.0'))
+    assert not cholera.has_descendant(icd.find('002.0'))
+
+
+def test_find_many():
+    icd = DummyICD9(test_hierarchy)
+    nodes = icd.find_many(['002.0', 'missing', '001'])
+    assert [n.code if n else None for n in nodes] == ['002.0', None, '001']
+
+
+def test_code_index_refreshes_after_add():
+    icd = DummyICD9(test_hierarchy)
+    assert icd.find('003.0') is None
+    icd.add([{'code': None}, {'code': '001-139'}, {'code': '001-009'},
+             {'code': '003', 'descr': 'Other salmonella infections'},
+             {'code': '003.0', 'descr': 'Salmonella gastroenteritis'}])
+    assert icd.find('003.0').description == 'Salmonella gastroenteritis'
+
+
+def test_interval_leaves_are_preorder_slices():
+    icd = DummyICD9(test_hierarchy)
+    assert [n.code for n in icd.leaves] == ['001.0', '002.0']
+    assert icd.codes == ['001.0', '002.0']
+    assert icd.find('002').codes == ['002.0']
+    assert icd.find('002.0').leaves == [icd.find('002.0')]
+    assert list(icd.iter_leaves()) == icd.leaves
+    assert [n.code for n in icd.leaves_at_depth(4)] == ['001.0', '002.0']
+    assert icd.find('001').leaves_at_depth(4) == [icd.find('001.0')]
+    assert icd.leaves_at_depth(3) == []
+
+
+def test_walk_and_subtree_size():
+    icd = DummyICD9(test_hierarchy)
+    assert [n.code for n in icd.walk()] == ['ROOT', '001-139', '001-009', '001', '001.0', '002', '002.0']
+    assert [n.code for n in icd.walk(depth=2)] == ['ROOT', '001-139', '001-009']
+    assert icd.subtree_size == 7
+    assert icd.find('001-009').subtree_size == 5
+
+
+def test_intervals_refresh_after_add():
+    icd = DummyICD9(test_hierarchy)
+    assert len(icd.leaves) == 2
+    icd.add([{'code': None}, {'code': '001-139'}, {'code': '001-009'},
+             {'code': '001'}, {'code': '001.1', 'descr': 'Cholera due to vibrio cholerae el tor'}])
+    assert icd.codes == ['001.0', '001.1', '002.0']
+    assert icd.find('001').has_descendant(icd.find('001.1'))
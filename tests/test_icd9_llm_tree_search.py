@@ -1,7 +1,16 @@
 import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import asyncio
+import json
+import re
+import threading
+import time
+from types import SimpleNamespace
 import pytest
+from icd9_llm_tree_search.candidate_budget import (CandidateBudget, context_window_for, count_message_tokens,
+                                                   score_candidates, token_counter)
+from icd9_llm_tree_search.keyword_batching import KeywordBatcher, parse_batch_keywords
 from icd9_llm_tree_search.tree_search import ICD9LLMTreeSearch
 from simple_icd9cm.icd9cm import ICD9
 
@@ -107,4 +116,357 @@ def test_tree_search_for_erythema_nodosum():
     # description = searcher.icd9.find(expected_code).description
     # print(f"Found description for {expected_code}: {description}")
 
-    assert expected_code in results, f"Expected code {expected_code} not found in results: {results}" 
\ No newline at end of file
+    assert expected_code in results, f"Expected code {expected_code} not found in results: {results}" 
+
+class FakeAsyncCompletions:
+    """Async chat endpoint: keywords are the note's words, the ranking picks the last candidate."""
+
+    def __init__(self, batch_reply=None):
+        self.active = 0
+        self.max_active = 0
+        self.calls = []
+        # batch_reply(notes): the answer to a batched keyword request
+        self.batch_reply = batch_reply or (lambda notes: json.dumps({i: n.split() for i, n in enumerate(notes, 1)}))
+
+    async def create(self, model, messages, **kwargs):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        self.calls.append(messages)
+        try:
+            await asyncio.sleep(0.01)
+            user = messages[-1]['content']
+            if 'FAIL' in user:
+                raise RuntimeError('endpoint error')
+            if '[Case note 1]:' in user:
+                notes = re.split(r'\[Case note \d+\]:', user.split('[Task]:')[0])[1:]
+                content = self.batch_reply(notes)
+            elif 'keywords' in messages[0]['content']:
+                note = user.split('[Case note]:')[1].split('[Task]:')[0]
+                content = ', '.join(note.split())
+            else:
+                codes = [line.split(':')[0] for line in user.split('ICD-9 Codes:\n')[1].split('\n\n')[0].splitlines()]
+                content = codes[-1]
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+        finally:
+            self.active -= 1
+
+
+def cholera_searcher(tmp_path):
+    codes = tmp_path / 'codes.json'
+    codes.write_text(json.dumps([
+        [{'code': None}, {'code': '001', 'descr': 'Cholera'}, {'code': '001.0', 'descr': 'Cholera due to vibrio cholerae'}],
+        [{'code': None}, {'code': '001', 'descr': 'Cholera'}, {'code': '001.1', 'descr': 'Cholera due to vibrio cholerae el tor'}],
+        [{'code': None}, {'code': '002', 'descr': 'Typhoid'}, {'code': '002.0', 'descr': 'Typhoid fever'}]]))
+    searcher = ICD9LLMTreeSearch(api_key="dummy-key", use_dspy_optimization=False)
+    searcher.icd9 = ICD9(str(codes))
+    return searcher
+
+
+def test_run_search_batch_keeps_order_and_isolates_failures(tmp_path):
+    searcher = cholera_searcher(tmp_path)
+    completions = FakeAsyncCompletions()
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    notes = ['vibrio cholerae', 'typhoid', 'FAIL', 'nothing known', 'el tor'] * 3
+    results = asyncio.run(searcher.arun_search_batch(notes, concurrency=4, client=client))
+    assert len(results) == len(notes)
+    for note, result in zip(notes, results):
+        if note == 'FAIL':
+            assert isinstance(result, RuntimeError)
+        else:
+            assert result == {'vibrio cholerae': '001.1', 'typhoid': '002.0',
+                              'nothing known': None, 'el tor': '001.1'}[note]
+    assert 1 < completions.max_active <= 4
+    # candidate lookup and prompt budgeting run off the event loop
+    threads = set()
+    for name in ('_candidates', '_ranking_candidates'):
+        def recorded(*args, _method=getattr(searcher, name)):
+            threads.add(threading.current_thread())
+            return _method(*args)
+        setattr(searcher, name, recorded)
+    asyncio.run(searcher.arun_search_batch(notes, concurrency=4, client=client))
+    assert threads and threading.main_thread() not in threads
+    with pytest.raises(RuntimeError):
+        asyncio.run(searcher.arun_search_batch(notes, client=client, return_exceptions=False))
+
+
+def test_parse_batch_keywords():
+    assert parse_batch_keywords('{"1": ["Cholera", "fever"], "2": "typhoid, \\"fever\\""}', 2) == \
+        {0: ['cholera', 'fever'], 1: ['typhoid', 'fever']}
+    fenced = 'Here you go:\n```json\n{"note 2": ["el tor"], "3": ["out of range"], "1": 5}\n```'
+    assert parse_batch_keywords(fenced, 2) == {1: ['el tor']}
+    assert parse_batch_keywords('cholera, fever', 1) == {}
+    assert parse_batch_keywords('{"1": ["cholera"', 1) == {}
+
+
+def test_keyword_batcher_coalesces_and_falls_back(tmp_path):
+    searcher = cholera_searcher(tmp_path)
+    notes = ['vibrio cholerae', 'typhoid', 'el tor', 'nothing known']
+
+    async def extract(batcher):
+        return await asyncio.gather(*(batcher.extract(note) for note in notes))
+
+    completions = FakeAsyncCompletions()
+    batcher = KeywordBatcher(searcher, SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    assert asyncio.run(extract(batcher)) == [note.split() for note in notes]
+    assert len(completions.calls) == 1 and batcher.stats['batched_notes'] == 4
+    assert len(batcher.latencies) == 4
+
+    # notes left out of the answer, or a batch that cannot be parsed, are asked for alone
+    for reply, fallbacks in [(lambda ns: json.dumps({'2': ns[1].split()}), 3), (lambda ns: 'sorry', 4)]:
+        completions = FakeAsyncCompletions(reply)
+        batcher = KeywordBatcher(searcher, SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+        assert asyncio.run(extract(batcher)) == [note.split() for note in notes]
+        assert batcher.stats['fallbacks'] == fallbacks and len(completions.calls) == 1 + fallbacks
+
+    # max_notes and max_prompt_tokens split the queue
+    completions = FakeAsyncCompletions()
+    batcher = KeywordBatcher(searcher, SimpleNamespace(chat=SimpleNamespace(completions=completions)),
+                             max_notes=3, max_prompt_tokens=10, count_tokens=lambda note: 4)
+    asyncio.run(extract(batcher))
+    assert sorted(len(c[-1]['content'].split('[Case note ')) - 1 for c in completions.calls) == [2, 2]
+
+    # a failed batch request fails only the notes that fail on their own
+    completions = FakeAsyncCompletions()
+    batcher = KeywordBatcher(searcher, SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+
+    async def extract_failing():
+        return await asyncio.gather(batcher.extract('typhoid'), batcher.extract('FAIL'), return_exceptions=True)
+
+    results = asyncio.run(extract_failing())
+    assert results[0] == ['typhoid'] and isinstance(results[1], RuntimeError)
+    assert batcher.stats['fallbacks'] == 2
+
+
+def test_keyword_batcher_never_leaves_callers_waiting(tmp_path):
+    searcher = cholera_searcher(tmp_path)
+    notes = ['vibrio cholerae', 'typhoid']
+
+    async def extract(batcher):
+        return await asyncio.wait_for(asyncio.gather(*(batcher.extract(note) for note in notes)), 5)
+
+    class EmptyBatchCompletions(FakeAsyncCompletions):
+        async def create(self, model, messages, **kwargs):
+            if '[Case note 1]:' in messages[-1]['content']:
+                self.calls.append(messages)
+                return SimpleNamespace(choices=[])
+            return await super().create(model, messages, **kwargs)
+
+    # an answer without content, or without choices, falls back to single notes
+    for completions in [FakeAsyncCompletions(lambda ns: None), EmptyBatchCompletions()]:
+        batcher = KeywordBatcher(searcher, SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+        assert asyncio.run(extract(batcher)) == [note.split() for note in notes]
+        assert batcher.stats['fallbacks'] == 2 and len(completions.calls) == 3
+
+    # anything else going wrong reaches the callers
+    batcher = KeywordBatcher(searcher, SimpleNamespace(chat=SimpleNamespace(completions=FakeAsyncCompletions())))
+
+    async def broken(batch):
+        raise ValueError('bug')
+
+    batcher._resolve = broken
+    with pytest.raises(ValueError):
+        asyncio.run(extract(batcher))
+
+
+def test_run_search_batch_coalesced_keywords_match(tmp_path):
+    searcher = cholera_searcher(tmp_path)
+    client = SimpleNamespace(chat=SimpleNamespace(completions=FakeAsyncCompletions()))
+    notes = ['vibrio cholerae', 'typhoid', 'nothing known', 'el tor'] * 3
+    expected = asyncio.run(searcher.arun_search_batch(notes, concurrency=4, client=client))
+    completions = FakeAsyncCompletions()
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    assert asyncio.run(searcher.arun_search_batch(notes, concurrency=4, client=client,
+                                                  coalesce_keywords=True)) == expected
+    assert searcher.keyword_batcher.stats['batches'] >= 1
+    assert searcher.keyword_batcher.stats['requests'] < len(notes)
+
+
+def test_candidate_budget_trims_to_context_window(tmp_path):
+    searcher = cholera_searcher(tmp_path)
+    codes = ['001.0', '001.1', '002.0']
+    assert searcher._budgeted_candidates('cholera', codes, ['cholera'])[0] == codes
+    assert searcher.candidate_budget.stats['trimmed'] == 0
+
+    budget = CandidateBudget(len, context_window=10000, reserve=0)  # one token per character
+    searcher.candidate_budget = budget
+    lines = searcher._candidate_lines(codes)
+    full = count_message_tokens(searcher._ranking_messages('el tor', '\n'.join(lines)), len)
+    budget.context_window = full - 1
+    kept, code_list_str = searcher._budgeted_candidates('el tor', codes, ['el tor', 'cholera'])
+    assert kept == ['001.0', '001.1'] and code_list_str == '\n'.join(searcher._candidate_lines(kept))
+    assert budget.stats['trimmed'] == 1 and budget.stats['dropped'] == 1
+    assert budget.stats['tokens_saved'] == full - count_message_tokens(
+        searcher._ranking_messages('el tor', code_list_str), len)
+
+    # the best candidate is kept even when nothing fits
+    budget.context_window = 10
+    assert searcher._budgeted_candidates('el tor', codes, ['el tor'])[0] == ['001.1']
+
+
+def test_context_window_follows_the_model():
+    assert context_window_for('gpt-4o') == context_window_for('openai/gpt-4o-mini') == 128000
+    assert context_window_for('gpt-4') == 8192 and context_window_for('gpt-4-turbo-preview') == 128000
+    assert context_window_for('local-model') is None and context_window_for('gpt-4omni') is None
+    searcher = ICD9LLMTreeSearch(model_name='gpt-4o', api_key='test', use_dspy_optimization=False)
+    assert searcher.candidate_budget.context_window == 128000
+    searcher = ICD9LLMTreeSearch(model_name='medgemma', api_key='test', use_dspy_optimization=False)
+    assert searcher.candidate_budget.context_window == 4096
+    searcher = ICD9LLMTreeSearch(model_name='medgemma', api_key='test', use_dspy_optimization=False,
+                                 context_window=32768)
+    assert searcher.candidate_budget.context_window == 32768
+    searcher = ICD9LLMTreeSearch(model_name='gpt-4o', api_key='test', use_dspy_optimization=False,
+                                 context_window=0)
+    assert searcher.candidate_budget is None
+
+
+def test_score_candidates_prefers_rare_keywords_and_specific_codes():
+    scores = score_candidates(['cholera', 'el tor'], ['Cholera due to vibrio cholerae',
+                                                      'Cholera due to vibrio cholerae el tor',
+                                                      'Cholera, unspecified'])
+    assert scores[1] > scores[0] > scores[2]
+    assert token_counter('no-such-model')('cholera due to vibrio cholerae') > 0
+
+
+def test_lexical_order_and_lexical_only_mode(tmp_path):
+    searcher = cholera_searcher(tmp_path)
+    unusable = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content='no idea'))])
+    searcher.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kwargs: unusable)))
+    # an unusable answer falls back to the best lexical match
+    assert searcher._rank_codes_with_llm('vibrio cholerae el tor', ['001.0', '001.1', '002.0']) == '001.1'
+    assert searcher._rank_codes_with_llm('typhoid fever', ['001.0', '001.1', '002.0']) == '002.0'
+
+    searcher.lexical_only = True
+    searcher.client = None  # no LLM call is made
+    assert searcher.run_search('Vibrio cholerae el tor isolated from stool.') == '001.1'
+    assert asyncio.run(searcher.arun_search('Typhoid fever.', client=object())) == '002.0'
+    assert searcher.run_search('appendicitis') is None
+    assert [code for code, _ in searcher.lexical_search('cholera', k=5)] == ['001.0', '001.1']
+    assert searcher.run_search_batch(['Typhoid fever.', 'Cholera due to vibrio cholerae.']) == ['002.0', '001.0']
+
+
+def test_dense_index_adds_paraphrase_candidates(tmp_path):
+    from simple_icd9cm.vectorindex import DenseIndex, HashedNgramEmbedder
+    searcher = cholera_searcher(tmp_path)
+    index = DenseIndex.build(str(tmp_path / 'leaves.npy'), searcher.icd9.iter_leaves(), HashedNgramEmbedder(dim=64))
+    assert searcher._candidates('typhoidal illness', ['typhoidal']) == []
+    searcher.dense_index, searcher.dense_k = index, 1
+    assert searcher._candidates('typhoidal illness', ['typhoidal']) == ['002.0']
+    assert searcher._candidates('typhoidal illness', ['cholera']) == ['001.0', '001.1', '002.0']
+
+    completions = FakeAsyncCompletions()
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    notes = ['typhoidal illness', 'vibrio cholerae']
+    assert asyncio.run(searcher.arun_search_batch(notes, client=client)) == ['002.0', '001.1']
+
+
+class RecordingTreeSearch(ICD9LLMTreeSearch):
+    """Says Yes to every child whose description shares a word with the note."""
+
+    def __init__(self, icd9):
+        super().__init__(api_key="dummy-key", use_dspy_optimization=False)
+        self.icd9 = icd9
+        self.asked = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def _llm_decide(self, note, nodes):
+        with self.lock:
+            self.asked.append(nodes[0].parent.code)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.02)
+        with self.lock:
+            self.active -= 1
+        if 'FAIL' in note and nodes[0].parent.code == '001':
+            raise RuntimeError('endpoint error')
+        words = set(note.lower().split())
+        return "\n".join(f"* {n.code} {n.description}: {'Yes' if words & set(n.description.lower().split()) else 'No'}"
+                         for n in nodes)
+
+
+def test_parse_decisions():
+    nodes = [SimpleNamespace(code=c) for c in ('011', '011.4', '011-018', '001')]
+    output = "011.4: Yes\n011-018: Yes, tuberculosis\n011: no\n**001** Cholera: **Yes**"
+    assert [n.code for n in ICD9LLMTreeSearch._parse_decisions(output, nodes)] == ['011.4', '011-018', '001']
+    assert [n.code for n in ICD9LLMTreeSearch._parse_decisions("- 001 Cholera: YES", nodes)] == ['001']
+
+
+def test_run_tree_search_beam_memo_and_early_stop(tmp_path):
+    codes = tmp_path / 'codes.json'
+    root, chapter = {'code': None}, {'code': '001-139', 'descr': 'Infectious diseases'}
+    cholera, typhoid = {'code': '001', 'descr': 'Cholera disease'}, {'code': '002', 'descr': 'Typhoid disease'}
+    codes.write_text(json.dumps([
+        [root, chapter, cholera, {'code': '001.0', 'descr': 'Cholera due to vibrio'}],
+        [root, chapter, cholera, {'code': '001.1', 'descr': 'Cholera el tor'}],
+        [root, chapter, typhoid, {'code': '002.0', 'descr': 'Typhoid fever'}],
+        [root, chapter, {'code': '003', 'descr': 'Other disease'}, {'code': '003.0', 'descr': 'Salmonella'}]]))
+    searcher = RecordingTreeSearch(ICD9(str(codes)))
+    note = 'infectious disease cholera el tor typhoid fever'
+
+    unbounded = searcher.run_tree_search(note, beam_width=None)
+    assert unbounded == ['001-139', '001', '002', '003', '001.0', '001.1', '002.0']
+    assert sorted(searcher.asked) == ['001', '001-139', '002', '003', 'ROOT']
+    assert searcher.max_active == 3  # the three categories were asked at once
+    report = searcher.tree_search_report
+    assert report['calls'] == 5 and report['memo_hits'] == 0 and len(report['levels']) == 3
+
+    # memoized: the same note costs no calls; the beam keeps the two closest categories
+    searcher.asked.clear()
+    assert searcher.run_tree_search(note, beam_width=2) == unbounded
+    assert searcher.asked == [] and searcher.tree_search_report['memo_hits'] == 4
+    assert searcher.tree_search_report['pruned'] == 1
+    # the beam collapsed to leaves before max_depth: the leaves were not asked about
+    assert len(searcher.tree_search_report['levels']) == 3
+    assert [level['expanded'] for level in searcher.tree_search_report['levels']] == [1, 1, 2]
+
+    assert searcher.run_tree_search(note, max_depth=1) == ['001-139']
+    assert searcher.run_tree_search('nothing relevant') == []
+    # a failed decision accepts nothing below that node, and is asked again next time
+    failing = 'FAIL infectious cholera disease'
+    assert searcher.run_tree_search(failing, workers=1) == ['001-139', '001', '002', '003']
+    assert list(searcher.tree_search_report['failures']) == ['001']
+    assert isinstance(searcher.tree_search_report['failures']['001'], RuntimeError)
+    assert (failing, '001') not in searcher._decisions
+    searcher.asked.clear()
+    searcher.run_tree_search(failing, workers=1)
+    assert searcher.asked == ['001'] and searcher.tree_search_report['memo_hits'] == 4
+
+
+def test_run_tree_search_memo_smaller_than_a_level(tmp_path):
+    codes = tmp_path / 'codes.json'
+    root, chapter = {'code': None}, {'code': '001-139', 'descr': 'Infectious diseases'}
+    codes.write_text(json.dumps([
+        [root, chapter, {'code': f'00{i}', 'descr': f'Disease {i}'}, {'code': f'00{i}.0', 'descr': f'Disease {i} acute'}]
+        for i in range(1, 6)]))
+    searcher = RecordingTreeSearch(ICD9(str(codes)))
+    searcher.decision_memo_size = 2
+    note = 'infectious disease acute'
+    expected = ['001-139'] + [f'00{i}' for i in range(1, 6)] + [f'00{i}.0' for i in range(1, 6)]
+    for _ in range(2):
+        assert searcher.run_tree_search(note, beam_width=None) == expected
+        # the survivors are the last two decisions stored
+        assert list(searcher._decisions) == [(note, '004'), (note, '005')]
+
+
+def test_run_tree_search_memo_evicted_by_another_search(tmp_path):
+    codes = tmp_path / 'codes.json'
+    root, chapter = {'code': None}, {'code': '001-139', 'descr': 'Infectious diseases'}
+    codes.write_text(json.dumps([
+        [root, chapter, {'code': f'00{i}', 'descr': f'Disease {i}'}, {'code': f'00{i}.0', 'descr': f'Disease {i} acute'}]
+        for i in range(1, 6)]))
+    note, other = 'infectious disease acute', 'infectious disease'
+    expected = RecordingTreeSearch(ICD9(str(codes))).run_tree_search(note, beam_width=None)
+
+    class Interleaved(RecordingTreeSearch):
+        def _llm_decide(self, note_, nodes):
+            # another search finishes while this level is being decided
+            if note_ == note and nodes[0].parent.code == '002':
+                self.decision_memo_size = 1
+                self.run_tree_search(other, beam_width=None, workers=1)
+            return super()._llm_decide(note_, nodes)
+
+    searcher = Interleaved(ICD9(str(codes)))
+    searcher._decisions[(note, '001')] = [searcher.icd9.find('001.0')]
+    assert searcher.run_tree_search(note, beam_width=None, workers=1) == expected
+    assert (note, '001') not in searcher._decisions
@@ -0,0 +1,186 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import asyncio
+import multiprocessing
+import threading
+from types import SimpleNamespace
+import pytest
+import dspy
+from icd9_llm_tree_search.llm_cache import CachedAsyncChatClient, CachedChatClient, CachedLM, LLMCache, cache_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        content = f"answer {len(self.calls)}"
+        return {'id': str(len(self.calls)), 'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}}]}
+
+
+class FakeLM(dspy.BaseLM):
+    """A legacy DSPy LM answering in the chat adapter's format, as a served model would."""
+
+    def __init__(self):
+        super().__init__('openai/local', temperature=0.0, max_tokens=50)
+        self.calls = 0
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        self.calls += 1
+        content = f"[[ ## best_code ## ]]\n001.{self.calls}\n\n[[ ## completed ## ]]"
+        return {'id': str(self.calls), 'model': self.model,
+                'usage': {'prompt_tokens': 20, 'completion_tokens': 5, 'total_tokens': 25},
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}}]}
+
+
+class BestCode(dspy.Signature):
+    clinical_note = dspy.InputField()
+    best_code = dspy.OutputField()
+
+
+MESSAGES = [{'role': 'user', 'content': 'cholera'}]
+
+
+def test_key_covers_model_messages_and_params():
+    key = cache_key('m', MESSAGES, temperature=0.0, max_tokens=10)
+    assert key == cache_key('m', [dict(m) for m in MESSAGES], max_tokens=10, temperature=0.0)
+    assert key != cache_key('m2', MESSAGES, temperature=0.0, max_tokens=10)
+    assert key != cache_key('m', MESSAGES, temperature=0.0, max_tokens=100)
+    assert key != cache_key('m', [{'role': 'user', 'content': 'typhoid'}], temperature=0.0, max_tokens=10)
+
+
+def test_chat_client_caches_deterministic_requests(tmp_path):
+    completions = FakeCompletions()
+    cache = LLMCache(str(tmp_path / 'llm.sqlite'))
+    client = CachedChatClient(SimpleNamespace(chat=SimpleNamespace(completions=completions), api_key='k'), cache)
+    first = client.chat.completions.create(model='m', messages=MESSAGES, temperature=0.0, max_tokens=10)
+    again = client.chat.completions.create(model='m', messages=MESSAGES, temperature=0.0, max_tokens=10)
+    assert again.choices[0].message.content == first['choices'][0]['message']['content'] == 'answer 1'
+    client.chat.completions.create(model='m', messages=MESSAGES, temperature=0.0, max_tokens=20)
+    client.chat.completions.create(model='m', messages=MESSAGES, temperature=0.7, max_tokens=10)
+    client.chat.completions.create(model='m', messages=MESSAGES, temperature=0.7, max_tokens=10)
+    assert len(completions.calls) == 4
+    assert cache.stats['hits'] == 1 and cache.stats['misses'] == 2
+    assert client.api_key == 'k'
+    cache.close()
+
+    # a second process (here: connection) shares the stored responses
+    with LLMCache(str(tmp_path / 'llm.sqlite')) as cache:
+        client = CachedChatClient(SimpleNamespace(chat=SimpleNamespace(completions=completions)), cache)
+        client.chat.completions.create(model='m', messages=MESSAGES, temperature=0.0, max_tokens=20)
+        assert len(completions.calls) == 4 and cache.stats['hits'] == 1
+
+
+def test_ttl_and_lru_eviction(tmp_path):
+    clock = FakeClock()
+    cache = LLMCache(str(tmp_path / 'llm.sqlite'), ttl=60, max_entries=2, clock=clock)
+    cache.put('a', {'x': 1})
+    clock.now += 1
+    cache.put('b', {'x': 2})
+    clock.now += 1
+    assert cache.get('a') == {'x': 1}  # 'b' is now least recently used
+    cache.put('c', {'x': 3})
+    assert cache.get('b') is None and cache.stats['evicted'] == 1
+    assert cache.get('a') == {'x': 1} and cache.get('c') == {'x': 3}
+    clock.now += 60
+    assert cache.get('c') is None and cache.stats['expired'] == 1
+    assert len(cache) == 1
+    cache.put('d', 'x' * 100)
+    assert len(cache) == 1  # 'a' expired as well
+
+    small = LLMCache(str(tmp_path / 'small.sqlite'), max_bytes=250, clock=clock)
+    for i in range(5):
+        clock.now += 1
+        small.put(str(i), 'x' * 100)
+    assert len(small) == 2 and small.get('4') is not None and small.get('0') is None
+
+
+@pytest.mark.filterwarnings('ignore::DeprecationWarning')
+def test_cached_lm_wraps_dspy_lm(tmp_path):
+    lm = FakeLM()
+    with LLMCache(str(tmp_path / 'llm.sqlite')) as cache:
+        cached = CachedLM(lm, cache)
+        assert isinstance(cached, dspy.BaseLM)
+        first = cached(messages=MESSAGES)
+        assert cached(messages=MESSAGES) == first and '001.1' in first[0]
+        assert '001.2' in cached(messages=MESSAGES, max_tokens=10)[0]
+        assert '001.3' in cached(messages=MESSAGES, temperature=1.0)[0]
+        assert '001.4' in cached(messages=MESSAGES, temperature=1.0)[0]
+        assert lm.calls == 4 and cache.stats == {'hits': 1, 'misses': 2, 'expired': 0, 'evicted': 0}
+        assert cached.history is lm.history
+
+
+@pytest.mark.filterwarnings('ignore::DeprecationWarning')
+def test_cached_lm_serves_dspy_predict(tmp_path):
+    lm = FakeLM()
+    with LLMCache(str(tmp_path / 'llm.sqlite')) as cache:
+        cached = CachedLM(lm, cache)
+        predict = dspy.Predict(BestCode)
+        with dspy.context(lm=cached):
+            assert predict(clinical_note='cholera').best_code == '001.1'
+            assert predict(clinical_note='cholera').best_code == '001.1'
+            assert predict(clinical_note='typhoid').best_code == '001.2'
+            assert asyncio.run(predict.acall(clinical_note='cholera')).best_code == '001.1'
+        assert lm.calls == 2 and cache.stats['hits'] == 2
+        # a later process answers from the file alone
+        with LLMCache(cache.path) as again, dspy.context(lm=CachedLM(FakeLM(), again)):
+            assert predict(clinical_note='typhoid').best_code == '001.2'
+
+
+def _put_many(path, start):
+    with LLMCache(path) as cache:
+        for i in range(start, start + 50):
+            cache.put(str(i), {'i': i})
+
+
+def test_cache_is_shared_across_processes(tmp_path):
+    path = str(tmp_path / 'llm.sqlite')
+    LLMCache(path).close()
+    procs = [multiprocessing.get_context('spawn').Process(target=_put_many, args=(path, n * 50)) for n in range(3)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+    with LLMCache(path) as cache:
+        assert len(cache) == 150 and cache.get('120') == {'i': 120}
+
+
+def test_async_chat_client_caches(tmp_path):
+    completions = FakeCompletions()
+
+    class AsyncCompletions:
+        async def create(self, **kwargs):
+            return completions.create(**kwargs)
+
+    async def run(client):
+        return [await client.chat.completions.create(model='m', messages=MESSAGES, temperature=0.0)
+                for _ in range(3)]
+
+    class ThreadRecordingCache(LLMCache):
+        def get(self, key):
+            threads.add(threading.current_thread())
+            return super().get(key)
+
+        def put(self, key, response, model=None):
+            threads.add(threading.current_thread())
+            super().put(key, response, model)
+
+    threads = set()
+    with ThreadRecordingCache(str(tmp_path / 'llm.sqlite')) as cache:
+        client = CachedAsyncChatClient(SimpleNamespace(chat=SimpleNamespace(completions=AsyncCompletions())), cache)
+        first, *rest = asyncio.run(run(client))
+        assert [r.choices[0].message.content for r in rest] == ['answer 1', 'answer 1']
+        assert len(completions.calls) == 1 and cache.stats['hits'] == 2
+    # SQLite is never touched from the event loop's thread
+    assert threads and threading.main_thread() not in threads
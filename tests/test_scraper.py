@@ -0,0 +1,384 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+requests = pytest.importorskip('requests')
+pytest.importorskip('pyquery')
+import json
+from pyquery import PyQuery as pq
+from scraper.scraper import Scraper, codes_layout, finalize, icd9_handlers, levelFactory
+from scraper.codesdiff import diff_codes, index_codes
+from scraper.extract import CompiledLevels
+from scraper.pagecache import SQLitePageCache
+from scraper.scheduler import FetchScheduler, RetryPolicy
+
+# A miniature of the icd9cm.chrisendres.com hierarchy: contents -> chapters ->
+# sections -> codes, where codes with an href have a page of subcodes.
+def make_site():
+    pages = {}
+    chapters = []
+    for c in range(3):
+        start = c * 100 + 1
+        chapter = f"index.php?action=child&chapter={c}"
+        chapters.append(f'<div class="lvl1"><a href="{chapter}"><div class="chapter">'
+                        f'{c + 1}. Chapter {c} ({start:03d}-{start + 99:03d})</div></a></div>')
+        sections = []
+        for s in range(2):
+            lo = start + s * 10
+            section = f"index.php?action=child&chapter={c}&section={s}"
+            sections.append(f'<div class="lvl2"><a href="{section}"><div class="section">'
+                            f'Section {s} ({lo:03d}-{lo + 9:03d})</div></a></div>')
+            codes = []
+            for k in range(3):
+                code = f"{lo + k:03d}"
+                if k == 0:
+                    codes.append(f'<div class="lvl3"><div class="dlvl">{code} Code {code}</div></div>')
+                    continue
+                sub = f"index.php?action=child&code={code}"
+                codes.append(f'<div class="lvl3"><a href="{sub}"><div class="dlvl">'
+                             f'{code} Code {code}</div></a></div>')
+                pages[sub] = ''.join(f'<div class="lvl4"><div class="dlvl">{code}.{d} Code {code}.{d}</div></div>'
+                                     for d in range(2))
+            pages[section] = ''.join(codes)
+        pages[chapter] = ''.join(sections)
+    pages['index.php?action=contents'] = ''.join(chapters)
+    return pages
+
+
+class Site:
+    """HTTP stand-in serving the fixture pages with injected latency."""
+
+    def __init__(self, latency=0.02):
+        self.pages = make_site()
+        self.latency = latency
+        self.requests = 0
+        self.connections = 0
+        self.active = 0
+        self.max_active = 0
+        self.not_modified = 0
+        self.etags = True
+        # each page answers 503 this many times before it succeeds
+        self.flaky = 0
+        self.failures = {}
+        self.lock = threading.Lock()
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with site.lock:
+                    site.connections += 1
+
+            def do_GET(self):
+                with site.lock:
+                    site.requests += 1
+                    site.active += 1
+                    site.max_active = max(site.max_active, site.active)
+                try:
+                    time.sleep(site.latency)
+                    page = site.pages.get(self.path.lstrip('/'))
+                    with site.lock:
+                        failed = site.failures.get(self.path, 0)
+                        if failed < site.flaky:
+                            site.failures[self.path] = failed + 1
+                    if failed < site.flaky:
+                        self.send_response(503)
+                        self.send_header('Retry-After', '0')
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    body = f'<html><body>{page or ""}</body></html>'.encode()
+                    etag = f'"{zlib.crc32(body):08x}"' if site.etags else None
+                    if etag and self.headers.get('If-None-Match') == etag:
+                        with site.lock:
+                            site.not_modified += 1
+                        self.send_response(304)
+                        self.send_header('ETag', etag)
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    self.send_response(200 if page is not None else 404)
+                    self.send_header('Content-Type', 'text/html')
+                    if etag:
+                        self.send_header('ETag', etag)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with site.lock:
+                        site.active -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/index.php?action=contents"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def site():
+    site = Site()
+    yield site
+    site.close()
+
+
+def crawl(url, concurrency=None, page_cache=None, scheduler=None, **kwargs):
+    scraper = Scraper(icd9_handlers(), page_cache=page_cache, scheduler=scheduler, **kwargs)
+    scraper.push(0, url)
+    if concurrency is None:
+        return list(scraper.run())
+    return list(scraper.run_async(concurrency))
+
+
+def codes(hierarchies):
+    return [[link['code'] for link in h] for h in hierarchies]
+
+
+def test_run_async_matches_run(site):
+    serial = crawl(site.url)
+    assert site.max_active == 1
+    n_pages = site.requests
+    # leaves of one page come out last link first
+    assert codes(serial)[:3] == [['001-100', '001-010', '001'],
+                                 ['001-100', '001-010', '002', '002.1'],
+                                 ['001-100', '001-010', '002', '002.0']]
+    site.requests = site.connections = site.max_active = 0
+    concurrent = crawl(site.url, concurrency=4)
+    assert concurrent == serial
+    assert site.requests == n_pages
+    assert 1 < site.max_active <= 4
+    # keep-alive: a pooled connection per worker, not one per page
+    assert site.connections <= 4
+
+
+def test_run_async_uses_cache(site):
+    scraper = Scraper(icd9_handlers())
+    scraper.push(0, site.url)
+    first = list(scraper.run_async(4))
+    requests_made = site.requests
+    scraper.push(0, site.url)
+    assert list(scraper.run_async(4)) == first
+    assert site.requests == requests_made
+
+
+def test_page_cache_serves_second_crawl(site, tmp_path):
+    path = str(tmp_path / 'pages.sqlite')
+    with SQLitePageCache(path) as cache:
+        first = crawl(site.url, page_cache=cache)
+        n_pages = site.requests
+        assert len(cache) == n_pages
+        page = cache.get(site.url)
+        assert b'class="lvl1"' in page.html and page.etag
+    site.requests = 0
+    with SQLitePageCache(path) as cache:
+        assert crawl(site.url, concurrency=4, page_cache=cache) == first
+    assert site.requests == 0
+
+
+def test_page_cache_revalidates_stale_pages(site, tmp_path):
+    path = str(tmp_path / 'pages.sqlite')
+    with SQLitePageCache(path) as cache:
+        first = crawl(site.url, page_cache=cache)
+    n_pages = site.requests
+    site.requests = 0
+    with SQLitePageCache(path, max_age=0, revalidate=True) as cache:
+        fetched_at = cache.get(site.url).fetched_at
+        assert crawl(site.url, page_cache=cache) == first
+        assert cache.get(site.url).fetched_at > fetched_at
+    assert site.requests == site.not_modified == n_pages
+
+
+TRICKY = ('<html><body><div class="lvl1  extra"><a href="a1"><div class="chapter">1. One\n (001-010)</div></a>'
+          '<div class="lvl2"><div class="section">Nested <b>bold</b> (002)</div></div></div>'
+          '<div class="lvl1\tother"><div class="chapter">2. Two (011-020)</div><a href="a2">x</a></div>'
+          '<P ID="x" class="Item two"><span data-k="1">003 Three<br>lines</span></P>'
+          '<ul><li class="item">004 Four</li></ul><li class="item">005 Five</li>'
+          '<div class="lvl3"><div class="dlvl"><textarea>006 <i>Six</i></textarea></div></div>'
+          '<div class="lvl-1"><div class="chapter">3. Not an item (021-030)</div></div></body></html>')
+
+
+def test_compiled_levels_match_handlers():
+    handlers = icd9_handlers()
+    compiled = CompiledLevels.from_handlers(handlers)
+    pages = list(make_site().values()) + [TRICKY]
+    for html in pages:
+        html = html.encode()
+        expected = [handler(pq(html)) for handler in handlers]
+        assert compiled.extract(html) == expected
+        for depth in range(len(handlers)):
+            assert Scraper(handlers).extract_links(html, depth) == \
+                Scraper(handlers, compiled=False).extract_links(html, depth)
+
+    text = lambda s: {'code': s}
+    custom = [levelFactory(asel, textsel, text) for asel, textsel in
+              [('div.lvl1.extra', 'div'), ('#x', 'span'), ('span[data-k]', 'span'),
+               ('ul > li.item', 'li'), ('P.Item.two', 'span'), ('li.item', 'li'), ('.lvl3', 'div.dlvl')]]
+    compiled = CompiledLevels.from_handlers(custom)
+    assert compiled.is_item[3] is None
+    expected = [handler(pq(TRICKY)) for handler in custom]
+    assert all(expected)
+    assert compiled.extract(TRICKY.encode()) == expected
+
+    assert CompiledLevels.from_handlers(handlers + [lambda dom: []]) is None
+    assert CompiledLevels.from_handlers(handlers + [levelFactory('li.item:first', 'li', text)]) is None
+
+
+def index(hierarchies):
+    return index_codes([codes_layout(h) for h in hierarchies])
+
+
+def test_incremental_skips_unchanged_subtrees(site, tmp_path):
+    with SQLitePageCache(str(tmp_path / 'pages.sqlite')) as cache:
+        old = crawl(site.url, page_cache=cache)
+        n_pages = site.requests
+        site.requests = 0
+        contents = 'index.php?action=contents'
+        site.pages[contents] = site.pages[contents].replace('Chapter 1 ', 'Chapter One ')
+        scraper = Scraper(icd9_handlers(), page_cache=cache, incremental=True)
+        scraper.push(0, site.url)
+        new = list(scraper.run())
+    # the contents page changed; the chapter pages answered 304 and
+    # everything below them came from the cache
+    assert site.requests == 4 and site.not_modified == 3
+    assert scraper.page_counts == {'changed': 1, 'unchanged': 3, 'skipped': n_pages - 4}
+    assert diff_codes(index(old), index(new)) == {
+        'added': [], 'removed': [], 'moved': [],
+        'redescribed': [{'code': '101-200', 'old': 'Chapter 1 ', 'new': 'Chapter One '}]}
+
+
+@pytest.mark.parametrize('etags', [True, False])
+def test_incremental_reparses_changed_pages(site, tmp_path, etags):
+    site.etags = etags
+    with SQLitePageCache(str(tmp_path / 'pages.sqlite')) as cache:
+        old = crawl(site.url, page_cache=cache)
+        n_pages = site.requests
+        site.requests = 0
+        section = 'index.php?action=child&chapter=0&section=1'
+        page = site.pages[section]
+        page = page.replace('<div class="lvl3"><div class="dlvl">011 Code 011</div></div>', '')
+        page = page.replace('>012 Code 012<', '>012 Code twelve<')
+        site.pages[section] = page + '<div class="lvl3"><div class="dlvl">019 Code 019</div></div>'
+        scraper = Scraper(icd9_handlers(), page_cache=cache, incremental=True, skip_unchanged_subtrees=False)
+        scraper.push(0, site.url)
+        new = list(scraper.run())
+    assert site.requests == n_pages
+    assert site.not_modified == (n_pages - 1 if etags else 0)
+    assert scraper.page_counts == {'changed': 1, 'unchanged': n_pages - 1}
+    assert new == crawl(site.url)
+    assert diff_codes(index(old), index(new)) == {
+        'added': [{'code': '019', 'descr': 'Code 019', 'parent': '011-020'}],
+        'removed': [{'code': '011', 'descr': 'Code 011', 'parent': '011-020'}],
+        'redescribed': [{'code': '012', 'old': 'Code 012', 'new': 'Code twelve'}],
+        'moved': []}
+
+
+def test_diff_codes_files(tmp_path):
+    old = [[{'code': None}, {'code': '001-009', 'descr': 'A'}, {'code': '001', 'descr': 'Cholera'}],
+           [{'code': None}, {'code': '010-019', 'descr': 'B'}, {'code': '011', 'descr': 'TB'}]]
+    new = [[{'code': None}, {'code': '001-009', 'descr': 'A'}, {'code': '011', 'descr': 'TB'}],
+           [{'code': None}, {'code': '010-019', 'descr': 'B'}, {'code': None}]]
+    paths = []
+    for name, hierarchies in [('old.json', old), ('new.json', new)]:
+        paths.append(str(tmp_path / name))
+        with open(paths[-1], 'w') as f:
+            json.dump(hierarchies, f)
+    assert diff_codes(*paths) == {
+        'added': [], 'redescribed': [],
+        'removed': [{'code': '001', 'descr': 'Cholera', 'parent': '001-009'}],
+        'moved': [{'code': '011', 'old': '010-019', 'new': '001-009'}]}
+
+
+class CrashingScraper(Scraper):
+    """Fails on the `crash_after`-th page fetch, like a crawl killed midway."""
+
+    def __init__(self, crash_after):
+        super().__init__(icd9_handlers())
+        self.fetches = 0
+        self.crash_after = crash_after
+
+    def fetch_links(self, session, depth, url):
+        self.fetches += 1
+        if self.fetches == self.crash_after:
+            raise RuntimeError('crash')
+        return super().fetch_links(session, depth, url)
+
+
+@pytest.mark.parametrize('concurrency', [1, 4])
+def test_crawl_resumes_from_checkpoint(site, tmp_path, concurrency):
+    expected = crawl(site.url)
+    n_pages = site.requests
+    jsonl = str(tmp_path / 'codes.jsonl')
+
+    scraper = CrashingScraper(crash_after=12)
+    scraper.push(0, site.url)
+    with pytest.raises(RuntimeError):
+        scraper.crawl_to(jsonl, checkpoint_every=5, concurrency=concurrency)
+    with open(f"{jsonl}.ckpt") as f:
+        checkpoint = json.load(f)
+    assert checkpoint['scraper']['pages_done'] == 10 and not checkpoint['done']
+
+    site.requests = 0
+    scraper = Scraper(icd9_handlers())
+    scraper.push(0, site.url)  # replaced by the checkpointed frontier
+    assert scraper.crawl_to(jsonl, checkpoint_every=5, concurrency=concurrency) == len(expected)
+    assert site.requests == n_pages - 10
+    with open(jsonl) as f:
+        assert [json.loads(line) for line in f] == expected
+
+    # a finished crawl is not resumed: running it again crawls from the start
+    site.requests = 0
+    scraper = Scraper(icd9_handlers())
+    scraper.push(0, site.url)
+    assert scraper.crawl_to(jsonl) == len(expected)
+    assert site.requests == n_pages
+    with open(jsonl) as f:
+        assert [json.loads(line) for line in f] == expected
+
+    codes = str(tmp_path / 'codes.json')
+    assert finalize(jsonl, codes) == len(expected)
+    with open(codes) as f:
+        hierarchies = json.load(f)
+    assert hierarchies[0] == [{'code': None}, {'code': '001-100', 'descr': 'Chapter 0 '},
+                              {'code': '001-010', 'descr': 'Section 0 '}, {'code': '001', 'descr': 'Code 001'}]
+    from simple_icd9cm.icd9cm import ICD9
+    tree = ICD9(codes)
+    assert [node.code for node in tree.children] == ['001-100', '101-200', '201-300']
+    assert tree.find('002.1').parent.code == '002'
+
+
+@pytest.mark.parametrize('concurrency', [None, 4])
+def test_scheduler_retries_flaky_pages(site, concurrency):
+    expected = crawl(site.url)
+    n_pages = site.requests
+    site.requests = 0
+    site.flaky = 2
+    scheduler = FetchScheduler(rate=200, burst=4, max_concurrency=4, retry=RetryPolicy(base=0.001))
+    assert crawl(site.url, concurrency, scheduler=scheduler) == expected
+    metrics = scheduler.metrics()
+    assert metrics['requests'] == site.requests == 3 * n_pages
+    assert metrics['retries'] == metrics['throttled'] == 2 * n_pages
+    assert metrics['failures'] == 0 and metrics['request_rate'] > 0
+    assert 1 <= metrics['concurrency_limit'] <= 4
+
+
+def test_scheduler_gives_up(site):
+    site.flaky = 5
+    scraper = Scraper(icd9_handlers(), scheduler=FetchScheduler(retry=RetryPolicy(retries=1, base=0.001)))
+    scraper.push(0, site.url)
+    with pytest.raises(requests.HTTPError):
+        list(scraper.run())
+    assert not scraper.cache
@@ -0,0 +1,80 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import json
+import pytest
+from scraper.pagecache import (DbmPageCache, Page, PageCache, SQLitePageCache, import_legacy,
+                               open_page_cache, read_bdb_hash)
+
+LEGACY = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scraper', 'cache'))
+CONTENTS = 'http://icd9cm.chrisendres.com/index.php?action=contents'
+
+
+def test_read_bdb_hash():
+    pages = {key.decode(): json.loads(value) for key, value in read_bdb_hash(LEGACY)}
+    assert len(pages) == 2041
+    assert pages[CONTENTS][0]['code'] == '001-139'
+    # big values (over a quarter page) come from overflow chains
+    assert max(len(json.dumps(v)) for v in pages.values()) > 3000
+    # every link with an href points at a cached page
+    host = 'http://icd9cm.chrisendres.com/'
+    assert all(host + link['href'] in pages for links in pages.values() for link in links if link['href'])
+
+
+def test_read_bdb_hash_rejects_other_files(tmp_path):
+    path = tmp_path / 'not-bdb'
+    path.write_bytes(b'\0' * 8192)
+    with pytest.raises(ValueError):
+        list(read_bdb_hash(str(path)))
+
+
+@pytest.mark.parametrize('name', ['pages.sqlite', 'pages'])
+def test_page_cache_roundtrip(tmp_path, name):
+    path = str(tmp_path / name)
+    with open_page_cache(path) as cache:
+        assert isinstance(cache, SQLitePageCache if name.endswith('.sqlite') else DbmPageCache)
+        page = Page('http://x/a', '[]', b'<html></html>', 100.0, '"e1"', None)
+        cache.put(page)
+        cache.put(Page('http://x/b', '[{"code": "001"}]'))
+        assert cache.get('http://x/a') == page
+        assert cache.get('http://x/b').html is None
+        assert cache.get('http://x/c') is None
+        assert 'http://x/b' in cache and len(cache) == 2
+    with open_page_cache(path) as cache:
+        assert sorted(cache.urls()) == ['http://x/a', 'http://x/b']
+        cache.touch('http://x/a', 200.0)
+        assert cache.get('http://x/a').fetched_at == 200.0
+
+
+def test_page_cache_backends_implement_the_storage():
+    class NoUrls(PageCache):
+        def get(self, url):
+            return None
+
+        def put(self, page):
+            pass
+
+    with pytest.raises(TypeError, match='urls'):
+        NoUrls()
+    with pytest.raises(TypeError):
+        PageCache()
+
+
+def test_page_cache_policy(tmp_path):
+    page = Page('http://x/a', '[]', None, 1000.0, '"e1"', 'Mon, 01 Jan 2024 00:00:00 GMT')
+    with SQLitePageCache(str(tmp_path / 'p.sqlite')) as cache:
+        assert cache.is_fresh(page, now=1e12)
+        assert cache.validators(page) == {}
+    with SQLitePageCache(str(tmp_path / 'p.sqlite'), max_age=60, revalidate=True) as cache:
+        assert cache.is_fresh(page, now=1059)
+        assert not cache.is_fresh(page, now=1060)
+        assert cache.validators(page) == {'If-None-Match': '"e1"',
+                                          'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT'}
+
+
+def test_import_legacy(tmp_path):
+    with SQLitePageCache(str(tmp_path / 'p.sqlite')) as cache:
+        assert import_legacy(cache, LEGACY, fetched_at=5.0) == 2041
+        page = cache.get(CONTENTS)
+        assert json.loads(page.links)[0]['code'] == '001-139'
+        assert page.html is None and page.fetched_at == 5.0
@@ -0,0 +1,148 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import random
+import pytest
+
+requests = pytest.importorskip('requests')
+from scraper.scheduler import AIMDLimiter, FetchScheduler, RetryPolicy, TokenBucket, retry_after
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def response(status, headers=None):
+    resp = requests.Response()
+    resp.status_code = status
+    resp.headers.update(headers or {})
+    return resp
+
+
+class FakeSession:
+    """Replays `outcomes` (responses or exceptions), advancing the clock by `latency` per call."""
+
+    def __init__(self, clock, outcomes, latency=0.1):
+        self.clock = clock
+        self.outcomes = list(outcomes)
+        self.latency = latency
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        self.clock.now += self.latency
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, burst=2, clock=clock, sleep=clock.sleep)
+    assert bucket.acquire() == 0 and bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(0.5)
+    clock.now += 10
+    bucket.pause(3)
+    assert bucket.acquire() == pytest.approx(3)
+
+
+def test_aimd_limiter():
+    limiter = AIMDLimiter(initial=2, minimum=1, maximum=4)
+    for _ in range(20):
+        limiter.acquire()
+        limiter.release(True, 0.1)
+    assert limiter.limit == 4
+    # a burst of failures halves the limit once per window
+    for _ in range(3):
+        limiter.acquire()
+    for _ in range(3):
+        limiter.release(False)
+    assert limiter.limit == 2
+    for _ in range(10):
+        limiter.acquire()
+        limiter.release(False)
+    assert limiter.limit == 1
+    # latency far above the fastest seen counts as congestion
+    limiter = AIMDLimiter(initial=4, maximum=8)
+    limiter.acquire(); limiter.release(True, 0.1)
+    limiter.acquire(); limiter.release(True, 5.0)
+    assert limiter.limit < 4
+
+
+def test_retry_policy_and_retry_after():
+    policy = RetryPolicy(base=1, cap=5, rng=random.Random(0))
+    for attempt in range(6):
+        assert 0 <= policy.backoff(attempt) <= min(5, 2 ** attempt)
+    assert retry_after(response(429, {'Retry-After': '7'})) == 7
+    assert retry_after(response(503, {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'})) == 0
+    assert retry_after(response(503)) is None
+
+
+def test_scheduler_retries_transient_failures():
+    clock = FakeClock()
+    session = FakeSession(clock, [requests.ConnectionError(), response(503), response(200)])
+    scheduler = FetchScheduler(retry=RetryPolicy(retries=3, base=1, rng=random.Random(0)),
+                               clock=clock, sleep=clock.sleep)
+    assert scheduler.fetch(session, 'http://x/a').status_code == 200
+    metrics = scheduler.metrics()
+    assert (metrics['requests'], metrics['retries'], metrics['errors'], metrics['throttled']) == (3, 2, 1, 1)
+    assert metrics['request_rate'] == pytest.approx(3 / clock.now)
+    assert len(clock.slept) == 2 and clock.slept[1] <= 2
+
+    # 404 is not retried; exhausted retries return the last response or raise
+    session = FakeSession(clock, [response(404)])
+    assert scheduler.fetch(session, 'http://x/b').status_code == 404
+    session = FakeSession(clock, [response(500)] * 4)
+    assert scheduler.fetch(session, 'http://x/c').status_code == 500
+    session = FakeSession(clock, [requests.Timeout()] * 4)
+    with pytest.raises(requests.Timeout):
+        scheduler.fetch(session, 'http://x/d')
+    assert scheduler.metrics()['failures'] == 2
+
+
+def test_scheduler_releases_slot_on_any_error():
+    clock = FakeClock()
+    scheduler = FetchScheduler(max_concurrency=1, clock=clock, sleep=clock.sleep,
+                               retry=RetryPolicy(retries=2, base=0.01, rng=random.Random(0)))
+    # a truncated body is transient
+    session = FakeSession(clock, [requests.exceptions.ChunkedEncodingError(), response(200)])
+    assert scheduler.fetch(session, 'http://x/a').status_code == 200
+    assert scheduler.metrics()['retries'] == 1
+    # other errors are raised at once, without leaking the concurrency slot
+    for error in [requests.TooManyRedirects(), requests.exceptions.ContentDecodingError(), ValueError()]:
+        session = FakeSession(clock, [error])
+        with pytest.raises(type(error)):
+            scheduler.fetch(session, 'http://x/b')
+        assert session.calls == 1
+        assert scheduler.limiter.in_flight == 0
+    session = FakeSession(clock, [response(200)])
+    assert scheduler.fetch(session, 'http://x/c').status_code == 200
+    assert scheduler.metrics()['errors'] == 4
+
+
+def test_scheduler_rate_limit_and_retry_after():
+    clock = FakeClock()
+    scheduler = FetchScheduler(rate=10, burst=1, max_concurrency=4, clock=clock, sleep=clock.sleep,
+                               retry=RetryPolicy(base=0.01, rng=random.Random(0)))
+    session = FakeSession(clock, [response(200)] * 20, latency=0)
+    for _ in range(20):
+        scheduler.fetch(session, 'http://x/a')
+    # 20 requests at 10/s on one host take ~1.9 s
+    assert clock.now == pytest.approx(1.9)
+    assert scheduler.bucket('http://y/').tokens == 1  # other hosts have their own bucket
+
+    session = FakeSession(clock, [response(429, {'Retry-After': '5'}), response(200)], latency=0)
+    start = clock.now
+    assert scheduler.fetch(session, 'http://x/a').status_code == 200
+    assert clock.now - start >= 5
+    assert scheduler.metrics()['throttled'] == 1
@@ -0,0 +1,121 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from simple_icd10cm.icd10cm import ICD10CM
+
+sample = [
+    {"code": "A00", "desc": "Cholera"},
+    {"code": "A00.0", "desc": "Cholera due to Vibrio cholerae 01, biovar cholerae", "parent": "A00"},
+    {"code": "A00.1", "desc": "Cholera due to Vibrio cholerae 01, biovar eltor", "parent": "A00"},
+    {"code": "A01", "desc": "Typhoid and paratyphoid fevers"},
+    {"code": "A01.0", "desc": "Typhoid fever", "parent": "A01"},
+    {"code": "A01.00", "desc": "Typhoid fever, unspecified", "parent": "A01.0"},
+    {"code": "A01.01", "desc": "Typhoid meningitis", "parent": "A01.0"},
+    {"code": "B99.9", "desc": "Unspecified infectious disease", "parent": "B99"},
+]
+
+def test_default_sample():
+    cm = ICD10CM()
+    assert cm.is_valid_item('A00')
+    assert cm.get_description('A00.0') == 'Cholera due to Vibrio cholerae 01, biovar cholerae'
+    assert cm.get_parent('A00.0') == 'A00'
+    assert cm.get_children('A00') == ['A00.0', 'A00.1']
+
+def test_children_and_depth():
+    cm = ICD10CM(sample)
+    assert cm.get_children('A01') == ['A01.0']
+    assert cm.get_children('A01.00') == []
+    # children of codes missing from the data are still reported
+    assert cm.get_children('B99') == ['B99.9']
+    assert cm.get_depth('A01') == 0
+    assert cm.get_depth('A01.01') == 2
+    assert cm.get_depth('B99.9') == 0
+    assert cm.get_depth('Z99') is None
+
+def test_ancestors_and_descendants():
+    cm = ICD10CM(sample)
+    assert cm.get_ancestors('A01.01') == ['A01.0', 'A01']
+    assert cm.get_ancestors('A01') == []
+    assert cm.get_descendants('A01') == ['A01.0', 'A01.00', 'A01.01']
+    assert cm.get_descendants('A00.1') == []
+    assert cm.get_descendants('Z99') == []
+    assert cm.is_descendant('A01.01', 'A01')
+    assert not cm.is_descendant('A01', 'A01')
+    assert not cm.is_descendant('A00.0', 'A01')
+    assert not cm.is_descendant('A01', 'A01.01')
+
+def test_data_and_code_map_are_assignable(tmp_path):
+    cm = ICD10CM()
+    cm.data = sample
+    assert cm.data is sample
+    assert cm.get_children('A01.0') == ['A01.00', 'A01.01']
+    assert cm.code_map['B99.9']['desc'] == 'Unspecified infectious disease'
+    write_order_file(tmp_path / 'order.txt')
+    loaded = ICD10CM.from_order_file(str(tmp_path / 'order.txt'))
+    assert loaded.is_valid_item('A00.0')
+    code_map = {row['code']: row for row in sample[3:5]}
+    loaded.code_map = code_map
+    assert loaded.code_map is code_map
+    assert not loaded.is_valid_item('A00.0') and loaded.get_description('A01.0') == 'Typhoid fever'
+    assert loaded.get_parent('A01.0') == 'A01' and loaded.get_children('A01') == ['A01.0']
+    # rows edited in place count once data is assigned again
+    rows = [dict(row) for row in sample]
+    cm.data = rows
+    rows[0]['desc'] = 'Cholera, edited'
+    cm.data = rows
+    assert cm.get_description('A00') == 'Cholera, edited' and cm.code_map['A00']['desc'] == 'Cholera, edited'
+
+order_rows = [
+    ("A00", 0, "Cholera", "Cholera"),
+    ("A000", 1, "Cholera due to Vibrio cholerae 01, biovar cholerae",
+     "Cholera due to Vibrio cholerae 01, biovar cholerae"),
+    ("A001", 1, "Cholera due to Vibrio cholerae 01, biovar eltor",
+     "Cholera due to Vibrio cholerae 01, biovar eltor"),
+    ("S00", 0, "Superficial injury of head", "Superficial injury of head"),
+    ("S0000", 0, "Unsp superficial injury of scalp", "Unspecified superficial injury of scalp"),
+    ("S0000XA", 1, "Unsp superficial injury of scalp, initial encounter",
+     "Unspecified superficial injury of scalp, initial encounter"),
+]
+
+def write_order_file(path, rows=order_rows):
+    with open(path, 'w') as f:
+        for i, (code, billable, short, long) in enumerate(rows, 1):
+            f.write(f"{i:05d} {code:<7} {billable} {short:<60} {long}\n")
+
+def test_from_order_file(tmp_path):
+    path = tmp_path / 'icd10cm_order.txt'
+    write_order_file(path)
+    cm = ICD10CM.from_order_file(str(path))
+    assert cm.get_all_codes() == ['A00', 'A00.0', 'A00.1', 'S00', 'S00.00', 'S00.00XA']
+    assert cm.get_description('S00.00') == 'Unspecified superficial injury of scalp'
+    # parents come from the code structure, skipping the X placeholder
+    assert cm.get_parent('S00.00XA') == 'S00.00'
+    assert cm.get_parent('S00.00') == 'S00'
+    assert cm.get_parent('A00') is None
+    assert cm.get_descendants('S00') == ['S00.00', 'S00.00XA']
+    assert cm.code_map['A00.1'] == {"code": "A00.1", "parent": "A00",
+                                    "desc": "Cholera due to Vibrio cholerae 01, biovar eltor"}
+    short = ICD10CM.from_order_file(str(path), use_cache=False, long_descriptions=False)
+    assert short.get_description('S00.00') == 'Unsp superficial injury of scalp'
+
+def test_order_file_cache(tmp_path):
+    path = tmp_path / 'icd10cm_order.txt'
+    write_order_file(path)
+    parsed = ICD10CM.from_order_file(str(path))
+    assert os.path.exists(f"{path}.cache")
+    cached = ICD10CM.from_order_file(str(path))
+    for cm in (parsed, cached):
+        assert cm.get_all_codes() == parsed.get_all_codes()
+        assert cm.get_children('A00') == ['A00.0', 'A00.1']
+        assert cm.get_ancestors('S00.00XA') == ['S00.00', 'S00']
+        assert cm.get_depth('S00.00XA') == 2
+        assert cm.is_descendant('S00.00XA', 'S00')
+        assert cm.data == parsed.data
+    # a changed order file invalidates the cache
+    write_order_file(path, order_rows[:3])
+    os.utime(path, ns=(0, 0))
+    assert ICD10CM.from_order_file(str(path)).get_all_codes() == ['A00', 'A00.0', 'A00.1']
+    # a corrupt cache is ignored
+    with open(f"{path}.cache", 'wb') as f:
+        f.write(b'garbage')
+    assert ICD10CM.from_order_file(str(path)).get_all_codes() == ['A00', 'A00.0', 'A00.1']
@@ -1,6 +1,43 @@
+import json
 import os
+from collections.abc import Sequence
 import pytest
 from simple_icd9cm.icd9cm import ICD9
+from simple_icd9cm.compact import CompactICD9
+from simple_icd9cm.snapshot import SnapshotError, build_snapshot, load_snapshot, read_descriptions
+from simple_icd9cm.descriptions import DescriptionStore
+
+DESCRIPTIONS = os.path.join(os.path.dirname(__file__), '..', 'descriptions.csv')
+
+sample_hierarchy = [
+    [
+        {'code': None},
+        {'code': '001-139', 'descr': 'Infectious and Parasitic Diseases'},
+        {'code': '001-009', 'descr': 'Intestinal Infectious Diseases'},
+        {'code': '001', 'descr': 'Cholera'},
+        {'code': '001.0', 'descr': 'Cholera due to vibrio cholerae'}
+    ],
+    [
+        {'code': None},
+        {'code': '001-139', 'descr': 'Infectious and Parasitic Diseases'},
+        {'code': '001-009', 'descr': 'Intestinal Infectious Diseases'},
+        {'code': '001', 'descr': 'Cholera'},
+        {'code': '001.1', 'descr': 'Cholera due to vibrio cholerae el tor'}
+    ],
+    [
+        {'code': None},
+        {'code': '001-139', 'descr': 'Infectious and Parasitic Diseases'},
+        {'code': '001-009', 'descr': 'Intestinal Infectious Diseases'},
+        {'code': '002', 'descr': 'Typhoid and paratyphoid fevers'},
+        {'code': '002.0', 'descr': 'Typhoid fever'}
+    ]
+]
+
+@pytest.fixture
+def sample_codes(tmp_path):
+    path = tmp_path / 'codes.json'
+    path.write_text(json.dumps(sample_hierarchy))
+    return str(path)
 
 def test_icd9_find_and_description():
     icd9 = ICD9()
@@ -15,7 +52,7 @@ def test_icd9_search():
 
 def test_icd9_children():
     icd9 = ICD9()
-    node = icd9.find('001')
+    node = icd9.find('001-139')
     children_codes = [child.code for child in node.children]
     assert '001-009' in children_codes
 
@@ -36,4 +73,293 @@ def test_find_codes_for_note():
     results = icd9.find_codes_for_note(note)
     codes = [code for code, desc in results]
     assert '001.0' in codes
-    assert any('cholera' in desc.lower() for code, desc in results) 
\ No newline at end of file
+    assert any('cholera' in desc.lower() for code, desc in results) 
+
+def test_find_prefers_exact_code(sample_codes):
+    icd9 = ICD9(sample_codes)
+    assert icd9.find('001').description == 'Cholera'
+    # partial codes still fall back to the first substring match
+    assert icd9.find('001.').code == '001.0'
+    assert icd9.find('001').find('002.0') is None
+
+def test_find_many(sample_codes):
+    icd9 = ICD9(sample_codes)
+    nodes = icd9.find_many(['002.0', '001.1', '999.9'])
+    assert [n.code if n else None for n in nodes] == ['002.0', '001.1', None]
+
+def test_reparented_code_is_numbered_once(tmp_path):
+    moved = [{'code': None}, {'code': '001-139', 'descr': 'Infectious and Parasitic Diseases'},
+             {'code': '001-009', 'descr': 'Intestinal Infectious Diseases'},
+             {'code': '002', 'descr': 'Typhoid and paratyphoid fevers'},
+             {'code': '001.1', 'descr': 'Cholera due to vibrio cholerae el tor'}]
+    path = tmp_path / 'codes.json'
+    path.write_text(json.dumps(sample_hierarchy + [moved]))
+    icd9 = ICD9(str(path))
+    cholera = icd9.find('001.1')
+    assert cholera.parent.code == '002'
+    assert [n.code for n in icd9.leaves] == ['001.0', '002.0', '001.1']
+    assert icd9.find('002').has_descendant(cholera)
+    assert not icd9.find('001').has_descendant(cholera)
+    assert icd9.find('001').has_descendant(icd9.find('001.0'))
+    assert [n.code for n in icd9.find('001').leaves] == ['001.0']
+
+def test_compact_matches_object_tree(sample_codes):
+    tree = ICD9(sample_codes)
+    compact = CompactICD9(sample_codes)
+    assert [str(n) for n in compact.walk()] == [str(n) for n in tree.walk()]
+    assert compact.codes == tree.codes
+    cholera = compact.find('001.1')
+    assert cholera.description == 'Cholera due to vibrio cholerae el tor'
+    assert [n.code for n in cholera.parents] == ['ROOT', '001-139', '001-009', '001', '001.1']
+    assert cholera.parent.code == '001'
+    assert [n.code for n in cholera.siblings] == ['001.0', '001.1']
+    assert compact.find('001').subtree_size == 3
+    assert compact.find('001').has_descendant(cholera)
+    assert compact.find('002').find('001.1') is None
+    assert compact.find('001') == compact.find('001')
+
+def test_snapshot_round_trip(sample_codes, tmp_path):
+    snap = str(tmp_path / 'codes.snap')
+    build_snapshot(sample_codes, snap)
+    tree = ICD9(sample_codes)
+    for loaded in (ICD9.from_snapshot(snap), CompactICD9.from_snapshot(snap)):
+        assert [(str(n), n.description) for n in loaded.walk()] == \
+            [(str(n), n.description) for n in tree.walk()]
+        assert loaded.find('001.1').parent.code == '001'
+    assert isinstance(CompactICD9.from_snapshot(snap)._store.strings, Sequence)
+
+def test_snapshot_merges_descriptions(tmp_path):
+    codes = tmp_path / 'codes.json'
+    codes.write_text(json.dumps([[{'code': None}, {'code': '001'}, {'code': '001.0'}]]))
+    descriptions = tmp_path / 'descriptions.csv'
+    descriptions.write_text('icd9code,long_description,short_description\n'
+                            '001.0,Cholera due to vibrio cholerae,Cholera d/t vib cholerae\n')
+    snap = str(tmp_path / 'codes.snap')
+    build_snapshot(str(codes), snap, str(descriptions))
+    tree = ICD9.from_snapshot(snap)
+    assert tree.find('001.0').description == 'Cholera due to vibrio cholerae'
+    assert tree.find('001').description == '001'
+
+def test_read_descriptions_shipped_file():
+    descriptions = read_descriptions(os.path.join(os.path.dirname(__file__), '..', 'descriptions.csv'))
+    assert descriptions['001.0'] == 'Cholera due to vibrio cholerae'
+    assert descriptions['041.3'].startswith("Friedl\xe4nder's bacillus infection")
+
+def test_snapshot_stale_or_corrupt_falls_back_to_json(sample_codes, tmp_path):
+    snap = tmp_path / 'codes.snap'
+    build_snapshot(sample_codes, str(snap))
+    extended = sample_hierarchy + [[{'code': None}, {'code': '001-139'}, {'code': '001-009'},
+                                    {'code': '003', 'descr': 'Other salmonella infections'}]]
+    with open(sample_codes, 'w') as f:
+        json.dump(extended, f)
+    os.utime(sample_codes, ns=(0, 0))
+    with pytest.raises(SnapshotError):
+        load_snapshot(str(snap))
+    assert ICD9.from_snapshot(str(snap)).find('003') is not None
+
+    data = bytearray(snap.read_bytes())
+    data[-1] ^= 0xff
+    snap.write_bytes(bytes(data))
+    with pytest.raises(SnapshotError, match='checksum'):
+        load_snapshot(str(snap), check_sources=False)
+    assert CompactICD9.from_snapshot(str(snap), sample_codes).find('003') is not None
+
+def test_registry_shares_one_lazy_tree(sample_codes):
+    from copy import deepcopy
+    import pickle
+    from simple_icd9cm.registry import ICD9Registry
+
+    registry = ICD9Registry()
+    first = registry.get(sample_codes)
+    second = registry.get(sample_codes)
+    assert registry.stats['loads'] == 0
+    assert first.find('001.0').description == 'Cholera due to vibrio cholerae'
+    assert second.find('002.0') is not None
+    assert first._tree is second._tree
+    assert registry.stats == {'loads': 1, 'hits': 1, 'reloads': 0}
+    assert deepcopy(first) is first
+    assert isinstance(first, ICD9)
+    with pytest.raises(AttributeError):
+        first.children = []
+    assert pickle.loads(pickle.dumps(first)).find('001.0').code == '001.0'
+
+def test_registry_reloads_changed_file(sample_codes):
+    from simple_icd9cm.registry import ICD9Registry
+
+    registry = ICD9Registry()
+    old = registry.load(sample_codes)
+    with open(sample_codes, 'w') as f:
+        json.dump(sample_hierarchy[:1], f)
+    os.utime(sample_codes, ns=(0, 0))
+    new = registry.load(sample_codes)
+    assert new is not old and new.find('002.0') is None
+    assert registry.stats['reloads'] == 1
+
+def test_find_codes_for_note_matches_regex_scan(sample_codes):
+    import re
+    icd9 = ICD9(sample_codes)
+    notes = ['Patient diagnosed with CHOLERA DUE TO VIBRIO CHOLERAE EL TOR; typhoid fever ruled out.',
+             'No findings.', 'typhoid feverish, cholera due to vibrio choleraeic']
+    for note in notes:
+        expected = [(leaf.code, leaf.description) for leaf in icd9.leaves
+                    if re.search(re.escape(leaf.description.lower()), note.lower())]
+        assert icd9.find_codes_for_note(note) == expected
+        assert CompactICD9(sample_codes).find_codes_for_note(note) == expected
+    assert icd9.matcher is icd9.matcher
+
+def test_find_codes_for_note_modes(sample_codes):
+    icd9 = ICD9(sample_codes)
+    note = 'cholera due to vibrio cholerae el tor, typhoid feverish'
+    codes = [code for code, _ in icd9.find_codes_for_note(note)]
+    assert codes == ['001.0', '001.1', '002.0']
+    longest = [code for code, _ in icd9.find_codes_for_note(note, longest_only=True)]
+    assert longest == ['001.1', '002.0']
+    bounded = [code for code, _ in icd9.find_codes_for_note(note, word_boundary=True)]
+    assert bounded == ['001.0', '001.1']
+
+def test_substring_index_matches_scan(sample_codes):
+    icd9 = ICD9(sample_codes)
+    index = icd9.substring_index
+    assert index is icd9.substring_index
+    for keywords in (['cholera'], ['typhoid', 'el tor'], ['vib'], ['ph'], ['o'], ['r, '],
+                     ['x'], [''], ['CHOLERAE'], []):
+        expected = [leaf.code for leaf in icd9.leaves
+                    if any(k and k.lower() in leaf.description.lower() for k in keywords)]
+        assert index.search(keywords) == expected, keywords
+
+def test_bm25_index_scores_and_ranks(sample_codes):
+    import math
+    icd9 = ICD9(sample_codes)
+    index = icd9.bm25_index
+    assert index is icd9.bm25_index and len(index) == 3
+    note = 'Cholera, vibrio cholerae el tor. Cholera confirmed.'
+    docs = [leaf.description.lower().split() for leaf in icd9.leaves]
+    avg = sum(map(len, docs)) / len(docs)
+    expected = []
+    for doc in docs:
+        score = 0.0
+        for term in ['cholera', 'vibrio', 'cholerae', 'el', 'tor', 'cholera', 'confirmed']:
+            df = sum(term in d for d in docs)
+            tf = doc.count(term)
+            if tf:
+                idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+                score += idf * tf * 2.2 / (tf + 1.2 * (0.25 + 0.75 * len(doc) / avg))
+        expected.append(score)
+    assert index.scores(note).tolist() == pytest.approx(expected, rel=1e-5)
+    assert [code for code, _ in index.search(note)] == ['001.1', '001.0']
+    assert index.search(note, k=1)[0][1] == pytest.approx(expected[1], rel=1e-5)
+    assert index.search('appendicitis') == []
+    assert [code for code, _ in index.rank('typhoid fever', ['001.0', 'V01', '002.0', '001.1'])] == \
+        ['002.0', '001.0', '001.1', 'V01']
+    assert CompactICD9(sample_codes).bm25_index.search(note) == index.search(note)
+
+    icd9.add([{'code': None}, {'code': '003', 'descr': 'Other salmonella infections'},
+              {'code': '003.0', 'descr': 'Salmonella gastroenteritis'}])
+    assert icd9.bm25_index.search('salmonella')[0][0] == '003.0'
+
+def test_dense_index_builds_incrementally_and_searches(sample_codes, tmp_path):
+    np = pytest.importorskip('numpy')
+    from simple_icd9cm.vectorindex import DenseIndex, HashedNgramEmbedder, ids_path
+    path = str(tmp_path / 'leaves.npy')
+    embedder = HashedNgramEmbedder(dim=64)
+    index = DenseIndex.open(path, embedder, sample_codes)
+    assert index.stats == {'reused': 0, 'embedded': 3, 'removed': 0}
+    assert index.codes == ['001.0', '001.1', '002.0'] and index.matrix.shape == (3, 64)
+    assert isinstance(index.matrix, np.memmap)
+    hits = index.search(['typhoidal fevers', 'choleric vibrios, el tor biotype'], k=2)
+    assert [code for code, _ in hits[0]][:1] == ['002.0'] and hits[1][0][0] == '001.1'
+    assert hits[1][0][1] >= hits[1][1][1] and len(hits[1]) == 2
+    assert DenseIndex.open(path, embedder, sample_codes).stats == {}  # codes.json unchanged: no rebuild
+
+    changed = json.loads(json.dumps(sample_hierarchy))
+    changed[2][-1]['descr'] = 'Typhoid fever, unspecified'
+    changed[1][-1]['code'] = '001.9'
+    with open(sample_codes, 'w') as f:
+        json.dump(changed, f)
+    index = DenseIndex.open(path, embedder, sample_codes)
+    assert index.stats == {'reused': 1, 'embedded': 2, 'removed': 2}
+    assert index.codes == ['001.0', '001.9', '002.0']
+    fresh = DenseIndex.build(str(tmp_path / 'fresh.npy'), ICD9(sample_codes).iter_leaves(), embedder)
+    assert np.allclose(index.matrix, fresh.matrix)
+
+    # an id map that does not match the matrix, or another embedder, rebuilds everything
+    with open(ids_path(path)) as f:
+        meta = json.load(f)
+    meta['codes'].pop()
+    with open(ids_path(path), 'w') as f:
+        json.dump(meta, f)
+    assert DenseIndex.open(path, embedder, sample_codes).stats['embedded'] == 3
+    assert DenseIndex.open(path, HashedNgramEmbedder(dim=32), sample_codes).stats['embedded'] == 3
+
+def test_find_codes_for_notes_streams_in_order(sample_codes):
+    from itertools import count, islice
+    icd9 = ICD9(sample_codes)
+    notes = ['cholera due to vibrio cholerae', 'typhoid fever', 'nothing', 'Typhoid fever, cholera'] * 5
+    expected = [icd9.find_codes_for_note(note) for note in notes]
+    assert list(icd9.find_codes_for_notes(notes)) == expected
+    assert list(icd9.find_codes_for_notes(iter(notes), workers=2, chunksize=3)) == expected
+
+    endless = (notes[i % len(notes)] for i in count())
+    assert list(islice(icd9.find_codes_for_notes(endless, workers=2, chunksize=2), 6)) == expected[:6]
+
+def test_code_index_orders_numeric_v_and_e_codes(tmp_path):
+    from simple_icd9cm.codeindex import code_key
+    assert sorted(['E800', 'V01.1', '250.1', '250', '250.01', '001.0', 'V01'], key=code_key) == \
+        ['001.0', '250', '250.01', '250.1', 'V01', 'V01.1', 'E800']
+
+    def chain(*links):
+        return [{'code': None}] + [{'code': c} for c in links]
+    codes = tmp_path / 'codes.json'
+    codes.write_text(json.dumps([
+        chain('240-279', '249-259', '250', '250.0', '250.01'),
+        chain('240-279', '249-259', '250', '250.1'),
+        chain('240-279', '249-259', '251', '251.0'),
+        chain('390-459', '401-405', '401', '401.9'),
+        chain('V01-V91', 'V01-V09', 'V01', 'V01.1'),
+        chain('E800-E999', 'E800-E807', 'E800', 'E800.0'),
+    ]))
+    for icd9 in (ICD9(str(codes)), CompactICD9(str(codes))):
+        assert [n.code for n in icd9.prefix_search('250.')] == ['250.0', '250.01', '250.1']
+        assert [n.code for n in icd9.prefix_search('25')] == ['250', '250.0', '250.01', '250.1', '251', '251.0']
+        assert [n.code for n in icd9.range_search('250.0', '250.1')] == ['250.0', '250.01', '250.1']
+        assert [n.code for n in icd9.range_search('390-459')] == ['401', '401.9']
+        assert [n.code for n in icd9.range_search('401.9', 'V01')] == ['401.9', 'V01', 'V01.1']
+        assert [n.code for n in icd9.containing_range('401.9')] == ['390-459', '401-405']
+        assert [n.code for n in icd9.containing_range('E800.0')] == ['E800-E999', 'E800-E807']
+        assert icd9.containing_range('300') == []
+    with pytest.raises(ValueError):
+        ICD9(str(codes)).range_search('ROOT', '250')
+
+def test_description_store_lookups():
+    store = DescriptionStore(DESCRIPTIONS)
+    assert store._keys is None  # nothing read until the first lookup
+    assert store.get('001.0') == ('Cholera due to vibrio cholerae', 'Cholera d/t vib cholerae')
+    assert store.get('0010') == store.get(' 001.0 ')
+    assert store.long('e800.0').startswith('Railway accident')
+    assert store.short('V010') == 'Cholera contact'
+    assert store.long('041.3').startswith('Friedl\u00e4nder')
+    assert store.get('001') is None and '001-139' not in store
+    full = read_descriptions(DESCRIPTIONS)
+    assert len(store) == len(full) == 14567
+    assert all(store.long(code) == descr for code, descr in full.items())
+    assert sorted(store) == sorted(full)
+    store.close()
+
+def test_icd9_resolves_descriptions_lazily(tmp_path):
+    codes = tmp_path / 'codes.json'
+    codes.write_text(json.dumps([[{'code': None}, {'code': '001', 'descr': 'Cholera'}, {'code': '001.0'}],
+                                 [{'code': None}, {'code': 'V01'}, {'code': 'V01.0', 'descr': 'Own text'}]]))
+    tree = ICD9(str(codes), descriptions=DESCRIPTIONS)
+    assert tree.descriptions._keys is None
+    assert tree.find('001.0').description == 'Cholera due to vibrio cholerae'
+    assert tree.find('001.0').short_description == 'Cholera d/t vib cholerae'
+    # descriptions from codes.json win; codes missing from the file keep theirs
+    assert tree.find('V01.0').description == 'Own text'
+    assert tree.find('V01.0').long_description == 'Contact with or exposure to cholera'
+    assert tree.find('V01').description == 'V01'
+    assert tree.find('001').long_description is None
+    assert ICD9(str(codes)).find('001.0').description == '001.0'
+    snap = str(tmp_path / 'codes.snap')
+    build_snapshot(str(codes), snap)
+    assert ICD9.from_snapshot(snap, descriptions=tree.descriptions).find('001.0').description == \
+        'Cholera due to vibrio cholerae'